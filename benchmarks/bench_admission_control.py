@@ -0,0 +1,125 @@
+"""
+流量制御 (AdmissionController) の負荷テスト (ネットワーク不要)
+
+クォータ (RPM / TPM) を超えると 429 を返すモックサーバーに、N人が一斉にリクエストを送る。
+短時間で計測するため、クォータの「1分」を --window 秒に縮めて模擬する。
+
+- baseline: 制御なし。429 を受けたらジッター付き指数バックオフで再試行する (従来の一斉再試行)
+- admission: RateLimitedBackend 経由で送る (クォータと同じ RPM / TPM を設定)
+
+完了数/秒 がクォータの上限 (RPM / window) に張り付き、429 が 0 件であることを確認する。
+
+    python -m benchmarks.bench_admission_control --users 40 --requests 5 --rpm 60 --window 6 --latency 0.5
+"""
+import argparse
+import collections
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from modules.llm_backends import MockBackend
+from modules.rate_limiter import (
+    RESPONSE_TOKENS_ESTIMATE,
+    AdmissionController,
+    RateLimitedBackend,
+    estimate_history_tokens,
+    estimate_tokens,
+    is_rate_limit_error,
+)
+
+
+class QuotaExceeded(Exception):
+    code = 429
+
+
+class QuotaBackend:
+    """
+    直近 window 秒のリクエスト数・トークン数がクォータを超えたら 429 を返すバックエンド
+    """
+    def __init__(self, inner, rpm: float, tpm: float, tokens_per_request: int, window: float = 60.0):
+        self.inner = inner
+        self.window_seconds = window
+        self.rpm = rpm
+        self.tpm = tpm
+        self.tokens_per_request = tokens_per_request
+        self.window = collections.deque()
+        self.lock = threading.Lock()
+        self.rejected = 0
+
+    def start_chat(self, history=None, system_instruction=None):
+        return self.inner.start_chat(history=history, system_instruction=system_instruction)
+
+    def send_message(self, chat_session, message, stream=False):
+        now = time.monotonic()
+        with self.lock:
+            while self.window and now - self.window[0] >= self.window_seconds:
+                self.window.popleft()
+            over_rpm = len(self.window) + 1 > self.rpm
+            over_tpm = self.tpm and (len(self.window) + 1) * self.tokens_per_request > self.tpm
+            if over_rpm or over_tpm:
+                self.rejected += 1
+                raise QuotaExceeded("429 RESOURCE_EXHAUSTED")
+            self.window.append(now)
+        return self.inner.send_message(chat_session, message, stream=stream)
+
+
+def run_user(backend, requests: int, message: str, retry: bool):
+    completed = 0
+    for _ in range(requests):
+        attempt = 0
+        while True:
+            try:
+                chat = backend.start_chat(history=[])
+                backend.send_message(chat, message)
+                completed += 1
+                break
+            except Exception as e:
+                if not (retry and is_rate_limit_error(e)) or attempt >= 8:
+                    break
+                time.sleep(random.uniform(0, min(8.0, 0.25 * 2 ** attempt)))
+                attempt += 1
+    return completed
+
+
+def run(label: str, users: int, requests: int, rpm: float, tpm: float, window: float, latency: float,
+        use_admission: bool):
+    message = "回答です。" * 50
+    tokens_per_request = estimate_history_tokens([]) + estimate_tokens(message) + RESPONSE_TOKENS_ESTIMATE
+    quota = QuotaBackend(MockBackend(script=["応答"], first_token_delay=latency), rpm, tpm, tokens_per_request,
+                         window=window)
+    backend = quota
+    if use_admission:
+        # 縮めた時間軸に合わせて、429 後の停止時間も同じ比率で短くする
+        controller = AdmissionController(max_concurrent=users, requests_per_minute=rpm, tokens_per_minute=tpm,
+                                         quota_window=window)
+        backend = RateLimitedBackend(quota, controller, throttle_seconds=10.0 * window / 60.0)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=users) as executor:
+        completed = sum(executor.map(lambda _: run_user(backend, requests, message, not use_admission), range(users)))
+    elapsed = time.perf_counter() - started
+
+    ceiling = rpm / window
+    if tpm:
+        ceiling = min(ceiling, tpm / window / tokens_per_request)
+    print(f"{label:<10} completed={completed}/{users * requests} errors_429={quota.rejected:<5} "
+          f"throughput={completed / elapsed:6.2f}/s ceiling={ceiling:6.2f}/s elapsed={elapsed:6.1f}s")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=40)
+    parser.add_argument("--requests", type=int, default=5, help="requests per user")
+    parser.add_argument("--rpm", type=float, default=60, help="requests allowed per window")
+    parser.add_argument("--tpm", type=float, default=0, help="tokens allowed per window")
+    parser.add_argument("--window", type=float, default=6.0, help="length of the simulated quota minute (sec)")
+    parser.add_argument("--latency", type=float, default=0.5, help="simulated response time (sec)")
+    args = parser.parse_args()
+
+    for label, use_admission in (("baseline", False), ("admission", True)):
+        run(label, args.users, args.requests, args.rpm, args.tpm, args.window, args.latency, use_admission)
+
+
+if __name__ == "__main__":
+    main()
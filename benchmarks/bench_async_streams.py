@@ -0,0 +1,167 @@
+"""
+同時に応答を待つセッション数に対するスレッド数・メモリ・レイテンシの比較 (モックのストリームを使用、ネットワーク不要)
+
+- threaded: 同期のストリームを ResilientBackend 経由で読む (試行ごとに読み込み用のスレッドを1本使う。従来の動作)
+- async:    非同期のストリームを ResilientBackend 経由で共有のイベントループで読む (GEMINI_ASYNC=true の動作)
+
+どちらも各セッションのスクリプトスレッドを1本ずつ模擬し、全セッションが同時に送信する。
+各構成は新しいプロセスで実行し、実行中のスレッド数と RSS の最大値 (開始前との差)、
+最初のチャンクまでの時間と、応答全体の時間のうち模擬した生成時間を超えた分 (overhead) の p50 / p99 を表示する。
+
+    python -m benchmarks.bench_async_streams --sessions 50 200 500 [--chunks 40 --chunk-interval 0.025]
+"""
+import argparse
+import asyncio
+import json
+import subprocess
+import sys
+import threading
+import time
+
+from modules.async_bridge import get_bridge
+from modules.gemini_client import ResilienceConfig, ResilientBackend
+from modules.llm_backends import MockChat, MockChunk
+
+
+class ScheduledMockBackend:
+    """
+    一定の間隔でチャンクを返すモック (同期版)。遅延が積み重ならないよう、各チャンクの到着時刻を送信時点から決める
+    """
+    def __init__(self, text: str, first_token_delay: float, chunk_size: int, chunk_interval: float):
+        self.text = text
+        self.first_token_delay = first_token_delay
+        self.chunk_size = chunk_size
+        self.chunk_interval = chunk_interval
+
+    def start_chat(self, history=None, system_instruction: str = None):
+        return MockChat(history, system_instruction)
+
+    def schedule(self):
+        started = time.monotonic()
+        for index, i in enumerate(range(0, len(self.text), self.chunk_size)):
+            yield started + self.first_token_delay + index * self.chunk_interval, MockChunk(self.text[i:i + self.chunk_size])
+
+    def send_message(self, chat_session, message: str, stream: bool = False):
+        for due, chunk in self.schedule():
+            time.sleep(max(0.0, due - time.monotonic()))
+            yield chunk
+
+
+class AsyncMockBackend(ScheduledMockBackend):
+    """非同期版 (GeminiClient の async_mode と同じく astream を持つ)"""
+    async_mode = True
+
+    async def astream(self, chat_session, message: str):
+        for due, chunk in self.schedule():
+            await asyncio.sleep(max(0.0, due - time.monotonic()))
+            yield chunk
+
+    def send_message(self, chat_session, message: str, stream: bool = False):
+        return get_bridge().stream(self.astream(chat_session, message))
+
+
+def rss_kb() -> int:
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1])
+    return 0
+
+
+def percentile(values, q: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def run_child(mode: str, sessions: int, first_token_delay: float, chunks: int, chunk_interval: float) -> dict:
+    chunk_size = 20
+    text = "あ" * (chunk_size * chunks)
+    if mode == "async":
+        inner = AsyncMockBackend(text, first_token_delay, chunk_size, chunk_interval)
+        get_bridge().loop  # ループのスレッドは起動済みの状態から数える
+    else:
+        inner = ScheduledMockBackend(text, first_token_delay, chunk_size, chunk_interval)
+    backend = ResilientBackend(inner, ResilienceConfig(first_token_timeout=60.0, idle_timeout=60.0))
+    ideal = first_token_delay + (chunks - 1) * chunk_interval
+
+    baseline_threads = threading.active_count()
+    baseline_rss = rss_kb()
+    peak = {"threads": 0, "rss": 0}
+    sampling = threading.Event()
+
+    def sample():
+        while not sampling.wait(0.01):
+            peak["threads"] = max(peak["threads"], threading.active_count())
+            peak["rss"] = max(peak["rss"], rss_kb())
+
+    ttft = []
+    overhead = []
+    start = threading.Barrier(sessions + 1)
+
+    def session():
+        # Streamlit のスクリプトスレッド: 応答をチャンクごとに受け取って描画する
+        start.wait()
+        started = time.perf_counter()
+        first = None
+        chat = backend.start_chat(history=[], system_instruction="system")
+        for _ in backend.send_message(chat, "回答", stream=True):
+            if first is None:
+                first = time.perf_counter() - started
+        ttft.append(first * 1000)
+        overhead.append((time.perf_counter() - started - ideal) * 1000)
+
+    sampler = threading.Thread(target=sample, daemon=True)
+    sampler.start()
+    workers = [threading.Thread(target=session) for _ in range(sessions)]
+    for worker in workers:
+        worker.start()
+    start.wait()
+    for worker in workers:
+        worker.join()
+    sampling.set()
+    sampler.join()
+
+    return {
+        "mode": mode,
+        "sessions": sessions,
+        # サンプラー自身のスレッドは除く
+        "threads": peak["threads"] - baseline_threads - 1,
+        "rss_mb": (peak["rss"] - baseline_rss) / 1024,
+        "ttft_p50": percentile(ttft, 0.5),
+        "ttft_p99": percentile(ttft, 0.99),
+        "overhead_p50": percentile(overhead, 0.5),
+        "overhead_p99": percentile(overhead, 0.99),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sessions", type=int, nargs="+", default=[50, 200, 500])
+    parser.add_argument("--first-token-delay", type=float, default=0.5)
+    parser.add_argument("--chunks", type=int, default=40)
+    parser.add_argument("--chunk-interval", type=float, default=0.025)
+    parser.add_argument("--child", choices=("threaded", "async"), default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        result = run_child(args.child, args.sessions[0], args.first_token_delay, args.chunks, args.chunk_interval)
+        print(json.dumps(result))
+        return
+
+    print(f"{'mode':<9} {'sessions':>8} {'threads':>8} {'rss_mb':>8} {'ttft_p50':>9} {'ttft_p99':>9} "
+          f"{'overhead_p50':>13} {'overhead_p99':>13}")
+    for sessions in args.sessions:
+        for mode in ("threaded", "async"):
+            output = subprocess.run(
+                [sys.executable, "-m", "benchmarks.bench_async_streams", "--child", mode,
+                 "--sessions", str(sessions), "--first-token-delay", str(args.first_token_delay),
+                 "--chunks", str(args.chunks), "--chunk-interval", str(args.chunk_interval)],
+                capture_output=True, text=True, check=True).stdout
+            r = json.loads(output.strip().splitlines()[-1])
+            print(f"{r['mode']:<9} {r['sessions']:>8} {r['threads']:>8} {r['rss_mb']:>8.1f} "
+                  f"{r['ttft_p50']:>8.1f}ms {r['ttft_p99']:>8.1f}ms {r['overhead_p50']:>11.1f}ms "
+                  f"{r['overhead_p99']:>11.1f}ms")
+
+
+if __name__ == "__main__":
+    main()
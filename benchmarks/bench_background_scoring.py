@@ -0,0 +1,120 @@
+"""
+採点モードのレイテンシ比較 (MockBackend を使用、ネットワーク不要)
+
+- inline:     採点するターンの応答に [[RATIONALE: 項目別評価...]] を含めて生成する (従来の動作)
+- background: 応答には [[SCORE:X]] のみを含め、項目別の採点は [[SCORE]] が届いた時点から別の呼び出しで並行して生成する
+
+生成速度 (--chars-per-sec) と最初のチャンクまでの時間 (--first-token-delay) を模擬し、
+採点するターンについて次の時間を比較する。
+
+- reply_ms: 送信から画面の応答が完了するまで (ユーザーが待つ時間)
+- score_ms: 送信から項目別の採点が揃うまで
+
+    python -m benchmarks.bench_background_scoring --turns 8 --chars-per-sec 400 --rationale-chars 600
+"""
+import argparse
+import json
+import statistics
+import time
+
+from modules.background_scoring import score_module, submit
+from modules.llm_backends import MockBackend
+from modules.tag_parser import StreamingTagParser
+from modules.transcript import Transcript
+
+
+def make_texts(visible_chars: int, rationale_chars: int):
+    visible = ("素晴らしい回答です。" * (visible_chars // 10 + 1))[:visible_chars]
+    rationale = ("【項目別評価】1.判断力:4点(根拠) " * (rationale_chars // 20 + 1))[:rationale_chars]
+    inline = f"{visible}\n[[SCORE:7]]\n[[RATIONALE: {rationale}]]\n今回の診断スコアと詳細な分析を知りたいですか？"
+    separate = f"{visible}\n[[SCORE:7]]\n今回の診断スコアと詳細な分析を知りたいですか？"
+    scoring_json = json.dumps({
+        "sub_scores": [{"criterion": f"項目{i}", "score": 4, "comment": rationale[:rationale_chars // 3]}
+                       for i in range(1, 4)],
+        "total": 7,
+        "rationale": "総合コメント",
+    }, ensure_ascii=False)
+    return inline, separate, scoring_json
+
+
+def stream_reply(backend, message: str, on_score=None):
+    chat = backend.start_chat(history=[])
+    parser = StreamingTagParser()
+    scored = False
+    for chunk in backend.send_message(chat, message, stream=True):
+        parser.feed(chunk.text)
+        if on_score is not None and parser.scores and not scored:
+            on_score()
+            scored = True
+    parser.finish()
+    return parser
+
+
+def run_inline(args, reply: str):
+    chunk_size = 20
+    backend = MockBackend(script=[reply], first_token_delay=args.first_token_delay,
+                          chunk_size=chunk_size, chunk_interval=chunk_size / args.chars_per_sec)
+    reply_ms = []
+    for _ in range(args.turns):
+        started = time.perf_counter()
+        parser = stream_reply(backend, "回答です。")
+        assert parser.score is not None and parser.rationale
+        reply_ms.append((time.perf_counter() - started) * 1000)
+    # 採点は応答の完了と同時に揃う
+    return reply_ms, list(reply_ms)
+
+
+def run_background(args, reply: str, scoring_json: str):
+    chunk_size = 20
+    backend = MockBackend(script=[reply], first_token_delay=args.first_token_delay,
+                          chunk_size=chunk_size, chunk_interval=chunk_size / args.chars_per_sec)
+    # 採点用の呼び出しは非ストリーミング: JSON 全体の生成時間を待ち時間として模擬する
+    scorer = MockBackend(script=lambda history, message: scoring_json,
+                         first_token_delay=args.first_token_delay + len(scoring_json) / args.chars_per_sec)
+    reply_ms, score_ms = [], []
+    for _ in range(args.turns):
+        transcript = Transcript()
+        transcript.append_user("回答です。")
+        pending = []
+        started = time.perf_counter()
+        parser = stream_reply(backend, "回答です。", on_score=lambda: pending.append(
+            submit(scorer, len(transcript), 0, 1, "受検者: 回答です。")))
+        transcript.append_assistant(parser)
+        reply_ms.append((time.perf_counter() - started) * 1000)
+        result = pending[0].future.result()
+        assert result.total == 7
+        score_ms.append((time.perf_counter() - started) * 1000)
+    return reply_ms, score_ms
+
+
+def run_parallel_call(args, scoring_json: str):
+    """採点の呼び出しを応答の送信と同時に始めた場合 (応答を待たずに採点できる最短の場合の参考値)"""
+    scorer = MockBackend(script=lambda history, message: scoring_json,
+                         first_token_delay=args.first_token_delay + len(scoring_json) / args.chars_per_sec)
+    started = time.perf_counter()
+    score_module(scorer, 1, "受検者: 回答です。")
+    return (time.perf_counter() - started) * 1000
+
+
+def summarize(label: str, reply_ms, score_ms):
+    print(f"{label:<11} reply_ms mean={statistics.mean(reply_ms):8.1f} max={max(reply_ms):8.1f}   "
+          f"score_ms mean={statistics.mean(score_ms):8.1f} max={max(score_ms):8.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--turns", type=int, default=8)
+    parser.add_argument("--first-token-delay", type=float, default=0.6)
+    parser.add_argument("--chars-per-sec", type=float, default=400.0, help="simulated generation speed")
+    parser.add_argument("--visible-chars", type=int, default=400)
+    parser.add_argument("--rationale-chars", type=int, default=600)
+    args = parser.parse_args()
+
+    inline, separate, scoring_json = make_texts(args.visible_chars, args.rationale_chars)
+    summarize("inline", *run_inline(args, inline))
+    summarize("background", *run_background(args, separate, scoring_json))
+    print(f"scoring call alone: {run_parallel_call(args, scoring_json):.1f}ms")
+
+
+if __name__ == "__main__":
+    main()
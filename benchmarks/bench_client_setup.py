@@ -0,0 +1,64 @@
+"""
+ターンごとのクライアント準備コストを比較するベンチマーク
+
+- baseline: 毎ターン GeminiClient を生成して start_chat する（従来の動作）
+- pooled:   共有プールからクライアントを取得して start_chat する
+
+ネットワーク通信は行わない（クライアント生成とチャット復元のみを計測）。
+
+    python -m benchmarks.bench_client_setup --turns 200
+"""
+import argparse
+import contextlib
+import io
+import statistics
+import time
+
+from modules.gemini_client import GeminiClient, GeminiClientPool
+
+
+def _make_history(turns: int):
+    history = []
+    for i in range(turns):
+        history.append({"role": "user", "parts": [{"text": f"回答 {i}"}]})
+        history.append({"role": "model", "parts": [{"text": f"応答 {i} " * 50}]})
+    return history
+
+
+def _measure(setup, turns: int):
+    samples = []
+    for i in range(turns):
+        history = _make_history(min(i, 20))
+        start = time.perf_counter()
+        client = setup()
+        client.start_chat(history=history)
+        samples.append((time.perf_counter() - start) * 1000)
+    return samples
+
+
+def _report(label: str, samples):
+    samples = sorted(samples)
+    p95 = samples[int(len(samples) * 0.95) - 1]
+    print(f"{label:<10} mean={statistics.mean(samples):8.3f}ms  p50={statistics.median(samples):8.3f}ms  p95={p95:8.3f}ms")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--turns", type=int, default=200)
+    parser.add_argument("--model", default="gemini-2.0-flash")
+    args = parser.parse_args()
+
+    api_key = "benchmark-dummy-key"
+    pool = GeminiClientPool()
+
+    # GeminiClient のモデル名出力を抑制する
+    with contextlib.redirect_stdout(io.StringIO()):
+        baseline = _measure(lambda: GeminiClient(api_key=api_key, model_name=args.model), args.turns)
+        pooled = _measure(lambda: pool.get(api_key, args.model), args.turns)
+
+    _report("baseline", baseline)
+    _report("pooled", pooled)
+
+
+if __name__ == "__main__":
+    main()
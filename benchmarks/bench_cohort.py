@@ -0,0 +1,101 @@
+"""
+コホート内の順位計算のベンチマーク (乱数で作ったスコアを使用)
+
+1回の問い合わせ (あるモジュールのスコアが上位何%か) の所要時間を、次の3通りで比較する。
+
+- python:    Python のループでコホート全体を数える (問い合わせのたびに O(n))
+- numpy:     NumPy でコホート全体を比較して数える (問い合わせのたびに O(n)、ベクトル化)
+- histogram: CohortStats (事前に作ったヒストグラム) を引く (O(1))
+
+あわせて、追記 (1件ずつ) とヒストグラムの再作成 (CohortStats) にかかる時間を表示する。
+
+    python -m benchmarks.bench_cohort --sizes 100000 1000000 --queries 200
+"""
+import argparse
+import time
+
+import numpy as np
+
+from modules.cohort import AVERAGE_COLUMN, COLUMNS, CohortStats, CohortStore, to_row
+
+
+def make_cohort(size: int, seed: int) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    scores = np.clip(np.rint(rng.normal(6.5, 1.5, size=(size, len(COLUMNS) - 1))), 1, 10).astype(np.float32)
+    # 途中で終了したセッション (後半の段階のスコアがない) を混ぜる
+    unfinished = rng.random(size) < 0.1
+    scores[unfinished, -1] = np.nan
+    average = np.nanmean(scores, axis=1, keepdims=True)
+    return np.hstack([scores, average]).astype(np.float32)
+
+
+def timed(func, repeat: int):
+    started = time.perf_counter()
+    for i in range(repeat):
+        func(i)
+    return (time.perf_counter() - started) / repeat * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100000, 1000000])
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--python-queries", type=int, default=5, help="the pure Python scan is slow")
+    parser.add_argument("--appends", type=int, default=10000)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    for size in args.sizes:
+        data = make_cohort(size, args.seed)
+        store = CohortStore(capacity=1024)
+        store.extend(data)
+
+        started = time.perf_counter()
+        stats = CohortStats(store.view())
+        refresh_ms = (time.perf_counter() - started) * 1000
+
+        column = 1
+        values = data[:, column]
+        as_list = [float(v) for v in values]
+        queries = np.random.default_rng(args.seed).integers(1, 11, size=max(args.queries, args.python_queries))
+
+        def python_rank(i):
+            score = queries[i]
+            valid = [v for v in as_list if v == v]
+            return sum(1 for v in valid if v >= score) / len(valid)
+
+        def numpy_rank(i):
+            valid = values[~np.isnan(values)]
+            return np.count_nonzero(valid >= queries[i]) / len(valid)
+
+        def histogram_rank(i):
+            return stats.rank(column, float(queries[i]))
+
+        # 3つの方法の結果が一致することを確認する
+        for i in range(args.python_queries):
+            expected = numpy_rank(i) * 100
+            assert abs(python_rank(i) * 100 - expected) < 1e-6
+            assert abs(histogram_rank(i)[0] - expected) < 1e-6
+
+        python_ms = timed(python_rank, args.python_queries)
+        numpy_ms = timed(numpy_rank, args.queries)
+        histogram_ms = timed(histogram_rank, args.queries)
+
+        started = time.perf_counter()
+        stats.rank_many(AVERAGE_COLUMN, data[:, AVERAGE_COLUMN])
+        rank_many_ms = (time.perf_counter() - started) * 1000
+
+        rows = [to_row([7, 6, 8, 5, 7]) for _ in range(args.appends)]
+        started = time.perf_counter()
+        for row in rows:
+            store.extend(row)
+        append_us = (time.perf_counter() - started) / args.appends * 1e6
+
+        print(f"cohort={size:>9,}  per query: python={python_ms:9.2f}ms numpy={numpy_ms:7.3f}ms "
+              f"histogram={histogram_ms * 1000:6.2f}us")
+        print(f"{'':17}refresh (CohortStats)={refresh_ms:7.1f}ms  rank_many (all rows)={rank_many_ms:7.1f}ms  "
+              f"append={append_us:5.1f}us/row")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+"""
+システムプロンプトのコンテキストキャッシュのベンチマーク
+
+オフライン (デフォルト): FakeCacheBackend で多数のセッション・ターンを模擬し、
+キャッシュの作成・延長・無効化の回数とヒット率を表示する。
+
+--api-key を指定すると実際の Gemini API で、キャッシュあり/なしの
+TTFT (最初のチャンクまでの時間) と usage_metadata のトークン数を比較する。
+
+    python -m benchmarks.bench_context_cache --sessions 200 --turns 15
+    python -m benchmarks.bench_context_cache --api-key $GEMINI_API_KEY --model gemini-2.0-flash
+"""
+import argparse
+import statistics
+import time
+
+from modules import prompts
+from modules.context_cache import ContextCacheManager, FakeCacheBackend
+
+
+def run_offline(sessions: int, turns: int):
+    backend = FakeCacheBackend()
+    manager = ContextCacheManager(backend, ttl_seconds=3600)
+    for session in range(sessions):
+        for turn in range(turns):
+            stage = prompts.current_stage(turn // 4)
+            manager.get("fake-model", prompts.build_system_prompt(stage), prompts.PROMPT_HASH)
+    # prompts.md が変更された場合を模擬する
+    manager.get("fake-model", prompts.build_system_prompt(1) + "\n(changed)", "changed-version")
+
+    total = manager.hits + manager.misses
+    print(f"requests={total} hits={manager.hits} creates={backend.created} "
+          f"refreshes={backend.refreshed} deletes={backend.deleted} hit_rate={manager.hits / total:.1%}")
+
+
+def run_online(api_key: str, model: str, turns: int):
+    import contextlib
+    import io
+    from modules.gemini_client import GeminiClient
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        plain = GeminiClient(api_key=api_key, model_name=model)
+        cached = GeminiClient(api_key=api_key, model_name=model)
+    cached.enable_context_cache()
+    system_instruction = prompts.build_system_prompt(1)
+
+    for label, client in (("no-cache", plain), ("cache", cached)):
+        ttfts = []
+        usage = None
+        for _ in range(turns):
+            chat = client.start_chat(history=[], system_instruction=system_instruction)
+            start = time.perf_counter()
+            first = None
+            for chunk in client.send_message(chat, "こんにちは。一言で返答してください。", stream=True):
+                if first is None:
+                    first = time.perf_counter() - start
+                usage = getattr(chunk, "usage_metadata", None) or usage
+            ttfts.append(first * 1000)
+        prompt_tokens = getattr(usage, "prompt_token_count", None)
+        cached_tokens = getattr(usage, "cached_content_token_count", None)
+        print(f"{label:<9} ttft_p50={statistics.median(ttfts):7.0f}ms  prompt_tokens={prompt_tokens}  cached_tokens={cached_tokens}")
+
+    if cached.context_cache is not None and cached.context_cache.failures:
+        print("note: cached content could not be created (model or minimum token limit); fell back to system_instruction")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sessions", type=int, default=200)
+    parser.add_argument("--turns", type=int, default=15)
+    parser.add_argument("--api-key")
+    parser.add_argument("--model", default="gemini-2.0-flash")
+    args = parser.parse_args()
+
+    if args.api_key:
+        run_online(args.api_key, args.model, min(args.turns, 5))
+    else:
+        run_offline(args.sessions, args.turns)
+
+
+if __name__ == "__main__":
+    main()
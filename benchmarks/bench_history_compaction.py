@@ -0,0 +1,106 @@
+"""
+履歴圧縮による入力トークン削減のベンチマーク
+
+Module 1-4 + 総合フィードバックまでの合成履歴を作り、各ターンで送信される履歴の
+入力トークン数（推定）を「全文送信」と「圧縮あり」で比較する。
+
+--api-key を指定すると count_tokens API で実際のトークン数を数え、
+--measure-latency を付けると max_output_tokens=1 の生成で入力処理のレイテンシも計測する。
+
+    python -m benchmarks.bench_history_compaction
+    python -m benchmarks.bench_history_compaction --api-key $GEMINI_API_KEY --model gemini-2.0-flash --measure-latency
+"""
+import argparse
+import time
+
+from modules.history_compactor import CompactionConfig, compact_history
+
+TURNS_PER_MODULE = 4
+
+
+def _user(text):
+    return {"role": "user", "parts": [{"text": text}]}
+
+
+def _model(text):
+    return {"role": "model", "parts": [{"text": text}]}
+
+
+def build_session():
+    """1ターンごとに (user, model) のペアを返す"""
+    turns = [(
+        "ユーザーのベンチさんが参加しました。アセスメントを開始してください。",
+        "ようこそ。Module 1 の状況を説明します。" + "状況説明。" * 80,
+    )]
+    for module in range(1, 5):
+        for step in range(TURNS_PER_MODULE):
+            answer = f"Module {module} への回答 {step}。" + "具体的な行動と理由を説明します。" * 15
+            if step == TURNS_PER_MODULE - 2:
+                reply = ("素晴らしい視点です。" * 30
+                         + f"\n[[SCORE:{5 + module}]]\n[[RATIONALE: 【項目別評価】" + "評価コメント。" * 60 + "]]"
+                         + "\n今回の診断スコアと詳細な分析を知りたいですか？")
+            elif step == TURNS_PER_MODULE - 1:
+                answer = "はい、知りたいです。"
+                reply = "スコアの解説です。" * 40 + f"\nそれでは Module {module + 1} に進みます。" + "状況説明。" * 80
+            else:
+                reply = "深掘りの質問です。" * 30
+            turns.append((answer, reply))
+    turns.append(("ありがとうございました。", "総合フィードバック。" * 200 + "\n[[SCORE:8]]\n[[END_OF_ASSESSMENT]]"))
+    return turns
+
+
+def estimate_tokens(history) -> int:
+    # 日本語はおおよそ 1トークン ≒ 1.5文字 として推定する
+    chars = sum(len(part.get("text", "")) for message in history for part in message["parts"])
+    return int(chars / 1.5)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--api-key")
+    parser.add_argument("--model", default="gemini-2.0-flash")
+    parser.add_argument("--measure-latency", action="store_true")
+    args = parser.parse_args()
+
+    client = None
+    if args.api_key:
+        from google import genai
+        client = genai.Client(api_key=args.api_key)
+
+    def count(history):
+        if client is None:
+            return estimate_tokens(history)
+        return client.models.count_tokens(model=args.model, contents=history).total_tokens
+
+    def latency(history, message):
+        from google.genai import types
+        start = time.perf_counter()
+        client.models.generate_content(
+            model=args.model,
+            contents=history + [_user(message)],
+            config=types.GenerateContentConfig(max_output_tokens=1),
+        )
+        return (time.perf_counter() - start) * 1000
+
+    config = CompactionConfig()
+    history = []
+    total_full = total_compacted = 0
+    print(f"{'turn':>4} {'full':>8} {'compacted':>10} {'saved':>7}" + ("  full_ms  comp_ms" if args.measure_latency and client else ""))
+    for turn, (user_text, model_text) in enumerate(build_session(), start=1):
+        compacted = compact_history(history, config)
+        full_tokens = count(history) if history else 0
+        compacted_tokens = count(compacted) if compacted else 0
+        total_full += full_tokens
+        total_compacted += compacted_tokens
+        saved = 1 - compacted_tokens / full_tokens if full_tokens else 0.0
+        line = f"{turn:>4} {full_tokens:>8} {compacted_tokens:>10} {saved:>6.1%}"
+        if args.measure_latency and client:
+            line += f"  {latency(history, user_text):7.0f}  {latency(compacted, user_text):7.0f}"
+        print(line)
+        history += [_user(user_text), _model(model_text)]
+
+    print(f"total input tokens: full={total_full} compacted={total_compacted} saved={1 - total_compacted / total_full:.1%}")
+
+
+if __name__ == "__main__":
+    main()
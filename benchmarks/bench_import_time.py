@@ -0,0 +1,103 @@
+"""
+起動時の import コストのベンチマーク (python -X importtime を使用)
+
+アプリが起動時に読み込むモジュールを新しいプロセスで import し、
+-X importtime の出力から modules.* の累積時間 (依存パッケージを含む) を集計する。
+次の場合は終了コード 1 で失敗する。
+
+- 累積時間の中央値が --budget-ms を超えた
+- 初回の利用時まで遅らせるべき重いパッケージ (google-genai / gspread / google-auth / numpy) が読み込まれた
+
+    python -m benchmarks.bench_import_time --runs 7 --budget-ms 150 [--top 15]
+
+streamlit 本体はどの構成でも読み込むため、計測の対象外とする (modules.settings は streamlit を import するので含めない)。
+"""
+import argparse
+import statistics
+import subprocess
+import sys
+
+# streamlit_app.py が起動時に読み込むモジュール
+COLD_START_MODULES = (
+    "modules.llm_backends",
+    "modules.tag_parser",
+    "modules.history_compactor",
+    "modules.prompts",
+    "modules.opening_cache",
+    "modules.background_scoring",
+    "modules.transcript",
+    "modules.metering",
+    "modules.metrics",
+    "modules.rate_limiter",
+    "modules.session_store",
+    "modules.log_pipeline",
+)
+
+# 起動時に読み込まれてはいけないモジュール (初回の利用時に読み込む)
+DEFERRED_MODULES = ("google.genai", "gspread", "google.oauth2", "google.auth", "numpy")
+
+
+def measure(modules):
+    """
+    1回分の計測。(modules.* の累積時間 [ms], {モジュール名: 累積時間 [ms]}) を返す
+    """
+    code = "import " + ", ".join(modules)
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", code],
+                            capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1])
+
+    total_us = 0
+    cumulative = {}
+    for line in result.stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        if not line.startswith("import time:") or "imported package" in line:
+            continue
+        _, cumulative_us, name = line.split(":", 1)[1].split("|")
+        depth = len(name) - len(name.lstrip())
+        name = name.strip()
+        cumulative[name] = int(cumulative_us) / 1000
+        # 直接 import したもの (インデントなし) だけを足すと、依存の重複を数えない
+        if depth == 1 and name.startswith("modules"):
+            total_us += int(cumulative_us)
+    return total_us / 1000, cumulative
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=7)
+    parser.add_argument("--budget-ms", type=float, default=150.0, help="median cumulative import time budget")
+    parser.add_argument("--top", type=int, default=15, help="show the N slowest imports of the last run")
+    args = parser.parse_args()
+
+    totals = []
+    cumulative = {}
+    for _ in range(args.runs):
+        total, cumulative = measure(COLD_START_MODULES)
+        totals.append(total)
+
+    median = statistics.median(totals)
+    print(f"modules.* import time: median={median:.1f}ms min={min(totals):.1f}ms max={max(totals):.1f}ms "
+          f"(runs={args.runs}, budget={args.budget_ms:.0f}ms)")
+    print()
+    for name, ms in sorted(cumulative.items(), key=lambda item: -item[1])[:args.top]:
+        print(f"  {ms:8.1f}ms  {name}")
+
+    failures = []
+    if median > args.budget_ms:
+        failures.append(f"import time {median:.1f}ms exceeds the budget of {args.budget_ms:.0f}ms")
+    loaded = sorted(name for name in cumulative
+                    if any(name == heavy or name.startswith(heavy + ".") for heavy in DEFERRED_MODULES))
+    if loaded:
+        failures.append(f"deferred modules were imported at startup: {', '.join(loaded)}")
+    if failures:
+        print()
+        for failure in failures:
+            print(f"FAIL: {failure}")
+        sys.exit(1)
+    print()
+    print("OK")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+"""
+ログ集計の比較: 毎回シート全体を取得する場合と、新しい行だけを取り込んでローカルで問い合わせる場合
+(FakeWorksheet を使用、ネットワーク不要)
+
+- full:        問い合わせのたびに get_all_values() で全行を取得し、Python でスコアを取り出す (従来の方法)
+- incremental: SheetsLogReader で新しい行だけを batch_get し、LogStore (SQLite) に問い合わせる
+
+各ラウンドでシートに --append 行を追加してから、1人分のスコアを問い合わせる。
+
+    python -m benchmarks.bench_log_ingest --rows 20000 --rounds 5 --latency 0.3 --row-latency 0.00002
+"""
+import argparse
+import os
+import statistics
+import tempfile
+import time
+
+from modules.fake_worksheet import FakeWorksheet
+from modules.log_ingest import LogStore, SheetsLogReader, extract_scores, parse_row
+
+HEADER_ROW = ["Timestamp", "User ID", "Category", "Message"]
+
+
+def make_rows(start: int, count: int, users: int):
+    rows = []
+    for i in range(start, start + count):
+        user = f"user{i % users:03d}"
+        timestamp = f"2025-01-{1 + i // 20000 % 28:02d} {i // 3600 % 24:02d}:{i // 60 % 60:02d}:{i % 60:02d}"
+        kind = i % 4
+        if kind == 0:
+            rows.append([timestamp, user, "User", f"回答 {i} " * 20])
+        elif kind == 1:
+            rows.append([timestamp, user, "AI", f"応答 {i} " * 40 + f"\n[[SCORE:{i % 10 + 1}]]\n[[RATIONALE:根拠 {i}]]"])
+        elif kind == 2:
+            rows.append([timestamp, user, "Scoring", f"Score extracted: {i % 10 + 1}"])
+        else:
+            rows.append([timestamp, user, "Metrics", "Turn metrics"])
+    return rows
+
+
+def query_full(worksheet, user: str):
+    found = []
+    for row in worksheet.get_all_values()[1:]:
+        timestamp, user_id, category, message = parse_row(row)
+        if user_id == user:
+            found.extend(extract_scores(category, message))
+    return found
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=20000)
+    parser.add_argument("--users", type=int, default=500)
+    parser.add_argument("--rounds", type=int, default=5)
+    parser.add_argument("--append", type=int, default=200, help="rows appended before each query")
+    parser.add_argument("--latency", type=float, default=0.3, help="seconds per API call")
+    parser.add_argument("--row-latency", type=float, default=0.00002, help="seconds per row transferred")
+    args = parser.parse_args()
+
+    worksheet = FakeWorksheet([HEADER_ROW] + make_rows(0, args.rows, args.users),
+                              latency=args.latency, row_latency=args.row_latency)
+    with tempfile.TemporaryDirectory() as tmp:
+        store = LogStore(os.path.join(tmp, "logs.db"))
+        reader = SheetsLogReader(worksheet, store)
+
+        started = time.perf_counter()
+        rows, scores = reader.sync()
+        print(f"initial sync: {rows} rows, {scores} scores in {(time.perf_counter() - started) * 1000:.0f}ms")
+
+        full_ms, sync_ms, query_ms = [], [], []
+        next_index = args.rows
+        for round_index in range(args.rounds):
+            worksheet.append_rows(make_rows(next_index, args.append, args.users))
+            next_index += args.append
+            user = f"user{round_index % args.users:03d}"
+
+            reads = worksheet.rows_read
+            started = time.perf_counter()
+            expected = query_full(worksheet, user)
+            full_ms.append((time.perf_counter() - started) * 1000)
+            full_rows = worksheet.rows_read - reads
+
+            reads = worksheet.rows_read
+            started = time.perf_counter()
+            reader.sync()
+            sync_ms.append((time.perf_counter() - started) * 1000)
+            incremental_rows = worksheet.rows_read - reads
+            started = time.perf_counter()
+            local = store.scores(user_id=user)
+            query_ms.append((time.perf_counter() - started) * 1000)
+            assert len([kind for kind, *_ in expected if kind == "ai"]) == len([row for row in local if row[2] == "ai"])
+
+        print(f"full         mean={statistics.mean(full_ms):8.1f}ms per query (rows read per query: {full_rows})")
+        print(f"incremental  sync mean={statistics.mean(sync_ms):8.1f}ms (rows read per sync: {incremental_rows}), "
+              f"local query mean={statistics.mean(query_ms):6.2f}ms")
+        store.close()
+
+
+if __name__ == "__main__":
+    main()
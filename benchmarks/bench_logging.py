@@ -0,0 +1,105 @@
+"""
+ログ出力1件あたりのリクエストスレッドでのコストの比較
+
+- direct:   リクエストスレッドで JSON に整形して書き込む (従来の JsonFormatter + StreamHandler。
+            時刻の取得・利用者の参照・json.dumps をレコードごとに行う)
+- pipeline: LogPipeline (コンテキストを付けてキューに積むだけ。整形と書き込みはリスナーのスレッド)
+
+出力先は実際のファイル (一時ディレクトリ) で、AI の応答を模した大きな本文と短い本文の両方を計測する。
+
+    python -m benchmarks.bench_logging --records 20000 --body-chars 200 8000
+"""
+import argparse
+import datetime
+import json
+import logging
+import os
+import tempfile
+import time
+
+from modules.log_pipeline import LogPipeline, bind_context
+
+# 従来のフォーマッターが参照していた st.session_state の代わり
+FAKE_SESSION_STATE = {"user_name": "bench_user"}
+
+
+class LegacyJsonFormatter(logging.Formatter):
+    """streamlit_app.py にあった JsonFormatter と同じ処理"""
+    def format(self, record):
+        log_entry = {
+            "severity": record.levelname,
+            "message": record.getMessage(),
+            "timestamp": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+            "component": "assessment-app",
+        }
+        if hasattr(record, 'category'):
+            log_entry['category'] = record.category
+        if hasattr(record, 'metrics'):
+            log_entry['metrics'] = record.metrics
+        try:
+            if "user_name" in FAKE_SESSION_STATE and FAKE_SESSION_STATE["user_name"]:
+                log_entry['user_id'] = FAKE_SESSION_STATE["user_name"]
+            else:
+                log_entry['user_id'] = "anonymous"
+        except:
+            log_entry['user_id'] = "system_init"
+        return json.dumps(log_entry, ensure_ascii=False)
+
+
+def emit_all(logger: logging.Logger, records: int, body: str):
+    # 1件ごとの所要時間を測り、中央値と p99 を返す
+    samples = []
+    for i in range(records):
+        started = time.perf_counter()
+        logger.info(body, extra={'category': 'AI'})
+        samples.append(time.perf_counter() - started)
+    samples.sort()
+    return samples[len(samples) // 2] * 1e6, samples[int(len(samples) * 0.99)] * 1e6, sum(samples)
+
+
+def run_direct(path: str, records: int, body: str):
+    logger = logging.getLogger(f"bench_direct_{len(body)}")
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+    handler = logging.FileHandler(path, encoding="utf-8")
+    handler.setFormatter(LegacyJsonFormatter())
+    logger.addHandler(handler)
+    result = emit_all(logger, records, body)
+    handler.close()
+    return result
+
+
+def run_pipeline(path: str, records: int, body: str):
+    logger = logging.getLogger(f"bench_pipeline_{len(body)}")
+    logger.setLevel(logging.INFO)
+    # 標準出力は使わず、ファイルだけに書き込む
+    pipeline = LogPipeline(max_queue_size=records + 1, stdout=False)
+    pipeline.add_file(path, max_bytes=0)
+    pipeline.attach(logger)
+    bind_context(user_id="bench_user", session_id="bench")
+    result = emit_all(logger, records, body)
+    started = time.perf_counter()
+    pipeline.stop()
+    drain = time.perf_counter() - started
+    return result + (drain,)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--records", type=int, default=20000)
+    parser.add_argument("--body-chars", type=int, nargs="+", default=[200, 8000])
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for chars in args.body_chars:
+            body = ("応答の本文です。" * (chars // 8 + 1))[:chars]
+            direct = run_direct(os.path.join(tmp, f"direct_{chars}.log"), args.records, body)
+            pipeline = run_pipeline(os.path.join(tmp, f"pipeline_{chars}.log"), args.records, body)
+            print(f"body={chars:>6} chars  direct:   p50={direct[0]:7.1f}us p99={direct[1]:7.1f}us "
+                  f"total={direct[2] * 1000:7.1f}ms")
+            print(f"{'':19}pipeline: p50={pipeline[0]:7.1f}us p99={pipeline[1]:7.1f}us "
+                  f"total={pipeline[2] * 1000:7.1f}ms (+{pipeline[3] * 1000:.1f}ms to drain the queue)")
+
+
+if __name__ == "__main__":
+    main()
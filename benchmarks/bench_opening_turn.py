@@ -0,0 +1,91 @@
+"""
+最初の応答 (Module 1 の導入) が表示され始めるまでの時間の比較 (MockBackend を使用、ネットワーク不要)
+
+- blocking: 非ストリーミングで全文を生成してから表示する (従来の動作)
+- stream:   ストリーミングで生成し、最初のチャンクから表示する
+- cached:   生成済みのテンプレートに名前を差し込む (OpeningCache のヒット時)
+
+生成速度 (--chars-per-sec) と最初のチャンクまでの時間 (--first-token-delay) を模擬し、
+最初の表示までの時間 (first_visible_ms) と全文が揃うまでの時間 (complete_ms) を表示する。
+
+    python -m benchmarks.bench_opening_turn --sessions 5 --chars-per-sec 400 --intro-chars 800
+"""
+import argparse
+import statistics
+import time
+
+from modules.llm_backends import MockBackend
+from modules.opening_cache import NAME_PLACEHOLDER, OpeningCache, cache_key, initial_prompt
+from modules.tag_parser import StreamingTagParser
+
+
+def make_intro(chars: int) -> str:
+    body = ("これからアセスメントを始めます。気軽に答えてください。" * (chars // 25 + 1))[:chars]
+    return f"{NAME_PLACEHOLDER}さん、ようこそ。\n\n{body}"
+
+
+def run_blocking(backend, user_name: str):
+    started = time.perf_counter()
+    chat = backend.start_chat(history=[])
+    text = backend.send_message(chat, initial_prompt(user_name)).text
+    elapsed = (time.perf_counter() - started) * 1000
+    assert text
+    return elapsed, elapsed
+
+
+def run_stream(backend, user_name: str):
+    started = time.perf_counter()
+    chat = backend.start_chat(history=[])
+    parser = StreamingTagParser()
+    first_visible = None
+    for chunk in backend.send_message(chat, initial_prompt(user_name), stream=True):
+        if parser.feed(chunk.text) and first_visible is None:
+            first_visible = (time.perf_counter() - started) * 1000
+    parser.finish()
+    return first_visible, (time.perf_counter() - started) * 1000
+
+
+def run_cached(cache: OpeningCache, key: str, user_name: str):
+    started = time.perf_counter()
+    text = cache.get(key, user_name)
+    elapsed = (time.perf_counter() - started) * 1000
+    assert text and NAME_PLACEHOLDER not in text
+    return elapsed, elapsed
+
+
+def summarize(label: str, results):
+    first = [first for first, _ in results]
+    complete = [complete for _, complete in results]
+    print(f"{label:<9} first_visible_ms mean={statistics.mean(first):9.3f} max={max(first):9.3f}   "
+          f"complete_ms mean={statistics.mean(complete):9.3f}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sessions", type=int, default=5)
+    parser.add_argument("--first-token-delay", type=float, default=0.8)
+    parser.add_argument("--chars-per-sec", type=float, default=400.0, help="simulated generation speed")
+    parser.add_argument("--intro-chars", type=int, default=800)
+    args = parser.parse_args()
+
+    intro = make_intro(args.intro_chars)
+    chunk_size = 20
+    backend = MockBackend(script=lambda history, message: intro,
+                          first_token_delay=args.first_token_delay,
+                          chunk_size=chunk_size, chunk_interval=chunk_size / args.chars_per_sec)
+    # 非ストリーミングでは全文の生成時間がそのまま待ち時間になる
+    blocking = MockBackend(script=backend.script,
+                           first_token_delay=args.first_token_delay + len(intro) / args.chars_per_sec)
+
+    cache = OpeningCache()
+    key = cache_key("mock", "mock-model", "system prompt")
+    cache.put(key, intro)
+
+    names = [f"受検者{i:02d}" for i in range(args.sessions)]
+    summarize("blocking", [run_blocking(blocking, name) for name in names])
+    summarize("stream", [run_stream(backend, name) for name in names])
+    summarize("cached", [run_cached(cache, key, name) for name in names])
+
+
+if __name__ == "__main__":
+    main()
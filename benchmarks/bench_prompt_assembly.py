@@ -0,0 +1,100 @@
+"""
+モジュール単位のシステムプロンプト組み立ての効果測定と内容の確認
+
+1. 各段階で送信するシステムプロンプトの長さ（推定トークン）を全文送信と比較する
+2. 各段階のプロンプトの内容を確認する (必要なモジュールの定義・総合フィードバックのガイドラインが含まれ、
+   区切り線が重複しておらず、全文より長くないこと)。1つでも満たさなければ終了コード 1
+3. モック応答で Module 1-4 → 総合フィードバックまで進めた場合の送信量を全文送信と比較する
+   (モック応答はプロンプトを読まないため、これは送信量の見積もりであり動作の確認ではない)
+
+    python -m benchmarks.bench_prompt_assembly
+"""
+import sys
+
+from modules.prompts import (FINAL_STAGE, MODULE_COUNT, PROMPT_SECTIONS, SYSTEM_PROMPT,
+                             build_system_prompt, current_stage)
+from modules.tag_parser import StreamingTagParser
+
+
+def estimate_tokens(text: str) -> int:
+    # 日本語はおおよそ 1トークン ≒ 1.5文字 として推定する
+    return int(len(text) / 1.5)
+
+
+def mock_flow():
+    """モジュールごとに 回答 → 評価(スコア) → 開示 の3ターンを行うモック応答"""
+    for module in range(1, MODULE_COUNT + 1):
+        yield f"Module {module} の深掘り質問です。"
+        yield f"良い回答です。\n[[SCORE:{module + 4}]]\n[[RATIONALE: Module {module} の評価]]\n今回の診断スコアと詳細な分析を知りたいですか？"
+        yield "スコアの解説です。次のモジュールに進みます。"
+    yield "総合フィードバックです。\n[[SCORE:8]]\n[[RATIONALE: 総合評価]]\n[[END_OF_ASSESSMENT]]"
+
+
+def expected_modules(stage: int):
+    """段階ごとに含まれるべきモジュール (総合フィードバックでは全モジュールを振り返る)"""
+    if stage >= FINAL_STAGE:
+        return list(range(1, MODULE_COUNT + 1))
+    return [n for n in (stage - 1, stage) if n >= 1]
+
+
+def check_prompts():
+    errors = []
+    for stage in range(1, FINAL_STAGE + 1):
+        prompt = build_system_prompt(stage)
+        for module in range(1, MODULE_COUNT + 1):
+            included = PROMPT_SECTIONS["modules"][module] in prompt
+            if module in expected_modules(stage) and not included:
+                errors.append(f"stage {stage}: Module {module} definition missing")
+            if module not in expected_modules(stage) and included:
+                errors.append(f"stage {stage}: unexpected Module {module} definition")
+        has_final = PROMPT_SECTIONS["final"] in prompt
+        if stage >= MODULE_COUNT and not has_final:
+            errors.append(f"stage {stage}: final feedback guideline missing")
+        if stage < MODULE_COUNT and has_final:
+            errors.append(f"stage {stage}: unexpected final feedback guideline")
+        if prompt != SYSTEM_PROMPT and not prompt.startswith(PROMPT_SECTIONS["common"]):
+            errors.append(f"stage {stage}: common rules missing")
+        if "---\n\n---" in prompt:
+            errors.append(f"stage {stage}: doubled separator")
+        if len(prompt) > len(SYSTEM_PROMPT):
+            errors.append(f"stage {stage}: larger than the full prompt ({len(prompt)} > {len(SYSTEM_PROMPT)} chars)")
+    return errors
+
+
+def flow_tokens():
+    module_scores = []
+    sent_full = sent_scoped = 0
+    for reply in mock_flow():
+        stage = current_stage(len(module_scores))
+        sent_full += estimate_tokens(SYSTEM_PROMPT)
+        sent_scoped += estimate_tokens(build_system_prompt(stage))
+
+        parser = StreamingTagParser()
+        parser.feed(reply)
+        parser.finish()
+        if parser.score is not None:
+            module_scores.append(parser.score)
+    return sent_full, sent_scoped
+
+
+def main():
+    full_tokens = estimate_tokens(SYSTEM_PROMPT)
+    print(f"{'stage':>5} {'tokens':>7} {'saved':>7}")
+    for stage in range(1, FINAL_STAGE + 1):
+        tokens = estimate_tokens(build_system_prompt(stage))
+        print(f"{stage:>5} {tokens:>7} {1 - tokens / full_tokens:>6.1%}")
+    print(f" full {full_tokens:>7}")
+
+    sent_full, sent_scoped = flow_tokens()
+    print(f"mock flow system-prompt tokens: full={sent_full} scoped={sent_scoped} saved={1 - sent_scoped / sent_full:.1%}")
+
+    errors = check_prompts()
+    for error in errors:
+        print(f"NG: {error}")
+    if errors:
+        sys.exit(1)
+    print("OK: every stage carries its module definitions and guidelines")
+
+
+if __name__ == "__main__":
+    main()
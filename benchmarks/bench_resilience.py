@@ -0,0 +1,91 @@
+"""
+Gemini 呼び出しの耐障害性のベンチマーク (FaultInjectingBackend を使用、ネットワーク不要)
+
+エラー・応答の遅延・無応答・途中停止を注入したモックに対して、次の3通りで送信する。
+
+- direct: そのまま呼び出す (従来の動作。エラーはそのまま失敗、無応答は hang_delay 秒待たされる)
+- retry:  ResilientBackend (タイムアウト + ジッター付き指数バックオフで再試行)
+- hedge:  retry に加えて、最初のチャンクが p95 を過ぎても届かなければ2本目を送る
+
+成功率、最初のチャンクまでの時間 (p50/p95/p99)、上流への呼び出し回数を表示する。
+
+    python -m benchmarks.bench_resilience --requests 200 --concurrency 20 --error-rate 0.1 --slow-rate 0.1
+"""
+import argparse
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from modules.gemini_client import ResilienceConfig, ResilientBackend
+from modules.llm_backends import FaultInjectingBackend, MockBackend
+
+
+def percentile(ordered, q):
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))] * 1000 if ordered else float("nan")
+
+
+def send(backend, message: str):
+    started = time.perf_counter()
+    ttft = None
+    try:
+        chat = backend.start_chat(history=[])
+        for _ in backend.send_message(chat, message, stream=True):
+            if ttft is None:
+                ttft = time.perf_counter() - started
+        return True, ttft
+    except Exception:
+        return False, None
+
+
+def run(label: str, args, resilient: bool, hedge: bool):
+    faulty = FaultInjectingBackend(
+        MockBackend(first_token_delay=args.latency, chunk_size=50, chunk_interval=0.01),
+        error_rate=args.error_rate, slow_rate=args.slow_rate, slow_delay=args.slow_delay,
+        hang_rate=args.hang_rate, hang_delay=args.hang_delay, stall_rate=args.stall_rate, seed=args.seed,
+    )
+    backend = faulty
+    if resilient:
+        config = ResilienceConfig(first_token_timeout=args.first_token_timeout, idle_timeout=args.idle_timeout,
+                                  max_attempts=args.max_attempts, backoff_base=0.1, backoff_max=1.0,
+                                  hedge=hedge, hedge_min_delay=args.latency, hedge_min_samples=20,
+                                  hedge_default_delay=args.first_token_timeout / 2)
+        backend = ResilientBackend(faulty, config)
+
+    message = "回答です。" * 50
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        results = list(executor.map(lambda _: send(backend, message), range(args.requests)))
+    elapsed = time.perf_counter() - started
+
+    ttfts = sorted(ttft for ok, ttft in results if ok and ttft is not None)
+    succeeded = sum(1 for ok, _ in results if ok)
+    extra = ""
+    if resilient:
+        extra = f" retries={backend.retries} hedges={backend.hedges}"
+    print(f"{label:<7} success={succeeded / len(results):6.1%} ttft_p50={percentile(ttfts, 0.50):7.0f}ms "
+          f"p95={percentile(ttfts, 0.95):7.0f}ms p99={percentile(ttfts, 0.99):7.0f}ms "
+          f"upstream_calls={faulty.calls}{extra} elapsed={elapsed:6.1f}s")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--latency", type=float, default=0.2, help="normal time to first chunk (sec)")
+    parser.add_argument("--error-rate", type=float, default=0.1)
+    parser.add_argument("--slow-rate", type=float, default=0.1)
+    parser.add_argument("--slow-delay", type=float, default=2.0)
+    parser.add_argument("--hang-rate", type=float, default=0.02)
+    parser.add_argument("--hang-delay", type=float, default=10.0)
+    parser.add_argument("--stall-rate", type=float, default=0.0)
+    parser.add_argument("--first-token-timeout", type=float, default=3.0)
+    parser.add_argument("--idle-timeout", type=float, default=3.0)
+    parser.add_argument("--max-attempts", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    for label, resilient, hedge in (("direct", False, False), ("retry", True, False), ("hedge", True, True)):
+        run(label, args, resilient, hedge)
+
+
+if __name__ == "__main__":
+    main()
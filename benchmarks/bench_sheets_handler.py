@@ -0,0 +1,58 @@
+"""
+GoogleSheetsHandler のスループットベンチマーク（FakeWorksheetを使用、ネットワーク不要）
+
+- baseline: レコードごとに append_row を同期呼び出し（従来の動作）
+- batched:  キュー + バックグラウンドスレッドで append_rows にまとめて書き込み
+
+    python -m benchmarks.bench_sheets_handler --records 500 --latency 0.05
+"""
+import argparse
+import logging
+import time
+
+from modules.fake_worksheet import FakeWorksheet
+from modules.google_sheets_handler import GoogleSheetsHandler
+
+
+def run_baseline(records: int, latency: float):
+    worksheet = FakeWorksheet(latency=latency)
+    start = time.perf_counter()
+    for i in range(records):
+        worksheet.append_row(["2025-01-01 00:00:00", "bench", "AI", f"message {i}"])
+    elapsed = time.perf_counter() - start
+    return elapsed, elapsed, worksheet.api_calls
+
+
+def run_batched(records: int, latency: float):
+    worksheet = FakeWorksheet(latency=latency)
+    handler = GoogleSheetsHandler("bench", "log", "bench", worksheet=worksheet)
+    bench_logger = logging.getLogger("bench_sheets_handler")
+    bench_logger.propagate = False
+    bench_logger.setLevel(logging.INFO)
+    bench_logger.addHandler(handler)
+
+    start = time.perf_counter()
+    for i in range(records):
+        bench_logger.info(f"message {i}", extra={'category': 'AI'})
+    request_path = time.perf_counter() - start
+    handler.flush()
+    total = time.perf_counter() - start
+
+    bench_logger.removeHandler(handler)
+    handler.close()
+    return request_path, total, worksheet.api_calls
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--records", type=int, default=500)
+    parser.add_argument("--latency", type=float, default=0.05, help="simulated Sheets API round trip (sec)")
+    args = parser.parse_args()
+
+    for label, runner in (("baseline", run_baseline), ("batched", run_batched)):
+        request_path, total, api_calls = runner(args.records, args.latency)
+        print(f"{label:<9} request_path={request_path * 1000:9.2f}ms  total={total * 1000:9.2f}ms  api_calls={api_calls}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+"""
+長い最終フィードバックを想定したストリーミング描画のベンチマーク
+
+- baseline: チャンクごとに文字列を連結し、全文を再描画、最後に正規表現でタグ除去
+- parser:   StreamingTagParser + ThrottledRenderer
+
+    python -m benchmarks.bench_stream_render --chars 20000 --chunk 20
+"""
+import argparse
+import re
+import time
+
+from modules.tag_parser import StreamingTagParser, ThrottledRenderer
+
+
+class CountingPlaceholder:
+    """st.empty() の代わりに描画回数と送信文字数を数える"""
+    def __init__(self):
+        self.renders = 0
+        self.chars_sent = 0
+
+    def markdown(self, text):
+        self.renders += 1
+        self.chars_sent += len(text)
+
+
+def _make_chunks(chars: int, chunk_size: int):
+    body = "フィードバック本文です。" * (chars // 12)
+    text = body + "\n\n[[SCORE:8]]\n[[RATIONALE: " + "根拠" * 500 + "]]\n\n[[END_OF_ASSESSMENT]]"
+    return [text[i:i + chunk_size] for i in range(0, len(text), chunk_size)]
+
+
+def run_baseline(chunks, placeholder):
+    full_text = ""
+    for chunk in chunks:
+        full_text += chunk
+        placeholder.markdown(full_text + "▌")
+    score_pattern = re.compile(r"\[\[SCORE:(\d+)\]\]")
+    rationale_pattern = re.compile(r"\[\[RATIONALE:.*?\]\]", re.DOTALL)
+    cleaned = rationale_pattern.sub("", score_pattern.sub("", full_text)).strip()
+    placeholder.markdown(cleaned)
+    return cleaned
+
+
+def run_parser(chunks, placeholder, interval):
+    parser = StreamingTagParser()
+    renderer = ThrottledRenderer(placeholder, interval=interval)
+    for chunk in chunks:
+        renderer.update(parser, parser.feed(chunk))
+    parser.finish()
+    renderer.finish(parser.clean_text)
+    return parser.clean_text
+
+
+def main():
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument("--chars", type=int, default=20000)
+    arg_parser.add_argument("--chunk", type=int, default=20)
+    arg_parser.add_argument("--interval", type=float, default=0.15)
+    args = arg_parser.parse_args()
+
+    chunks = _make_chunks(args.chars, args.chunk)
+
+    for label, runner in (
+        ("baseline", lambda p: run_baseline(chunks, p)),
+        ("parser", lambda p: run_parser(chunks, p, args.interval)),
+    ):
+        placeholder = CountingPlaceholder()
+        start = time.perf_counter()
+        runner(placeholder)
+        elapsed = (time.perf_counter() - start) * 1000
+        print(f"{label:<9} {elapsed:9.2f}ms  renders={placeholder.renders:6d}  chars_sent={placeholder.chars_sent:12d}")
+
+
+if __name__ == "__main__":
+    main()
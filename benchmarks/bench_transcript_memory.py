@@ -0,0 +1,76 @@
+"""
+1セッションあたりの会話記録のメモリ使用量とエクスポート時間のベンチマーク
+
+- baseline:   messages (content + raw_content の dict) と gemini_history を別々に保持（従来の構造）
+- transcript: Transcript / TranscriptRecord（生テキストを1回だけ保持）
+
+    python -m benchmarks.bench_transcript_memory --turns 20 --sessions 100
+"""
+import argparse
+import time
+import tracemalloc
+
+from modules.transcript import Transcript, TranscriptRecord, export_bytes, export_stream
+
+
+def _reply(turn: int) -> str:
+    # 実際の応答を模して、ターンごとに異なる文字列を作る (文字列のインターンを避ける)
+    return (f"ターン{turn}のフィードバック。" + "素晴らしい視点です。" * 60
+            + f"\n[[SCORE:{turn % 10}]]\n[[RATIONALE: 【項目別評価】" + "評価コメント。" * 40 + f"{turn}]]")
+
+
+def build_baseline(turns: int):
+    import re
+    score_pattern = re.compile(r"\[\[SCORE:(\d+)\]\]")
+    rationale_pattern = re.compile(r"\[\[RATIONALE:.*?\]\]", re.DOTALL)
+    messages, gemini_history = [], []
+    for turn in range(turns):
+        answer = f"回答{turn}。" + "具体的な行動を説明します。" * 20
+        raw = _reply(turn)
+        clean = rationale_pattern.sub("", score_pattern.sub("", raw)).strip()
+        messages.append({"role": "user", "content": answer, "timestamp": "2025-01-01 00:00:00"})
+        messages.append({"role": "assistant", "content": clean, "raw_content": raw, "timestamp": "2025-01-01 00:00:00"})
+        gemini_history.append({"role": "user", "parts": [{"text": answer}]})
+        gemini_history.append({"role": "model", "parts": [{"text": raw}]})
+    return messages, gemini_history
+
+
+def build_transcript(turns: int):
+    transcript = Transcript()
+    for turn in range(turns):
+        transcript.append_user(f"回答{turn}。" + "具体的な行動を説明します。" * 20, timestamp="2025-01-01 00:00:00")
+        transcript.append(TranscriptRecord.parse("assistant", _reply(turn), timestamp="2025-01-01 00:00:00"))
+    return transcript
+
+
+def measure(builder, turns: int, sessions: int):
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    kept = [builder(turns) for _ in range(sessions)]
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    size = sum(stat.size_diff for stat in after.compare_to(before, "filename"))
+    return size / sessions, kept
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--turns", type=int, default=20)
+    parser.add_argument("--sessions", type=int, default=100)
+    args = parser.parse_args()
+
+    baseline_size, _ = measure(build_baseline, args.turns, args.sessions)
+    transcript_size, kept = measure(build_transcript, args.turns, args.sessions)
+    print(f"baseline    {baseline_size / 1024:8.1f} KiB/session")
+    print(f"transcript  {transcript_size / 1024:8.1f} KiB/session")
+
+    transcript = kept[0]
+    for fmt in ("csv_sjis", "csv_utf8", "jsonl"):
+        start = time.perf_counter()
+        data = export_stream(transcript.records, fmt).read()
+        assert data == export_bytes(transcript, fmt)
+        print(f"export {fmt:<9} {(time.perf_counter() - start) * 1000:7.2f}ms  {len(data)} bytes")
+
+
+if __name__ == "__main__":
+    main()
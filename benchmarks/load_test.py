@@ -0,0 +1,271 @@
+"""
+同時実行セッションの負荷テスト
+
+Streamlit の AppTest で streamlit_app.py を実行し、N人の模擬ユーザーが
+Module 1-4 → 総合フィードバックまでを並行して進める。LLM はレイテンシを設定できるモックバックエンドを使う。
+AppTest は1プロセスに1つしか Streamlit のランタイムを持てないため、模擬ユーザーごとに別プロセスで実行し、
+全員が同じ時刻に開始するよう開始時刻を揃える (プロセス共有のリソースはユーザー間で共有されない点に注意)。
+
+計測項目 (同時ユーザー数ごと):
+- turn_latency_ms: 回答送信から応答の描画完了まで (1回の再実行)
+- ttft_ms:         送信から最初のチャンクまで
+- opening_ms:      開始ボタンの再実行 (冒頭の状況説明の生成を含む。OPENING_CACHE が効けば LLM を呼ばない)
+- rerun_ms:        LLM呼び出しを伴わない再実行 (最初のページ表示)
+- rss_per_session_kib: セッション1つあたりのRSS増加量 (各プロセスでアセスメントの前後に計測した差の平均)
+- saturation_users: p95 のターンレイテンシが1人時の --saturation-factor 倍を超えた最初のユーザー数
+
+結果はJSONで出力する (--output で保存)。いずれかのユーザーでエラーが出たか最後まで進まなかった場合は、
+部分的な計測値を出さずにエラーを表示して終了コード 1 で終わる。
+
+    python -m benchmarks.load_test --users 1,5,10,20 --first-token-delay 0.8 --chunk-interval 0.05 --output bench_output.json
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import threading
+import time
+
+from modules import llm_backends
+
+APP_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "streamlit_app.py")
+MODULE_COUNT = 4
+
+
+def build_scenario():
+    """模擬ユーザーの回答と、それに対するモック応答 (Module 1-4 + 総合フィードバック)"""
+    answers = []
+    replies = {}
+    for module in range(1, MODULE_COUNT + 1):
+        steps = [
+            (f"Module {module} への回答です。" + "具体的な行動と理由を説明します。" * 10,
+             "良い視点です。もう少し具体的に教えてください。" * 5),
+            (f"Module {module} の補足です。" + "関係者への伝え方を工夫します。" * 10,
+             "素晴らしい回答です。" * 20 + f"\n[[SCORE:{5 + module % 4}]]\n[[RATIONALE: 【項目別評価】" + "評価コメント。" * 30
+             + "]]\n今回の診断スコアと詳細な分析を知りたいですか？"),
+            (f"Module {module} のスコアを教えてください。",
+             "スコアの解説です。" * 20 + "\nそれでは次に進みます。" + "状況説明。" * 40),
+        ]
+        for answer, reply in steps:
+            answers.append(answer)
+            replies[answer] = reply
+    final = "ありがとうございました。総合フィードバックをお願いします。"
+    answers.append(final)
+    replies[final] = "総合フィードバックです。" * 150 + "\n[[SCORE:8]]\n[[RATIONALE: 総合評価]]\n\n[[END_OF_ASSESSMENT]]"
+    return answers, replies
+
+
+class TimingBackend:
+    """バックエンドをラップして、送信から最初のチャンクまでの時間を記録する"""
+    def __init__(self, inner, ttfts, lock):
+        self.inner = inner
+        self.ttfts = ttfts
+        self.lock = lock
+
+    def start_chat(self, history=None, system_instruction=None):
+        return self.inner.start_chat(history=history, system_instruction=system_instruction)
+
+    def send_message(self, chat_session, message, stream=False):
+        started = time.perf_counter()
+        if not stream:
+            return self.inner.send_message(chat_session, message)
+        return self._timed(self.inner.send_message(chat_session, message, stream=True), started)
+
+    def _timed(self, response, started):
+        first = True
+        for chunk in response:
+            if first:
+                with self.lock:
+                    self.ttfts.append((time.perf_counter() - started) * 1000)
+                first = False
+            yield chunk
+
+
+def read_rss_kib() -> int:
+    try:
+        with open("/proc/self/status", encoding="utf-8") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    import resource
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def percentiles(samples):
+    if not samples:
+        return None
+    ordered = sorted(samples)
+
+    def pick(q):
+        return round(ordered[min(len(ordered) - 1, int(q * len(ordered)))], 2)
+
+    return {"p50": pick(0.50), "p95": pick(0.95), "p99": pick(0.99), "mean": round(statistics.mean(ordered), 2),
+            "count": len(ordered)}
+
+
+def run_user(index: int, answers, timeout: float):
+    """1人分のアセスメントを最後まで進め、(ターンレイテンシ, 再実行時間, 開始時間, エラー) を返す"""
+    from streamlit.testing.v1 import AppTest
+
+    turn_latencies, reruns, openings, errors = [], [], [], []
+    at = AppTest.from_file(APP_PATH, default_timeout=timeout)
+    at.secrets["GEMINI_API_KEY"] = "load-test"
+    at.secrets["GEMINI_MODEL"] = "load-test-model"
+    at.secrets["LLM_BACKEND"] = llm_backends.BACKEND_MOCK
+
+    def timed(action, bucket):
+        started = time.perf_counter()
+        action()
+        bucket.append((time.perf_counter() - started) * 1000)
+        if at.exception:
+            errors.append(str(at.exception[0].value))
+
+    timed(at.run, reruns)
+    at.text_input(key="user_name").input(f"user{index}")
+    # 開始ボタンは冒頭の LLM 呼び出しを伴うため、LLM を呼ばない再実行とは分けて計測する
+    timed(at.button[0].click().run, openings)
+
+    for answer in answers:
+        if at.session_state.is_finished or not at.chat_input:
+            break
+        timed(at.chat_input[0].set_value(answer).run, turn_latencies)
+
+    if not at.session_state.is_finished:
+        errors.append(f"user{index}: assessment did not finish")
+    return turn_latencies, reruns, openings, errors
+
+
+def run_child(args):
+    """模擬ユーザー1人分 (子プロセス)。結果を1行のJSONで出力する"""
+    answers, replies = build_scenario()
+    ttfts = []
+    lock = threading.Lock()
+
+    def create_mock_backend(*_args, **_kwargs):
+        mock = llm_backends.MockBackend(
+            script=replies,
+            first_token_delay=args.first_token_delay,
+            chunk_size=args.chunk_size,
+            chunk_interval=args.chunk_interval,
+        )
+        return TimingBackend(mock, ttfts, lock)
+
+    # streamlit_app.py は実行のたびに modules.llm_backends から create_backend を読み込む
+    llm_backends.create_backend = create_mock_backend
+
+    # 読み込みにかかる時間の差で開始がずれないよう、指定された時刻まで待つ
+    time.sleep(max(0.0, args.start_at - time.time()))
+    rss_before = read_rss_kib()
+    try:
+        turn_latencies, reruns, openings, errors = run_user(args.child, answers, args.timeout)
+    except Exception as e:
+        turn_latencies, reruns, openings, errors = [], [], [], [f"user{args.child}: {type(e).__name__}: {e}"]
+    print(json.dumps({
+        "turn_latency_ms": turn_latencies,
+        "rerun_ms": reruns,
+        "opening_ms": openings,
+        "ttft_ms": ttfts,
+        "rss_kib": max(0, read_rss_kib() - rss_before),
+        "errors": errors,
+    }, ensure_ascii=False))
+
+
+def run_level(users: int, args):
+    command = [sys.executable, "-m", "benchmarks.load_test",
+               "--first-token-delay", str(args.first_token_delay), "--chunk-size", str(args.chunk_size),
+               "--chunk-interval", str(args.chunk_interval), "--timeout", str(args.timeout),
+               "--start-at", str(time.time() + args.startup_delay)]
+    started = time.perf_counter()
+    children = [subprocess.Popen(command + ["--child", str(i)], stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                                 text=True)
+                for i in range(users)]
+    results = []
+    for i, child in enumerate(children):
+        stdout, stderr = child.communicate()
+        try:
+            results.append(json.loads(stdout.strip().splitlines()[-1]))
+        except (IndexError, ValueError):
+            message = stderr.strip().splitlines()[-1] if stderr.strip() else f"exit code {child.returncode}"
+            results.append({"errors": [f"user{i}: child process failed: {message}"]})
+    elapsed = time.perf_counter() - started - args.startup_delay
+
+    def collect(name):
+        return [ms for result in results for ms in result.get(name, [])]
+
+    turn_latencies = collect("turn_latency_ms")
+    return {
+        "users": users,
+        "turn_latency_ms": percentiles(turn_latencies),
+        "ttft_ms": percentiles(collect("ttft_ms")),
+        "opening_ms": percentiles(collect("opening_ms")),
+        "rerun_ms": percentiles(collect("rerun_ms")),
+        "rss_per_session_kib": round(statistics.mean(result.get("rss_kib", 0) for result in results), 1),
+        "throughput_turns_per_s": round(len(turn_latencies) / elapsed, 2) if elapsed > 0 else None,
+        "errors": collect("errors"),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", default="1,5,10,20", help="comma separated concurrency levels")
+    parser.add_argument("--first-token-delay", type=float, default=0.8)
+    parser.add_argument("--chunk-size", type=int, default=20)
+    parser.add_argument("--chunk-interval", type=float, default=0.02)
+    parser.add_argument("--timeout", type=float, default=120.0)
+    parser.add_argument("--saturation-factor", type=float, default=2.0)
+    parser.add_argument("--startup-delay", type=float, default=10.0,
+                        help="seconds given to the user processes to import the app before starting together")
+    parser.add_argument("--output", help="write JSON results to this file")
+    parser.add_argument("--child", type=int, default=None, help=argparse.SUPPRESS)
+    parser.add_argument("--start-at", type=float, default=0.0, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child is not None:
+        run_child(args)
+        return
+
+    answers, _ = build_scenario()
+    levels = []
+    for users in [int(value) for value in args.users.split(",") if value]:
+        level = run_level(users, args)
+        if level["errors"]:
+            # 一部のユーザーだけの計測値は誤解を招くため出さない
+            for error in level["errors"]:
+                print(f"users={users}: {error}", file=sys.stderr)
+            sys.exit(1)
+        levels.append(level)
+        print(f"users={users:>4} turn_p95={level['turn_latency_ms']['p95']}ms "
+              f"ttft_p95={level['ttft_ms']['p95']}ms "
+              f"rss/session={level['rss_per_session_kib']}KiB", file=sys.stderr)
+
+    saturation = None
+    baseline = levels[0]["turn_latency_ms"] if levels else None
+    for level in levels[1:]:
+        if baseline and level["turn_latency_ms"] and \
+                level["turn_latency_ms"]["p95"] > baseline["p95"] * args.saturation_factor:
+            saturation = level["users"]
+            break
+
+    result = {
+        "config": {
+            "first_token_delay": args.first_token_delay,
+            "chunk_size": args.chunk_size,
+            "chunk_interval": args.chunk_interval,
+            "turns_per_user": len(answers),
+        },
+        "levels": levels,
+        "saturation_users": saturation,
+    }
+    output = json.dumps(result, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output)
+    print(output)
+
+
+if __name__ == "__main__":
+    main()
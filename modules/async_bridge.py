@@ -0,0 +1,104 @@
+"""
+同期コード (Streamlit のスクリプトスレッド) から非同期のストリームを読むための橋渡し
+
+プロセスで1つのイベントループをバックグラウンドのスレッドで動かし、全セッションの応答の読み込みを
+そのループに載せる。各ストリームのチャンクは SimpleQueue でスクリプトスレッドに渡すため、
+応答を待っている間に読み込み用のスレッドを1本ずつ抱えることがない。
+
+読み手が途中でやめた場合 (利用者の切断で Streamlit がスクリプトを止めた場合など) は、
+ジェネレーターの終了時にループ側のタスクをキャンセルして、上流への接続を閉じる。
+"""
+import asyncio
+import queue
+import threading
+
+_CHUNK = 0
+_DONE = 1
+_ERROR = 2
+
+
+class AsyncBridge:
+    """共有のイベントループ (最初に使うときにスレッドを起動する)"""
+    def __init__(self, name: str = "AsyncBridge"):
+        self.name = name
+        self.active = 0
+        self._loop = None
+        self._thread = None
+        self._lock = threading.Lock()
+
+    @property
+    def loop(self) -> asyncio.AbstractEventLoop:
+        if self._loop is None:
+            with self._lock:
+                if self._loop is None:
+                    loop = asyncio.new_event_loop()
+                    self._thread = threading.Thread(target=loop.run_forever, name=self.name, daemon=True)
+                    self._thread.start()
+                    self._loop = loop
+        return self._loop
+
+    def submit(self, coro):
+        """コルーチンをループで実行する。concurrent.futures.Future を返す (cancel() でタスクもキャンセルされる)"""
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    def run(self, coro, timeout: float = None):
+        """コルーチンをループで実行し、結果を待って返す"""
+        return self.submit(coro).result(timeout)
+
+    async def _pump(self, aiterable, chunks: queue.SimpleQueue):
+        self.active += 1
+        try:
+            async for item in aiterable:
+                chunks.put((_CHUNK, item))
+            chunks.put((_DONE, None))
+        except Exception as e:
+            chunks.put((_ERROR, e))
+        finally:
+            self.active -= 1
+            aclose = getattr(aiterable, "aclose", None)
+            if aclose is not None:
+                await aclose()
+
+    def stream(self, aiterable, timeout: float = None):
+        """
+        非同期イテラブルをループで読み、チャンクを順に返す (同期のジェネレーター)。
+        timeout 秒チャンクが届かなければ TimeoutError
+        """
+        chunks = queue.SimpleQueue()
+        future = self.submit(self._pump(aiterable, chunks))
+        try:
+            while True:
+                try:
+                    kind, item = chunks.get(timeout=timeout)
+                except queue.Empty:
+                    raise TimeoutError(f"No chunk for {timeout:.1f}s")
+                if kind == _DONE:
+                    return
+                if kind == _ERROR:
+                    raise item
+                yield item
+        finally:
+            # 読み終える前に閉じられた場合は、ループ側の読み込みを止める
+            future.cancel()
+
+    def stop(self):
+        with self._lock:
+            loop, self._loop = self._loop, None
+            thread, self._thread = self._thread, None
+        if loop is not None:
+            loop.call_soon_threadsafe(loop.stop)
+            thread.join()
+            loop.close()
+
+
+_bridge = None
+_bridge_lock = threading.Lock()
+
+
+def get_bridge() -> AsyncBridge:
+    """プロセスで共有するイベントループ"""
+    global _bridge
+    with _bridge_lock:
+        if _bridge is None:
+            _bridge = AsyncBridge()
+        return _bridge
@@ -0,0 +1,105 @@
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from modules.prompts import FINAL_STAGE, build_scoring_prompt
+
+# 採点依頼のメッセージの先頭 (モックバックエンドが採点依頼を見分けるためにも使う)
+SCORING_HEADER = "【採点依頼】"
+
+
+class ScoreResult:
+    """採点用の呼び出しの結果 (JSON) を解析したもの"""
+    __slots__ = ("total", "sub_scores", "comment", "response")
+
+    def __init__(self, total: int, sub_scores, comment: str = "", response=None):
+        self.total = total
+        self.sub_scores = sub_scores      # [{"criterion": str, "score": int, "comment": str}]
+        self.comment = comment
+        self.response = response          # 元の応答 (usage_metadata による使用量の計測用)
+
+    @property
+    def rationale(self) -> str:
+        """会話内で出力する [[RATIONALE]] と同じ書式の根拠"""
+        items = ", ".join(
+            f"{i}.{item.get('criterion', '')}:{item.get('score', '')}点({item.get('comment', '')})"
+            for i, item in enumerate(self.sub_scores, 1)
+        )
+        return f"【項目別評価】{items} / 【総合コメント】{self.comment}"
+
+
+def parse_scoring_result(text: str) -> ScoreResult:
+    """
+    採点用の応答からJSONを取り出す (コードブロックや前後の説明文が付いていても読めるようにする)
+    """
+    start, end = text.find("{"), text.rfind("}")
+    if start == -1 or end < start:
+        raise ValueError("Scoring response does not contain JSON")
+    data = json.loads(text[start:end + 1])
+    total = int(data["total"])
+    if not 1 <= total <= 10:
+        raise ValueError(f"Scoring total out of range: {total}")
+    sub_scores = [item for item in data.get("sub_scores", []) if isinstance(item, dict)]
+    return ScoreResult(total, sub_scores, str(data.get("rationale", "")).strip())
+
+
+def module_dialogue(records, end: int, stage: int) -> str:
+    """
+    records[end] (スコアを出した応答) までの、直前にスコアを出した応答より後の対話を採点用のテキストにする。
+    総合評価 (FINAL_STAGE) では Module 1-4 全体を振り返るため、各モジュールの評価と対話の全体を渡す
+    """
+    lines = []
+    if stage >= FINAL_STAGE:
+        begin = 0
+        results = [record for record in records[:end] if record.score is not None]
+        if results:
+            lines.append("【各モジュールの評価】\n" + "\n".join(
+                f"Module {i}: {record.score}点 {record.rationale}".rstrip() for i, record in enumerate(results, 1)
+            ))
+    else:
+        begin = end
+        while begin > 0 and records[begin - 1].score is None:
+            begin -= 1
+    for record in records[begin:end + 1]:
+        if not record.visible:
+            continue
+        speaker = "メンター" if record.role == "assistant" else "受検者"
+        lines.append(f"{speaker}: {record.clean}")
+    return "\n\n".join(lines)
+
+
+def score_module(backend, stage: int, dialogue: str) -> ScoreResult:
+    chat = backend.start_chat(history=[], system_instruction=build_scoring_prompt(stage))
+    response = backend.send_message(chat, f"{SCORING_HEADER}\n\n{dialogue}")
+    result = parse_scoring_result(response.text)
+    result.response = response
+    return result
+
+
+class PendingScore:
+    """採点待ちの1件 (どの記録・何番目のモジュールスコアに反映するか)"""
+    __slots__ = ("record_index", "score_index", "stage", "future")
+
+    def __init__(self, record_index: int, score_index: int, stage: int, future):
+        self.record_index = record_index
+        self.score_index = score_index
+        self.stage = stage
+        self.future = future
+
+
+# プロセス内で共有する採点用のスレッドプール
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor(max_workers: int = 8) -> ThreadPoolExecutor:
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="scoring")
+        return _executor
+
+
+def submit(backend, record_index: int, score_index: int, stage: int, dialogue: str) -> PendingScore:
+    future = get_executor().submit(score_module, backend, stage, dialogue)
+    return PendingScore(record_index, score_index, stage, future)
@@ -0,0 +1,179 @@
+"""
+受検者全体 (コホート) の中での位置づけ
+
+終了したセッションのモジュールごとのスコアを float32 の配列に追記し、
+一定間隔でヒストグラム (0.1 点刻み) を作り直す。順位の問い合わせはヒストグラムを引くだけなので、
+コホートが数十万件になっても一定時間で「上位 X%」を返せる。
+
+列: module1..module4, final (総合フィードバック), average (全スコアの平均)
+
+保存先はインスタンスごとのローカルファイル (COHORT_STORE_PATH) で、インスタンス間では共有しない。
+複数インスタンスで動かすと、各インスタンスが見た受検者だけの順位になり、インスタンスの入れ替えで失われる。
+そのため既定では無効 (COHORT_STATS=false) とし、1インスタンス構成か永続ボリュームを共有する場合のみ有効にする。
+"""
+import os
+import threading
+import time
+
+import numpy as np
+
+from modules.metering import stage_label
+from modules.prompts import FINAL_STAGE
+
+COLUMNS = tuple(stage_label(stage) for stage in range(1, FINAL_STAGE + 1)) + ("average",)
+AVERAGE_COLUMN = len(COLUMNS) - 1
+MAX_SCORE = 10
+# ヒストグラムの刻み (1点あたりのビン数)。平均スコアは 0.1 点単位に丸めて数える
+RESOLUTION = 10
+BINS = MAX_SCORE * RESOLUTION + 1
+
+
+def to_row(module_scores) -> np.ndarray:
+    """module_scores (段階順のスコアのリスト) を1行にする。まだない段階は NaN"""
+    row = np.full(len(COLUMNS), np.nan, dtype=np.float32)
+    scores = list(module_scores)[:FINAL_STAGE]
+    row[:len(scores)] = scores
+    if scores:
+        row[AVERAGE_COLUMN] = sum(scores) / len(scores)
+    return row
+
+
+class CohortStore:
+    """
+    スコアの配列 (行: セッション, 列: COLUMNS)。容量を倍々に増やしながら追記する。
+    path を指定すると行を float32 のバイナリとしてファイルに追記し、起動時に読み込む
+    """
+    def __init__(self, path: str = None, capacity: int = 1024):
+        self.path = path
+        self._data = np.full((capacity, len(COLUMNS)), np.nan, dtype=np.float32)
+        self._size = 0
+        self._lock = threading.Lock()
+        if path and os.path.exists(path):
+            values = np.fromfile(path, dtype=np.float32)
+            # 書き込み途中で終了した場合の端数の行は捨てる
+            rows = len(values) // len(COLUMNS)
+            self._append(values[:rows * len(COLUMNS)].reshape(rows, len(COLUMNS)))
+
+    def __len__(self) -> int:
+        return self._size
+
+    def append(self, module_scores):
+        self.extend(to_row(module_scores)[np.newaxis, :])
+
+    def extend(self, rows: np.ndarray):
+        rows = np.asarray(rows, dtype=np.float32).reshape(-1, len(COLUMNS))
+        with self._lock:
+            self._append(rows)
+            if self.path:
+                with open(self.path, "ab") as f:
+                    f.write(rows.tobytes())
+
+    def _append(self, rows: np.ndarray):
+        needed = self._size + len(rows)
+        if needed > len(self._data):
+            capacity = max(needed, len(self._data) * 2)
+            grown = np.full((capacity, len(COLUMNS)), np.nan, dtype=np.float32)
+            grown[:self._size] = self._data[:self._size]
+            self._data = grown
+        self._data[self._size:needed] = rows
+        self._size = needed
+
+    def view(self) -> np.ndarray:
+        # 追記は size より後ろにしか書き込まないため、コピーせずに返してよい
+        with self._lock:
+            return self._data[:self._size]
+
+
+class CohortStats:
+    """
+    ある時点のコホートから作ったヒストグラムと平均・標準偏差 (列ごと)
+    """
+    def __init__(self, data: np.ndarray):
+        self.size = len(data)
+        self.refreshed_at = time.monotonic()
+        valid = ~np.isnan(data)
+        # 全列のビン番号を列ごとにずらして1回の bincount で数える
+        bins = np.rint(np.nan_to_num(data) * RESOLUTION).astype(np.int64)
+        np.clip(bins, 0, BINS - 1, out=bins)
+        bins += np.arange(len(COLUMNS), dtype=np.int64) * BINS
+        self.counts = np.bincount(bins[valid], minlength=len(COLUMNS) * BINS).reshape(len(COLUMNS), BINS)
+        self.n = self.counts.sum(axis=1)
+        # at_or_above[c, b]: 列 c でビン b 以上の件数
+        self.at_or_above = np.cumsum(self.counts[:, ::-1], axis=1)[:, ::-1]
+
+        totals = np.where(valid, data, 0).sum(axis=0, dtype=np.float64)
+        squares = np.where(valid, np.square(data, dtype=np.float64), 0).sum(axis=0)
+        n = np.maximum(self.n, 1)
+        self.mean = totals / n
+        self.std = np.sqrt(np.maximum(squares / n - self.mean ** 2, 0))
+
+    def rank(self, column: int, score: float):
+        """
+        (上位 X%, パーセンタイル, zスコア, 件数) を返す。上位 X% は同点を含めた割合。
+        該当する列のデータがなければ None
+        """
+        n = int(self.n[column])
+        if not n:
+            return None
+        b = min(max(int(round(score * RESOLUTION)), 0), BINS - 1)
+        at_or_above = int(self.at_or_above[column, b])
+        equal = int(self.counts[column, b])
+        top_percent = at_or_above / n * 100
+        percentile = (n - at_or_above + equal / 2) / n * 100
+        std = self.std[column]
+        z = float((score - self.mean[column]) / std) if std > 0 else 0.0
+        return top_percent, percentile, z, n
+
+    def rank_many(self, column: int, scores: np.ndarray):
+        """rank のベクトル版。(上位 X%, パーセンタイル, zスコア) の配列を返す"""
+        n = max(int(self.n[column]), 1)
+        b = np.clip(np.rint(np.asarray(scores) * RESOLUTION).astype(np.int64), 0, BINS - 1)
+        at_or_above = self.at_or_above[column, b]
+        top_percent = at_or_above / n * 100
+        percentile = (n - at_or_above + self.counts[column, b] / 2) / n * 100
+        std = self.std[column]
+        z = (scores - self.mean[column]) / std if std > 0 else np.zeros(len(b))
+        return top_percent, percentile, z
+
+
+class CohortEngine:
+    """
+    CohortStore と、バックグラウンドで一定間隔ごとに作り直す CohortStats。
+    問い合わせは直近の CohortStats を引くだけで、問い合わせのたびに集計しない
+    """
+    def __init__(self, store: CohortStore, refresh_interval: float = 300.0, min_cohort: int = 30):
+        self.store = store
+        self.refresh_interval = refresh_interval
+        self.min_cohort = min_cohort
+        self._stats = CohortStats(store.view())
+        self._stop = threading.Event()
+        self._worker = threading.Thread(target=self._run, name="CohortEngine", daemon=True)
+        self._worker.start()
+
+    def record(self, module_scores):
+        if module_scores:
+            self.store.append(module_scores)
+
+    def refresh(self) -> CohortStats:
+        self._stats = CohortStats(self.store.view())
+        return self._stats
+
+    def _run(self):
+        while not self._stop.wait(self.refresh_interval):
+            if len(self.store) != self._stats.size:
+                self.refresh()
+
+    @property
+    def stats(self) -> CohortStats:
+        return self._stats
+
+    def rank(self, column: int, score: float):
+        """コホートが min_cohort 件に満たなければ None (少数での順位は意味を持たないため)"""
+        stats = self._stats
+        if stats.n[column] < self.min_cohort:
+            return None
+        return stats.rank(column, score)
+
+    def close(self):
+        self._stop.set()
+        self._worker.join()
@@ -0,0 +1,209 @@
+import datetime
+import hashlib
+import threading
+import time
+
+# キャッシュ作成に失敗した後、再作成を試みるまでの待機秒数
+RETRY_AFTER_FAILURE = 300.0
+
+
+class CacheEntry:
+    def __init__(self, name: str, expire_at: float, prompt_version: str):
+        self.name = name
+        self.expire_at = expire_at
+        self.prompt_version = prompt_version
+
+
+class GeminiCacheBackend:
+    """
+    google-genai の caches API を使うバックエンド
+    """
+    def __init__(self, genai_client):
+        self.client = genai_client
+
+    def create(self, model: str, system_instruction: str, ttl_seconds: int):
+        from google.genai import types
+        cache = self.client.caches.create(
+            model=model,
+            config=types.CreateCachedContentConfig(
+                display_name="assessment-system-prompt",
+                system_instruction=system_instruction,
+                ttl=f"{int(ttl_seconds)}s",
+            ),
+        )
+        return cache.name, _expire_at(cache, ttl_seconds)
+
+    def refresh(self, name: str, ttl_seconds: int):
+        from google.genai import types
+        cache = self.client.caches.update(
+            name=name,
+            config=types.UpdateCachedContentConfig(ttl=f"{int(ttl_seconds)}s"),
+        )
+        return _expire_at(cache, ttl_seconds)
+
+    def delete(self, name: str):
+        self.client.caches.delete(name=name)
+
+
+def is_cache_error(exc: Exception) -> bool:
+    """
+    cached content が見つからない・使えない (期限切れで削除された等) ことによるエラーか。
+    それ以外 (429 / 5xx / タイムアウトなど) は送り直しても解決しないため、再試行の層に任せる
+    """
+    code = getattr(exc, "code", None) or getattr(exc, "status_code", None)
+    if code not in (400, 404):
+        return False
+    message = str(exc).lower()
+    return "cachedcontent" in message or "cached content" in message or "cached_content" in message
+
+
+def _expire_at(cache, ttl_seconds: int) -> float:
+    # サーバーが返す有効期限を monotonic 時刻に換算する（取得できなければTTLから計算）
+    expire_time = getattr(cache, "expire_time", None)
+    if isinstance(expire_time, datetime.datetime):
+        remaining = (expire_time - datetime.datetime.now(datetime.timezone.utc)).total_seconds()
+        return time.monotonic() + max(0.0, remaining)
+    return time.monotonic() + ttl_seconds
+
+
+class FakeCacheBackend:
+    """
+    ネットワークなしでキャッシュのライフサイクルを確認するためのバックエンド。
+    min_chars より短いプロンプトや fail=True のときは作成に失敗する（実APIの最小トークン数制限の模擬）。
+    """
+    def __init__(self, min_chars: int = 0, fail: bool = False):
+        self.min_chars = min_chars
+        self.fail = fail
+        self.caches = {}
+        self.created = 0
+        self.refreshed = 0
+        self.deleted = 0
+        self._lock = threading.Lock()
+
+    def create(self, model: str, system_instruction: str, ttl_seconds: int):
+        if self.fail or len(system_instruction) < self.min_chars:
+            raise RuntimeError("FakeCacheBackend: cannot create cached content")
+        with self._lock:
+            self.created += 1
+            name = f"cachedContents/fake-{self.created}"
+            self.caches[name] = (model, system_instruction)
+        return name, time.monotonic() + ttl_seconds
+
+    def refresh(self, name: str, ttl_seconds: int):
+        with self._lock:
+            if name not in self.caches:
+                raise KeyError(name)
+            self.refreshed += 1
+        return time.monotonic() + ttl_seconds
+
+    def delete(self, name: str):
+        with self._lock:
+            self.caches.pop(name, None)
+            self.deleted += 1
+
+
+class ContextCacheManager:
+    """
+    システムプロンプト（静的なプレフィックス）の cached content をプロセス単位で管理する。
+
+    - (モデル, プロンプト内容ハッシュ) ごとに1つのキャッシュを作成して共有する
+    - 有効期限の refresh_margin 秒前になったらTTLを延長する
+    - prompts.md の内容が変わったら古いバージョンのキャッシュを削除する
+    - 作成に失敗した場合は None を返し、呼び出し側は通常の system_instruction にフォールバックする
+    """
+    def __init__(self, backend, ttl_seconds: int = 3600, refresh_margin: float = 300.0):
+        self.backend = backend
+        self.ttl_seconds = ttl_seconds
+        self.refresh_margin = refresh_margin
+        self._entries = {}
+        self._failed_until = {}
+        self._key_locks = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.failures = 0
+
+    @staticmethod
+    def _make_key(model: str, system_instruction: str):
+        return (model, hashlib.sha256(system_instruction.encode("utf-8")).hexdigest())
+
+    def get(self, model: str, system_instruction: str, prompt_version: str = ""):
+        """
+        キャッシュ名を返す。キャッシュを使えない場合は None
+        """
+        key = self._make_key(model, system_instruction)
+        self._drop_stale_versions(prompt_version)
+
+        name = self._lookup(key)
+        if name is not None:
+            return name
+
+        with self._lock:
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+
+        # 同じキーの作成・更新は1スレッドだけが行い、他のスレッドはその結果を使う
+        with key_lock:
+            name = self._lookup(key)
+            if name is not None:
+                return name
+
+            now = time.monotonic()
+            with self._lock:
+                if self._failed_until.get(key, 0) > now:
+                    return None
+                entry = self._entries.get(key)
+
+            try:
+                if entry is not None and now < entry.expire_at:
+                    expire_at = self.backend.refresh(entry.name, self.ttl_seconds)
+                    entry = CacheEntry(entry.name, expire_at, prompt_version)
+                else:
+                    self.misses += 1
+                    name, expire_at = self.backend.create(model, system_instruction, self.ttl_seconds)
+                    entry = CacheEntry(name, expire_at, prompt_version)
+            except Exception:
+                self.failures += 1
+                with self._lock:
+                    self._entries.pop(key, None)
+                    self._failed_until[key] = now + RETRY_AFTER_FAILURE
+                return None
+
+            with self._lock:
+                self._entries[key] = entry
+            return entry.name
+
+    def _lookup(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and time.monotonic() < entry.expire_at - self.refresh_margin:
+                self.hits += 1
+                return entry.name
+        return None
+
+    def invalidate(self, name: str):
+        """
+        送信時にキャッシュが見つからない等のエラーが出た場合に呼び出す。
+        サーバー側に残っていれば TTL まで残らないよう削除する
+        """
+        with self._lock:
+            for key, entry in list(self._entries.items()):
+                if entry.name == name:
+                    del self._entries[key]
+        try:
+            self.backend.delete(name)
+        except Exception:
+            pass
+
+    def _drop_stale_versions(self, prompt_version: str):
+        with self._lock:
+            stale = [
+                (key, entry) for key, entry in self._entries.items()
+                if entry.prompt_version != prompt_version
+            ]
+            for key, _ in stale:
+                del self._entries[key]
+        for _, entry in stale:
+            try:
+                self.backend.delete(entry.name)
+            except Exception:
+                pass
@@ -0,0 +1,93 @@
+import re
+import threading
+import time
+
+_A1_RANGE = re.compile(r"^([A-Z]+)(\d+):([A-Z]+)(\d+)$")
+
+
+def _column_index(letters: str) -> int:
+    index = 0
+    for letter in letters:
+        index = index * 26 + ord(letter) - ord("A") + 1
+    return index - 1
+
+
+class FakeWorksheet:
+    """
+    gspread.Worksheet の代わりに使うローカルのワークシート。
+    ネットワークなしでハンドラのスループットやリトライ動作を確認するために使う。
+
+    latency: 1回のAPI呼び出しごとに待機する秒数（Sheets APIの往復時間の模擬）
+    fail_times: 最初のN回の書き込みを失敗させる（リトライの確認用）
+    row_latency: 読み込む1行ごとに追加で待機する秒数（シートが大きいほど全件取得が遅くなることの模擬）
+    """
+    def __init__(self, rows=None, latency: float = 0.0, fail_times: int = 0, row_latency: float = 0.0):
+        self.rows = [list(row) for row in (rows or [])]
+        self.latency = latency
+        self.fail_times = fail_times
+        self.row_latency = row_latency
+        self.rows_read = 0
+        self.api_calls = 0
+        self._lock = threading.Lock()
+
+    def _call(self):
+        with self._lock:
+            self.api_calls += 1
+            if self.fail_times > 0:
+                self.fail_times -= 1
+                raise ConnectionError("FakeWorksheet: injected failure")
+        if self.latency:
+            time.sleep(self.latency)
+
+    def append_row(self, values, **kwargs):
+        self._call()
+        with self._lock:
+            self.rows.append(list(values))
+
+    def append_rows(self, values, **kwargs):
+        self._call()
+        with self._lock:
+            self.rows.extend(list(row) for row in values)
+
+    def row_values(self, row: int, **kwargs):
+        self._call()
+        with self._lock:
+            if row - 1 < len(self.rows):
+                return list(self.rows[row - 1])
+            return []
+
+    def get_all_values(self, **kwargs):
+        self._call()
+        with self._lock:
+            values = [list(row) for row in self.rows]
+        self._transfer(len(values))
+        return values
+
+    def get_values(self, range_name: str, **kwargs):
+        self._call()
+        values = self._read_range(range_name)
+        self._transfer(len(values))
+        return values
+
+    def batch_get(self, ranges, **kwargs):
+        # 複数の範囲を1回のAPI呼び出しで取得する
+        self._call()
+        results = [self._read_range(range_name) for range_name in ranges]
+        self._transfer(sum(len(values) for values in results))
+        return results
+
+    def _read_range(self, range_name: str):
+        # "A2:D1001" 形式のみ対応。実際の API と同じく、末尾の空行は返さない
+        match = _A1_RANGE.match(range_name)
+        if match is None:
+            raise ValueError(f"FakeWorksheet: unsupported range {range_name!r}")
+        first_col, first_row, last_col, last_row = match.groups()
+        cols = slice(_column_index(first_col), _column_index(last_col) + 1)
+        with self._lock:
+            return [list(row[cols]) for row in self.rows[int(first_row) - 1:int(last_row)]]
+
+    def _transfer(self, rows: int):
+        with self._lock:
+            self.rows_read += rows
+        if self.row_latency and rows:
+            time.sleep(self.row_latency * rows)
@@ -1,33 +1,668 @@
-from google import genai
-from google.genai import types
-from modules.prompts import SYSTEM_PROMPT
+import asyncio
+import collections
+import functools
+import hashlib
+import inspect
+import queue
+import random
+import threading
+import time
+from dataclasses import dataclass
+
+from modules import prompts
+from modules.metrics import timer
+from modules.context_cache import ContextCacheManager, GeminiCacheBackend, is_cache_error
 
 class GeminiClient:
-    def __init__(self, api_key: str, model_name: str):
-        
+    """
+    async_mode: SDK の非同期クライアント (client.aio) で送信し、共有のイベントループ (async_bridge) で応答を読む。
+                send_message の戻り値は同期のまま (ストリームは同期のイテレーター) なので呼び出し側は変わらない
+    """
+    def __init__(self, api_key: str, model_name: str, async_mode: bool = False):
+
+        # google-genai の読み込みは重いため、最初にクライアントを作るときまで遅らせる (起動時間の短縮)
+        from google import genai
+
         print(f"--- Using Gemini Model (google-genai): {model_name} ---") # デバッグ用にモデル名を出力
 
+        # HttpOptions.timeout は接続だけでなくリクエスト全体 (ストリームの読み終わりまで) の制限時間になり、
+        # 長い応答を打ち切ってしまうため設定しない。待ち時間の制限は ResilientBackend のタイムアウトで行う
         self.client = genai.Client(api_key=api_key)
         self.model_name = model_name
+        self.async_mode = async_mode
+        self.last_used = time.monotonic()
+        self.last_checked = self.last_used
+        self.context_cache = None
+        # 送信中の呼び出し数。プールから外したクライアントは、これが 0 になってから閉じる
+        self._in_flight = 0
+        self._retired = False
+        self._closed = False
+        self._lock = threading.Lock()
+        # 同じクライアントを使う全セッションで、上流の状態と最初のチャンクまでの時間を共有する
+        self.circuit_breaker = CircuitBreaker()
+        self.first_token_latency = LatencyTracker()
+
+    def enable_context_cache(self, ttl_seconds: int = 3600, backend=None):
+        """
+        システムプロンプトを cached content としてサーバー側にキャッシュするモードを有効にする
+        """
+        if self.context_cache is None:
+            if backend is None:
+                backend = GeminiCacheBackend(self.client)
+            self.context_cache = ContextCacheManager(backend, ttl_seconds=ttl_seconds)
+        return self.context_cache
+
+    def start_chat(self, history=None, system_instruction: str = None):
+        from google.genai import types
 
-    def start_chat(self, history=None):
         if history is None:
             history = []
-        
+        if system_instruction is None:
+            system_instruction = prompts.get_system_prompt()
+
         # History format adaptation might be needed if history is not empty.
         # But app.py starts with empty history usually.
-        
-        chat = self.client.chats.create(
+
+        cache_name = None
+        if self.context_cache is not None:
+            cache_name = self.context_cache.get(self.model_name, system_instruction, prompts.PROMPT_HASH)
+
+        if cache_name:
+            config = types.GenerateContentConfig(cached_content=cache_name)
+        else:
+            config = types.GenerateContentConfig(system_instruction=system_instruction)
+
+        chat = self._chats().create(
             model=self.model_name,
-            config=types.GenerateContentConfig(
-                system_instruction=SYSTEM_PROMPT
-            ),
+            config=config,
             history=history
         )
+        if cache_name:
+            # キャッシュが使えなかった場合に通常の送信へ切り替えるための情報
+            chat._context_cache_fallback = (cache_name, list(history), system_instruction)
         return chat
 
+    def _chats(self):
+        return self.client.aio.chats if self.async_mode else self.client.chats
+
+    @staticmethod
+    def _should_fall_back(chat_session, exc: Exception) -> bool:
+        # キャッシュ自体が使えない場合だけ送り直す (429 / 5xx などを二重に送らない)
+        return getattr(chat_session, "_context_cache_fallback", None) is not None and is_cache_error(exc)
+
+    def _without_cache(self, chat_session):
+        from google.genai import types
+
+        cache_name, history, system_instruction = chat_session._context_cache_fallback
+        self.context_cache.invalidate(cache_name)
+        return self._chats().create(
+            model=self.model_name,
+            config=types.GenerateContentConfig(system_instruction=system_instruction),
+            history=history
+        )
+
     def send_message(self, chat_session, message: str, stream: bool = False):
+        if self.async_mode:
+            from modules.async_bridge import get_bridge
+            if stream:
+                return get_bridge().stream(self.astream(chat_session, message))
+            return get_bridge().run(self._asend(chat_session, message))
+
         if stream:
-            return chat_session.send_message_stream(message)
-        else:
-            return chat_session.send_message(message)
\ No newline at end of file
+            return self._tracked_stream(chat_session, message)
+        self._acquire()
+        try:
+            try:
+                return chat_session.send_message(message)
+            except Exception as e:
+                if not self._should_fall_back(chat_session, e):
+                    raise
+                return self._without_cache(chat_session).send_message(message)
+        finally:
+            self._release()
+
+    def _tracked_stream(self, chat_session, message: str):
+        # 読み始めてから読み終わる (または途中で閉じられる) までを送信中として数える
+        self._acquire()
+        try:
+            if getattr(chat_session, "_context_cache_fallback", None) is not None:
+                yield from self._stream_with_fallback(chat_session, message)
+            else:
+                yield from chat_session.send_message_stream(message)
+        finally:
+            self._release()
+
+    def _stream_with_fallback(self, chat_session, message: str):
+        # 最初のチャンクが届く前にエラーになった場合のみ、キャッシュなしで送り直す
+        received = False
+        try:
+            for chunk in chat_session.send_message_stream(message):
+                received = True
+                yield chunk
+        except Exception as e:
+            if received or not self._should_fall_back(chat_session, e):
+                raise
+            yield from self._without_cache(chat_session).send_message_stream(message)
+
+    async def astream(self, chat_session, message: str):
+        """
+        非同期モードのストリーミング送信 (共有のイベントループ上で実行する)。
+        コンテキストキャッシュの扱いは _stream_with_fallback と同じ
+        """
+        self._acquire()
+        received = False
+        try:
+            async for chunk in await _open_stream(chat_session, message):
+                received = True
+                yield chunk
+        except Exception as e:
+            if received or not self._should_fall_back(chat_session, e):
+                raise
+            # キャッシュの削除 (同期の API 呼び出し) でループを止めないよう、別スレッドで行う
+            retry_chat = await asyncio.to_thread(self._without_cache, chat_session)
+            async for chunk in await _open_stream(retry_chat, message):
+                yield chunk
+        finally:
+            self._release()
+
+    async def _asend(self, chat_session, message: str):
+        self._acquire()
+        try:
+            return await chat_session.send_message(message)
+        except Exception as e:
+            if not self._should_fall_back(chat_session, e):
+                raise
+            retry_chat = await asyncio.to_thread(self._without_cache, chat_session)
+            return await retry_chat.send_message(message)
+        finally:
+            self._release()
+
+    def _acquire(self):
+        with self._lock:
+            self._in_flight += 1
+
+    def _release(self):
+        with self._lock:
+            self._in_flight -= 1
+            close_now = self._retired and not self._in_flight
+        if close_now:
+            # イベントループ上から呼ばれることもあるため、閉じる処理は別スレッドで行う
+            threading.Thread(target=self.close, name="GeminiClientClose", daemon=True).start()
+
+    def retire(self):
+        """
+        プールから外したクライアントを閉じる。送信中の呼び出しがあれば、最後の呼び出しが終わったときに閉じる
+        """
+        with self._lock:
+            self._retired = True
+            close_now = not self._in_flight
+        if close_now:
+            self.close()
+
+    def health_check(self) -> bool:
+        """
+        モデル情報を取得できるかで接続の健全性を確認する（軽量なメタデータAPIのみ呼び出す）
+        """
+        try:
+            self.client.models.get(model=self.model_name)
+            return True
+        except Exception:
+            return False
+
+    def close(self):
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+        # SDKのバージョンによっては close() が存在しないため、あれば呼び出す
+        close = getattr(self.client, "close", None)
+        if callable(close):
+            try:
+                close()
+            except Exception:
+                pass
+        aclose = getattr(self.client.aio, "aclose", None) if self.async_mode else None
+        if callable(aclose):
+            from modules.async_bridge import get_bridge
+            try:
+                get_bridge().run(aclose(), timeout=5.0)
+            except Exception:
+                pass
+
+
+async def _open_stream(chat_session, message: str):
+    # SDK のバージョンにより、send_message_stream は非同期イテレーターか、それを返すコルーチン
+    stream = chat_session.send_message_stream(message)
+    if inspect.isawaitable(stream):
+        stream = await stream
+    return stream
+
+
+# --- Resilience ---
+class GeminiTimeout(Exception):
+    """最初のチャンク・次のチャンクが制限時間内に届かなかった"""
+
+
+class CircuitOpenError(Exception):
+    """上流の障害が続いているため、呼び出しを行わずに失敗させた"""
+
+
+# 再試行してよいHTTPステータス (タイムアウト・レート制限・サーバー側の一時的な障害)
+RETRYABLE_STATUS = (408, 429, 500, 502, 503, 504)
+
+
+def is_retryable(exc: Exception) -> bool:
+    """
+    エラーを分類する。一時的な障害なら True、リクエスト自体の誤り (400 / 401 / 403 / 404 など) なら False
+    """
+    if isinstance(exc, (GeminiTimeout, TimeoutError, ConnectionError)):
+        return True
+    code = getattr(exc, "code", None) or getattr(exc, "status_code", None)
+    if isinstance(code, int):
+        return code in RETRYABLE_STATUS
+    # httpx などの通信エラー (クラス名で判定し、依存パッケージを直接 import しない)
+    name = type(exc).__name__
+    return name.endswith(("Timeout", "TimeoutException", "ConnectError", "RemoteProtocolError", "ReadError"))
+
+
+@dataclass
+class ResilienceConfig:
+    # 最初のチャンクまで / チャンク間の制限時間 (秒)
+    first_token_timeout: float = 30.0
+    idle_timeout: float = 30.0
+    # 非ストリーミング呼び出しの応答全体の制限時間
+    response_timeout: float = 60.0
+    # 最初のチャンクが届く前の失敗だけを再試行する (表示済みの応答を重複させないため)
+    max_attempts: int = 3
+    backoff_base: float = 0.5
+    backoff_max: float = 8.0
+    # ヘッジ: 最初のチャンクが p95 を過ぎても届かなければ、同じリクエストをもう1本送る
+    hedge: bool = False
+    hedge_percentile: float = 0.95
+    hedge_min_delay: float = 1.0
+    hedge_default_delay: float = 8.0
+    hedge_min_samples: int = 20
+
+
+class CircuitBreaker:
+    """
+    連続した失敗が failure_threshold に達したら recovery_time 秒間呼び出しを止める。
+    その後は1件だけ試行し (half-open)、成功すれば再開、失敗すればまた止める。
+    """
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold: int = 5, recovery_time: float = 30.0, clock=time.monotonic):
+        self.failure_threshold = failure_threshold
+        self.recovery_time = recovery_time
+        self._clock = clock
+        self._lock = threading.Lock()
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.rejected = 0
+
+    def before_call(self):
+        with self._lock:
+            if self.state == self.OPEN and self._clock() - self.opened_at >= self.recovery_time:
+                self.state = self.HALF_OPEN
+                return
+            if self.state != self.CLOSED:
+                self.rejected += 1
+                raise CircuitOpenError("Gemini upstream is unavailable; calls are suspended")
+
+    def record_success(self):
+        with self._lock:
+            self.state = self.CLOSED
+            self.failures = 0
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                self.state = self.OPEN
+                self.opened_at = self._clock()
+
+    def release(self):
+        """
+        結果が分からないまま終わった呼び出し (途中で読み捨てたストリームなど)。
+        half-open の試行だった場合は枠を空け、次の呼び出しで改めて試行する
+        """
+        with self._lock:
+            if self.state == self.HALF_OPEN:
+                self.state = self.OPEN
+                self.opened_at = self._clock() - self.recovery_time
+
+
+class LatencyTracker:
+    """直近の最初のチャンクまでの時間 (秒) を保持し、パーセンタイルを返す"""
+    def __init__(self, maxlen: int = 200):
+        self._samples = collections.deque(maxlen=maxlen)
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._samples)
+
+    def record(self, seconds: float):
+        with self._lock:
+            self._samples.append(seconds)
+
+    def percentile(self, q: float):
+        with self._lock:
+            ordered = sorted(self._samples)
+        if not ordered:
+            return None
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+_DONE = object()
+
+
+class _Attempt:
+    """1回分の送信をワーカースレッドで実行し、チャンク (または例外) を共有キューに入れる"""
+    def __init__(self, produce, results: queue.Queue):
+        self.cancelled = False
+        self._produce = produce
+        self._results = results
+        threading.Thread(target=self._run, name="GeminiAttempt", daemon=True).start()
+
+    def _run(self):
+        try:
+            for item in self._produce():
+                if self.cancelled:
+                    return
+                self._results.put((self, item))
+            self._results.put((self, _DONE))
+        except Exception as e:
+            if not self.cancelled:
+                self._results.put((self, e))
+
+
+class _AsyncAttempt:
+    """
+    1回分の送信を共有のイベントループで実行し、チャンク (または例外) を共有キューに入れる。
+    _Attempt と違い試行ごとに読み込み用のスレッドを作らず (チャットの作成だけループの共有スレッドプールで行う)、
+    cancelled を立てるとループ側のタスクをキャンセルする
+    """
+    def __init__(self, produce, results: queue.Queue):
+        from modules.async_bridge import get_bridge
+
+        self._cancelled = False
+        self._results = results
+        self._future = get_bridge().submit(self._run(produce))
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancelled
+
+    @cancelled.setter
+    def cancelled(self, value: bool):
+        self._cancelled = value
+        if value and self._future is not None:
+            self._future.cancel()
+
+    async def _run(self, produce):
+        try:
+            # チャットの作成 (コンテキストキャッシュの確認・作成を含む) は同期処理なので、ループを止めないよう
+            # 別スレッドで行う。呼び出し元は結果をキューで待つため、作成にかかる時間も試行の制限時間に含まれる
+            stream = await asyncio.to_thread(produce)
+            async for item in stream:
+                self._results.put((self, item))
+            self._results.put((self, _DONE))
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            if not self._cancelled:
+                self._results.put((self, e))
+
+
+class ResilientBackend:
+    """
+    バックエンドをラップし、タイムアウト・分類した再試行・ヘッジ・サーキットブレーカーを適用する。
+
+    再試行やヘッジでは同じチャットを使い回さず、start_chat に渡された履歴から毎回チャットを作り直す。
+    応答を読み込むスレッドが止まっても、Streamlit のスレッドは制限時間で GeminiTimeout を受け取って戻る。
+    """
+    def __init__(self, inner, config: ResilienceConfig = None, breaker: CircuitBreaker = None,
+                 latency: LatencyTracker = None, on_extra_attempt=None):
+        self.inner = inner
+        # 再試行・ヘッジで試行を追加するたびに (履歴, システムプロンプト, メッセージ) で呼ばれる (流量制御への計上用)
+        self.on_extra_attempt = on_extra_attempt
+        self.config = config or ResilienceConfig()
+        self.breaker = breaker or CircuitBreaker()
+        self.latency = latency or LatencyTracker()
+        self.retries = 0
+        self.hedges = 0
+
+    def start_chat(self, history=None, system_instruction: str = None):
+        return (list(history or []), system_instruction)
+
+    def send_message(self, chat_session, message: str, stream: bool = False):
+        if stream:
+            return self._stream(chat_session, message)
+        attempt, item, _ = self._start(chat_session, message, stream=False)
+        attempt.cancelled = True
+        self.breaker.record_success()
+        return item
+
+    def _produce(self, chat_session, message: str, stream: bool):
+        """1回分の試行を開始する関数 (results を受け取り、試行を返す)"""
+        history, system_instruction = chat_session
+
+        if stream and getattr(self.inner, "async_mode", False):
+            # 非同期モードのクライアントは共有のイベントループで読み込み、試行ごとにスレッドを作らない
+            def produce_async():
+                chat = self.inner.start_chat(history=history, system_instruction=system_instruction)
+                return self.inner.astream(chat, message)
+            return functools.partial(_AsyncAttempt, produce_async)
+
+        def produce():
+            chat = self.inner.start_chat(history=history, system_instruction=system_instruction)
+            if stream:
+                return self.inner.send_message(chat, message, stream=True)
+            return [self.inner.send_message(chat, message)]
+        return functools.partial(_Attempt, produce)
+
+    def _backoff(self, retry: int) -> float:
+        # full jitter: 0 〜 base * 2^retry (上限 backoff_max) の一様乱数
+        return random.uniform(0, min(self.config.backoff_max, self.config.backoff_base * 2 ** retry))
+
+    def _hedge_delay(self) -> float:
+        config = self.config
+        if len(self.latency) < config.hedge_min_samples:
+            return config.hedge_default_delay
+        return max(config.hedge_min_delay, self.latency.percentile(config.hedge_percentile))
+
+    def _start(self, chat_session, message: str, stream: bool):
+        """最初のチャンクが届くまで、再試行を含めて実行する"""
+        for retry in range(self.config.max_attempts):
+            self.breaker.before_call()
+            try:
+                return self._race(chat_session, message, stream, retry)
+            except Exception as e:
+                if not is_retryable(e):
+                    # リクエスト自体の誤りは上流が応答できている証拠なので、障害には数えない
+                    self.breaker.record_success()
+                    raise
+                self.breaker.record_failure()
+                if retry + 1 >= self.config.max_attempts:
+                    raise
+                self.retries += 1
+                time.sleep(self._backoff(retry))
+            except BaseException:
+                # Streamlit の再実行・停止 (StopException など) で待つのをやめた場合
+                self.breaker.release()
+                raise
+
+    def _race(self, chat_session, message: str, stream: bool, retry: int = 0):
+        config = self.config
+        results = queue.Queue()
+        produce = self._produce(chat_session, message, stream)
+
+        def launch(extra: bool):
+            if extra and self.on_extra_attempt is not None:
+                self.on_extra_attempt(chat_session[0], chat_session[1], message)
+            return produce(results)
+
+        started = time.monotonic()
+        deadline = started + (config.first_token_timeout if stream else config.response_timeout)
+        hedge_at = started + self._hedge_delay() if config.hedge else None
+        attempts = [launch(retry > 0)]
+        running = 1
+
+        while True:
+            now = time.monotonic()
+            wake = deadline if hedge_at is None else min(deadline, hedge_at)
+            try:
+                attempt, item = results.get(timeout=max(0.0, wake - now))
+            except queue.Empty:
+                if time.monotonic() >= deadline:
+                    for attempt in attempts:
+                        attempt.cancelled = True
+                    raise GeminiTimeout(f"No response within {deadline - started:.1f}s")
+                if hedge_at is not None and time.monotonic() >= hedge_at:
+                    attempts.append(launch(True))
+                    running += 1
+                    self.hedges += 1
+                    hedge_at = None
+                continue
+
+            if isinstance(item, Exception):
+                running -= 1
+                if running:
+                    # ヘッジした他方がまだ応答する可能性がある
+                    continue
+                raise item
+
+            # 最初に応答した方を採用し、もう一方は読み捨てる
+            for other in attempts:
+                if other is not attempt:
+                    other.cancelled = True
+            self.latency.record(time.monotonic() - started)
+            return attempt, item, results
+
+    def _next(self, attempt: _Attempt, results: queue.Queue):
+        deadline = time.monotonic() + self.config.idle_timeout
+        while True:
+            try:
+                source, item = results.get(timeout=max(0.0, deadline - time.monotonic()))
+            except queue.Empty:
+                raise GeminiTimeout(f"No chunk for {self.config.idle_timeout:.1f}s")
+            if source is attempt:
+                return item
+
+    def _stream(self, chat_session, message: str):
+        attempt, item, results = self._start(chat_session, message, stream=True)
+        settled = False
+        try:
+            while item is not _DONE:
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+                item = self._next(attempt, results)
+            self.breaker.record_success()
+            settled = True
+        except Exception as e:
+            if is_retryable(e):
+                self.breaker.record_failure()
+            else:
+                self.breaker.record_success()
+            settled = True
+            raise
+        finally:
+            attempt.cancelled = True
+            if not settled:
+                # 読み手が途中でやめた (GeneratorExit / Streamlit の RerunException・StopException)
+                self.breaker.release()
+
+
+# --- Client Pool ---
+class GeminiClientPool:
+    """
+    プロセス全体で共有する GeminiClient のプール。
+
+    (api_key, model_name) ごとに1つのクライアントを保持し、HTTPコネクションを
+    セッション・ターンをまたいで再利用する。一定時間使われなかったクライアントは破棄し、
+    しばらく使われていなかったクライアントは再利用前にヘルスチェックを行う。
+    """
+    def __init__(self, idle_timeout: float = 1800.0, health_check_interval: float = 300.0):
+        self.idle_timeout = idle_timeout
+        self.health_check_interval = health_check_interval
+        self._clients = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _make_key(api_key: str, model_name: str, async_mode: bool = False):
+        # APIキーを平文のまま保持しないようにハッシュ化してキーにする
+        return (hashlib.sha256(api_key.encode("utf-8")).hexdigest(), model_name, async_mode)
+
+    def get(self, api_key: str, model_name: str, async_mode: bool = False) -> GeminiClient:
+        key = self._make_key(api_key, model_name, async_mode)
+        now = time.monotonic()
+        self.evict_idle(now)
+
+        with self._lock:
+            client = self._clients.get(key)
+
+        if client is not None and now - client.last_checked > self.health_check_interval:
+            # ネットワーク呼び出しになるためロックの外で実行する
+            if client.health_check():
+                client.last_checked = now
+            else:
+                self._discard(key, client)
+                client = None
+
+        if client is None:
+            with self._lock:
+                # 他スレッドが先に作成していればそれを使う
+                client = self._clients.get(key)
+                if client is None:
+                    with timer("gemini_client_init_ms"):
+                        client = GeminiClient(api_key=api_key, model_name=model_name, async_mode=async_mode)
+                    self._clients[key] = client
+
+        client.last_used = now
+        return client
+
+    def evict_idle(self, now: float = None):
+        if now is None:
+            now = time.monotonic()
+        with self._lock:
+            expired = [
+                (key, client) for key, client in self._clients.items()
+                if now - client.last_used > self.idle_timeout
+            ]
+            for key, _ in expired:
+                del self._clients[key]
+        for _, client in expired:
+            client.retire()
+
+    def _discard(self, key, client):
+        # 他のセッションがまだこのクライアントで応答を受け取っている場合があるため、すぐには閉じない
+        with self._lock:
+            if self._clients.get(key) is client:
+                del self._clients[key]
+        client.retire()
+
+    def clear(self):
+        with self._lock:
+            clients = list(self._clients.values())
+            self._clients.clear()
+        for client in clients:
+            client.retire()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._clients)
+
+
+# プロセス内で共有するデフォルトのプール（Streamlitの再実行でもモジュールはキャッシュされる）
+_default_pool = GeminiClientPool()
+
+def get_client(api_key: str, model_name: str, async_mode: bool = False) -> GeminiClient:
+    """
+    プロセス共有プールから GeminiClient を取得する
+    """
+    return _default_pool.get(api_key, model_name, async_mode=async_mode)
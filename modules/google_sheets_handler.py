@@ -1,11 +1,17 @@
 import logging
-import gspread
-from google.oauth2.service_account import Credentials
+import queue
+import random
+import threading
+import time
 import streamlit as st
 import os
 import json # jsonモジュールをインポート
 
-from .logger import logger
+from .logger import setup_private_logger
+
+# このハンドラ自身のログ (接続・再試行のエラー) はパイプラインに流さない
+# (Sheets の出力先に戻ると、失敗のログが再び書き込みと失敗を起こし続けるため)
+logger = setup_private_logger('assessment_logger.sheets_handler')
 
 # --- Configuration from user input ---
 # Spreadsheet ID extracted from the URL: https://docs.google.com/spreadsheets/d/13Q4ovS5HKXh9qGnHMrePC9o8Gqute1HuBOvmJqW3cKo/edit?gid=0#gid=0
@@ -16,19 +22,66 @@ MIN_LOG_LEVEL = logging.INFO
 CREDENTIALS_KEY_IN_SECRETS = 'google_sheets'
 # Key in st.session_state to retrieve the user ID
 USER_ID_KEY_IN_SESSION_STATE = 'user_name' 
+# Batching / background flush settings
+BATCH_SIZE = 50            # 1回の append_rows で送る最大行数
+FLUSH_INTERVAL = 2.0       # 最大待ち時間（秒）。これを過ぎたら行数に関わらず送信する
+MAX_QUEUE_SIZE = 5000      # キューに保持する最大行数（メモリ上限）
+OVERFLOW_POLICY = 'drop_oldest'  # 'drop_oldest' | 'drop_newest' | 'block'
+BLOCK_TIMEOUT = 0.5        # 'block' 時に呼び出し元を待たせる最大秒数
+MAX_RETRIES = 5
+RETRY_BASE_DELAY = 1.0
+RETRY_MAX_DELAY = 30.0
+HEADER_ROW = ["Timestamp", "User ID", "Category", "Message"]
 
 # --- Google Sheets Handler ---
 class GoogleSheetsHandler(logging.Handler):
-    def __init__(self, sheet_id, worksheet_name, credentials_key_in_secrets, min_level=logging.INFO):
+    """
+    ログレコードをキューに積み、バックグラウンドスレッドが append_rows でまとめて書き込むハンドラ。
+    emit() はキューへの追加のみを行うため、リクエストスレッドで Sheets API を待たない。
+    Sheets への接続 (gspread の読み込みを含む) もバックグラウンドスレッドで行うため、生成はすぐに終わる。
+    接続までに emit されたログはキューに溜まり、接続後に書き込まれる。
+    """
+    def __init__(self, sheet_id, worksheet_name, credentials_key_in_secrets, min_level=logging.INFO,
+                 worksheet=None, batch_size=BATCH_SIZE, flush_interval=FLUSH_INTERVAL,
+                 max_queue_size=MAX_QUEUE_SIZE, overflow_policy=OVERFLOW_POLICY,
+                 max_retries=MAX_RETRIES, retry_base_delay=RETRY_BASE_DELAY):
         super().__init__(level=min_level)
         self.sheet_id = sheet_id
         self.worksheet_name = worksheet_name
         self.credentials_key_in_secrets = credentials_key_in_secrets
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.overflow_policy = overflow_policy
+        self.max_retries = max_retries
+        self.retry_base_delay = retry_base_delay
+        self.dropped_count = 0
+        self.written_count = 0
+        self.connection_failed = False
+
+        self._queue = queue.Queue(maxsize=max_queue_size)
+        self._stop_event = threading.Event()
+        self._worker = None
+
         self.client = None
         self.worksheet = None
-        self._connect_to_sheets()
+        if worksheet is not None:
+            # テストやベンチマーク用: 既存のワークシート（FakeWorksheet等）を直接使う
+            self.worksheet = worksheet
+            self.client = worksheet
+            self._ensure_header()
+
+        self._worker = threading.Thread(target=self._run, name="GoogleSheetsHandler", daemon=True)
+        self._worker.start()
 
     def _connect_to_sheets(self):
+        # gspread / google-auth の読み込みは重いため、ワーカースレッドで接続するときまで遅らせる
+        try:
+            import gspread
+            from google.oauth2.service_account import Credentials
+        except ImportError as e:
+            logger.error(f"gspread or google-auth is not installed. Cannot connect to Google Sheets: {e}")
+            return
+
         try:
             if not hasattr(st, 'secrets') or self.credentials_key_in_secrets not in st.secrets:
                 logger.error(f"Credentials key '{self.credentials_key_in_secrets}' not found in Streamlit secrets. Cannot connect to Google Sheets.")
@@ -58,11 +111,7 @@ class GoogleSheetsHandler(logging.Handler):
             spreadsheet = self.client.open_by_key(self.sheet_id)
             self.worksheet = spreadsheet.worksheet(self.worksheet_name)
             
-            # Check if worksheet is empty or headers are missing
-            all_values = self.worksheet.get_all_values()
-            if not all_values or len(all_values) == 0 or (len(all_values) > 0 and len(all_values[0]) == 0):
-                 self.worksheet.append_row(["Timestamp", "User ID", "Category", "Message"])
-                 logger.debug(f"Appended headers to empty or headerless worksheet '{self.worksheet_name}'.")
+            self._ensure_header()
 
             logger.debug(f"Successfully connected to Google Sheet: ID='{self.sheet_id}', Worksheet='{self.worksheet_name}'")
 
@@ -76,15 +125,26 @@ class GoogleSheetsHandler(logging.Handler):
             self.client = None
             self.worksheet = None
 
+    def _ensure_header(self):
+        # シート全体ではなく1行目だけを読んでヘッダーの有無を確認する
+        first_row = self.worksheet.row_values(1)
+        if not first_row:
+            self.worksheet.append_row(HEADER_ROW)
+            logger.debug(f"Appended headers to empty or headerless worksheet '{self.worksheet_name}'.")
+
     def emit(self, record):
-        if self.client is None or self.worksheet is None:
+        if self.connection_failed:
             # Connection failed or worksheet not found, cannot emit logs
             return
 
         try:
             # Get user ID from session state. This assumes it's available.
             user_id = "N/A" # Default if not found
-            if hasattr(st, 'session_state') and USER_ID_KEY_IN_SESSION_STATE in st.session_state and st.session_state[USER_ID_KEY_IN_SESSION_STATE]:
+            context = getattr(record, 'context', None)
+            if context is not None:
+                # ログパイプライン経由 (リスナーのスレッドで呼ばれる) ではレコードに付いたコンテキストを使う
+                user_id = str(context.get('user_id') or user_id)
+            elif hasattr(st, 'session_state') and USER_ID_KEY_IN_SESSION_STATE in st.session_state and st.session_state[USER_ID_KEY_IN_SESSION_STATE]:
                 user_id = str(st.session_state[USER_ID_KEY_IN_SESSION_STATE])
             
             # Format timestamp and get message
@@ -100,10 +160,116 @@ class GoogleSheetsHandler(logging.Handler):
             # Get category from the record, default to 'System'
             category = getattr(record, 'category', 'System')
             
-            # Append row to the sheet
-            self.worksheet.append_row([timestamp, user_id, category, message])
+            # Enqueue the row; the background worker writes it in batches
+            self._enqueue([timestamp, user_id, category, message])
         except Exception as e:
-            logger.error(f"Failed to append row to Google Sheet: {e}")
+            logger.error(f"Failed to enqueue row for Google Sheet: {e}")
+
+    def _enqueue(self, row):
+        try:
+            if self.overflow_policy == 'block':
+                self._queue.put(row, timeout=BLOCK_TIMEOUT)
+            else:
+                self._queue.put_nowait(row)
+            return
+        except queue.Full:
+            pass
+
+        if self.overflow_policy == 'drop_oldest':
+            # 最も古い行を捨てて新しい行を入れる
+            try:
+                self._queue.get_nowait()
+                self._queue.task_done()
+                self.dropped_count += 1
+            except queue.Empty:
+                pass
+            try:
+                self._queue.put_nowait(row)
+                return
+            except queue.Full:
+                pass
+        self.dropped_count += 1
+
+    # --- Background worker ---
+    def _run(self):
+        if self.worksheet is None:
+            self._connect_to_sheets()
+            if self.worksheet is None:
+                self._fail()
+                return
+        while not self._stop_event.is_set() or not self._queue.empty():
+            batch = self._collect_batch()
+            if batch:
+                self._write_batch(batch)
+                for _ in batch:
+                    self._queue.task_done()
+
+    def _fail(self):
+        # 接続できなければ以降のログは受け付けず、接続待ちの間に溜まった行は破棄する
+        self.connection_failed = True
+        while True:
+            try:
+                self._queue.get_nowait()
+            except queue.Empty:
+                break
+            self._queue.task_done()
+            self.dropped_count += 1
+
+    def _collect_batch(self):
+        # 最初の1行を待ち、その後は batch_size か flush_interval のどちらかに達するまで集める
+        batch = []
+        try:
+            batch.append(self._queue.get(timeout=self.flush_interval))
+        except queue.Empty:
+            return batch
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or self._stop_event.is_set():
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        # 停止時は待たずに残りを詰める
+        while self._stop_event.is_set() and len(batch) < self.batch_size:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _write_batch(self, batch):
+        for attempt in range(self.max_retries + 1):
+            try:
+                self.worksheet.append_rows(batch)
+                self.written_count += len(batch)
+                return
+            except Exception as e:
+                if attempt >= self.max_retries:
+                    self.dropped_count += len(batch)
+                    logger.error(f"Failed to append {len(batch)} rows to Google Sheet after {attempt + 1} attempts: {e}")
+                    return
+                # 指数バックオフ + ジッター
+                delay = min(RETRY_MAX_DELAY, self.retry_base_delay * (2 ** attempt))
+                delay = random.uniform(0, delay)
+                logger.debug(f"Retrying append_rows in {delay:.2f}s ({e})")
+                time.sleep(delay)
+
+    def flush(self):
+        """
+        キューに溜まっている行がすべて書き込まれるまで待つ
+        """
+        if self._worker is not None and self._worker.is_alive():
+            self._queue.join()
+
+    def close(self):
+        # logging.shutdown() からも呼ばれるため、終了時に残りの行を書き出してから停止する
+        if self._worker is not None:
+            self._stop_event.set()
+            self._worker.join()
+            self._worker = None
+        super().close()
 
 # --- Helper function to add the handler ---
 def add_google_sheets_handler(logger_instance: logging.Logger, 
@@ -113,11 +279,13 @@ def add_google_sheets_handler(logger_instance: logging.Logger,
                               min_level: int = logging.INFO):
     """
     Adds a GoogleSheetsHandler to the given logger instance.
+    The connection is made in the handler's background thread, so this returns immediately.
     """
     # 既存のGoogleSheetsHandlerを削除して、重複や古いハンドラの残留を防ぐ
     for handler in logger_instance.handlers[:]: # ハンドラリストのコピーをイテレート
         if isinstance(handler, GoogleSheetsHandler):
             logger_instance.removeHandler(handler)
+            handler.close()
             logger.debug("Removed existing GoogleSheetsHandler.")
 
     handler = GoogleSheetsHandler(
@@ -126,10 +294,8 @@ def add_google_sheets_handler(logger_instance: logging.Logger,
         credentials_key_in_secrets=credentials_key,
         min_level=min_level
     )
-    # Only add handler if connection was successful
-    if handler.client and handler.worksheet:
-        logger_instance.addHandler(handler)
-        logger.debug("GoogleSheetsHandler added to logger.")
-    else:
-        logger.error("GoogleSheetsHandler was not added due to connection failure.")
+    # 接続の成否を待たずに追加する (接続に失敗した場合、ハンドラは以降のログを無視する)
+    logger_instance.addHandler(handler)
+    logger.debug("GoogleSheetsHandler added to logger.")
+    return handler
 
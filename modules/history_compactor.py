@@ -0,0 +1,99 @@
+from dataclasses import dataclass
+
+from modules.tag_parser import StreamingTagParser
+
+DIGEST_HEADER = "【完了済みモジュールの要約】(以前の対話は要約済みです。この内容を前提に対話を続けてください)"
+DIGEST_ACK = "承知しました。要約の内容を踏まえて対話を続けます。"
+
+
+@dataclass
+class CompactionConfig:
+    enabled: bool = True
+    # スコアを出したターンの後、この件数のメッセージが積み上がったらモジュールを要約する
+    # (スコア開示の質疑がある間は元の対話を残すため)
+    min_messages_after_score: int = 4
+    max_rationale_chars: int = 400
+    max_statements: int = 3
+    max_statement_chars: int = 200
+
+
+def _text_of(message) -> str:
+    return "".join(part.get("text", "") for part in message.get("parts", []))
+
+
+def _truncate(text: str, limit: int) -> str:
+    text = " ".join(text.split())
+    if len(text) <= limit:
+        return text
+    return text[:limit] + "…"
+
+
+def _parse(text: str) -> StreamingTagParser:
+    parser = StreamingTagParser()
+    parser.feed(text)
+    parser.finish()
+    return parser
+
+
+def find_module_segments(history):
+    """
+    [[SCORE:X]] を出力したモデルのターンをモジュールの区切りとして、
+    完了済みモジュールの (開始index, 終了index(含まない), スコア, 根拠) のリストを返す
+    """
+    segments = []
+    start = 0
+    for i, message in enumerate(history):
+        if message.get("role") != "model":
+            continue
+        parser = _parse(_text_of(message))
+        if parser.score is not None:
+            segments.append((start, i + 1, parser.score, parser.rationale))
+            start = i + 1
+    return segments
+
+
+def _build_digest(history, segments, config: CompactionConfig) -> str:
+    lines = [DIGEST_HEADER]
+    if history and history[0].get("role") == "user":
+        # 受検者名などを含む開始時の指示は常に残す
+        lines.append(f"開始時の指示: {_text_of(history[0])}")
+    for number, (start, end, score, rationale) in enumerate(segments, start=1):
+        lines.append(f"## Module {number} (完了) スコア: {score}")
+        if rationale:
+            lines.append(f"- 評価根拠の要約: {_truncate(rationale, config.max_rationale_chars)}")
+
+        statements = [_text_of(m) for m in history[start:end] if m.get("role") == "user"]
+        # 具体的な内容を残すため、長い発言を優先しつつ元の順序で並べる
+        longest = sorted(range(len(statements)), key=lambda i: len(statements[i]), reverse=True)
+        keep = sorted(longest[:config.max_statements])
+        if keep:
+            lines.append("- 受検者の主な発言:")
+            for i in keep:
+                lines.append(f"  - 「{_truncate(statements[i], config.max_statement_chars)}」")
+    return "\n".join(lines)
+
+
+def compact_history(history, config: CompactionConfig = None):
+    """
+    完了済みモジュールを構造化した要約に置き換えた履歴を返す（元の履歴は変更しない）。
+    進行中のモジュールと、直近のスコア開示のやりとりはそのまま残す。
+    """
+    if config is None:
+        config = CompactionConfig()
+    if not config.enabled or not history:
+        return history
+
+    segments = [
+        segment for segment in find_module_segments(history)
+        if len(history) - segment[1] >= config.min_messages_after_score
+    ]
+    if not segments:
+        return history
+
+    digest = _build_digest(history, segments, config)
+    compacted = [
+        {"role": "user", "parts": [{"text": digest}]},
+        {"role": "model", "parts": [{"text": DIGEST_ACK}]},
+    ]
+    compacted.extend(history[segments[-1][1]:])
+    return compacted
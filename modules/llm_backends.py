@@ -0,0 +1,318 @@
+import hashlib
+import json
+import os
+import random
+import threading
+import time
+from typing import Protocol
+
+from modules.background_scoring import SCORING_HEADER
+
+# LLM_BACKEND の設定値
+BACKEND_GEMINI = "gemini"
+BACKEND_MOCK = "mock"
+BACKEND_RECORD = "record"
+BACKEND_REPLAY = "replay"
+BACKEND_FAULT = "fault"
+
+
+class LLMBackend(Protocol):
+    """
+    streamlit_app.py が使うLLMバックエンドのインターフェース (GeminiClient と同じ形)
+    """
+    def start_chat(self, history=None, system_instruction: str = None): ...
+
+    def send_message(self, chat_session, message: str, stream: bool = False): ...
+
+
+class MockChunk:
+    """ストリーミング応答のチャンク / 非ストリーミング応答 (google-genai の応答と同じく .text を持つ)"""
+    def __init__(self, text, usage_metadata=None):
+        self.text = text
+        self.usage_metadata = usage_metadata
+
+
+class MockChat:
+    def __init__(self, history=None, system_instruction: str = None):
+        self.history = list(history or [])
+        self.system_instruction = system_instruction
+
+
+def _message_key(message: str) -> str:
+    return hashlib.sha256(message.encode("utf-8")).hexdigest()
+
+
+def _turn_index(history) -> int:
+    # 履歴に含まれるユーザー発言の数 = これから送るのが何ターン目か (0: 開始時の指示)
+    return sum(1 for item in history if item.get("role") == "user")
+
+
+def default_mock_script(history, message: str) -> str:
+    """
+    デバッグモード用の応答。2回目の回答までは毎回スコアを付け、3回目で総合フィードバックを返して終了する
+    (採点依頼には採点結果のJSONを返す)
+    """
+    if message.startswith(SCORING_HEADER):
+        return ('{"sub_scores": [{"criterion": "Debug A", "score": 4, "comment": "Dummy comment."}, '
+                '{"criterion": "Debug B", "score": 3, "comment": "Dummy comment."}], '
+                '"total": 7, "rationale": "Dummy background rationale."}')
+    turn = _turn_index(history)
+    if turn == 0:
+        return f"デバッグモードで起動しました。アセスメントを開始します。(起動時刻: {time.strftime('%Y-%m-%d %H:%M:%S')})"
+    if turn < 3:
+        return f"【Debug Mode】 Mock Response {turn}\n\nThis is a dummy response for testing. (Message {turn}/3)\n\n[[SCORE:7]]\n[[RATIONALE:Dummy rationale for step {turn}.]]"
+    return "【Debug Mode】 Assessment Complete.\n\nHere is the comprehensive feedback...\n\n1. Type: Debugger\n2. Analysis: ...\n\n[[SCORE:9]]\n[[RATIONALE:Final dummy rationale.]]\n\n[[END_OF_ASSESSMENT]]"
+
+
+class MockBackend:
+    """
+    台本どおりの応答を返すバックエンド。
+
+    script: (history, message) -> str の関数、応答文字列のリスト (ターン番号で選択)、
+            または {送信メッセージ: 応答} の辞書 (一致しないメッセージは default_mock_script で応答)
+    first_token_delay: 最初のチャンクまでの待ち時間 (秒)
+    chunk_size / chunk_interval: 応答を分割するサイズとチャンク間の待ち時間
+    """
+    def __init__(self, script=None, first_token_delay: float = 0.5, chunk_size: int = 0, chunk_interval: float = 0.0):
+        self.script = script or default_mock_script
+        self.first_token_delay = first_token_delay
+        self.chunk_size = chunk_size
+        self.chunk_interval = chunk_interval
+
+    def start_chat(self, history=None, system_instruction: str = None):
+        return MockChat(history, system_instruction)
+
+    def _respond(self, chat_session, message: str) -> str:
+        if callable(self.script):
+            return self.script(chat_session.history, message)
+        if isinstance(self.script, dict):
+            if message in self.script:
+                return self.script[message]
+            return default_mock_script(chat_session.history, message)
+        return self.script[min(_turn_index(chat_session.history), len(self.script) - 1)]
+
+    def send_message(self, chat_session, message: str, stream: bool = False):
+        text = self._respond(chat_session, message)
+        chat_session.history.append({"role": "user", "parts": [{"text": message}]})
+        chat_session.history.append({"role": "model", "parts": [{"text": text}]})
+        if not stream:
+            time.sleep(self.first_token_delay)
+            return MockChunk(text)
+        return self._stream(text)
+
+    def _stream(self, text: str):
+        time.sleep(self.first_token_delay)
+        if not self.chunk_size:
+            yield MockChunk(text)
+            return
+        for i in range(0, len(text), self.chunk_size):
+            if i:
+                time.sleep(self.chunk_interval)
+            yield MockChunk(text[i:i + self.chunk_size])
+
+
+class RecordingBackend:
+    """
+    別のバックエンドをラップし、各呼び出しの応答チャンクとその到着時刻をJSONLファイルに追記する。
+    記録したファイルは ReplayBackend で再生できる。
+    """
+    def __init__(self, inner, path: str):
+        self.inner = inner
+        self.path = path
+        self._lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def start_chat(self, history=None, system_instruction: str = None):
+        chat = self.inner.start_chat(history=history, system_instruction=system_instruction)
+        return (chat, _turn_index(history or []))
+
+    def send_message(self, chat_session, message: str, stream: bool = False):
+        chat, turn = chat_session
+        started = time.monotonic()
+        if not stream:
+            response = self.inner.send_message(chat, message)
+            self._write(turn, message, [(time.monotonic() - started, response.text or "")])
+            return response
+        return self._record_stream(self.inner.send_message(chat, message, stream=True), turn, message, started)
+
+    def _record_stream(self, response, turn: int, message: str, started: float):
+        chunks = []
+        for chunk in response:
+            chunks.append((time.monotonic() - started, chunk.text or ""))
+            yield chunk
+        self._write(turn, message, chunks)
+
+    def _write(self, turn: int, message: str, chunks):
+        entry = {
+            "turn": turn,
+            "message_key": _message_key(message),
+            "message": message,
+            "chunks": [[round(offset, 4), text] for offset, text in chunks],
+        }
+        with self._lock:
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+
+
+class ReplayBackend:
+    """
+    RecordingBackend で記録した応答を、元のチャンク分割とチャンク間の時間間隔で再生する。
+
+    送信メッセージが記録と一致すればその応答を、一致しなければ同じターン番号の応答を返す。
+    speed: 再生速度の倍率 (2.0 なら2倍速、0 なら待ち時間なし)
+    """
+    def __init__(self, path: str, speed: float = 1.0):
+        self.speed = speed
+        self.by_message = {}
+        self.by_turn = {}
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                entry = json.loads(line)
+                self.by_message.setdefault(entry["message_key"], entry)
+                self.by_turn.setdefault(entry["turn"], entry)
+        if not self.by_turn:
+            raise ValueError(f"No recorded calls in {path}")
+
+    def start_chat(self, history=None, system_instruction: str = None):
+        return MockChat(history, system_instruction)
+
+    def _lookup(self, chat_session, message: str):
+        entry = self.by_message.get(_message_key(message))
+        if entry is None:
+            turn = _turn_index(chat_session.history)
+            entry = self.by_turn.get(turn) or self.by_turn[max(self.by_turn)]
+        return entry
+
+    def send_message(self, chat_session, message: str, stream: bool = False):
+        entry = self._lookup(chat_session, message)
+        chat_session.history.append({"role": "user", "parts": [{"text": message}]})
+        if not stream:
+            if self.speed:
+                time.sleep(entry["chunks"][-1][0] / self.speed)
+            return MockChunk("".join(text for _, text in entry["chunks"]))
+        return self._replay(entry)
+
+    def _replay(self, entry):
+        started = time.monotonic()
+        for offset, text in entry["chunks"]:
+            if self.speed:
+                wait = offset / self.speed - (time.monotonic() - started)
+                if wait > 0:
+                    time.sleep(wait)
+            yield MockChunk(text)
+
+
+class InjectedFault(Exception):
+    """FaultInjectingBackend が発生させるエラー (code は google-genai の APIError と同じくHTTPステータス)"""
+    def __init__(self, message: str, code: int = 503):
+        super().__init__(f"{code} {message}")
+        self.code = code
+
+
+class FaultInjectingBackend:
+    """
+    別のバックエンドをラップし、障害を確率的に注入する (タイムアウト・再試行の動作確認用)
+
+    error_rate: 送信時にエラーを返す確率 (error_codes から選ぶ。429 / 503 は再試行対象、400 は対象外)
+    slow_rate / slow_delay: 最初のチャンクが slow_delay 秒遅れる確率 (テールレイテンシ)
+    hang_rate: 最初のチャンクが届かない (hang_delay 秒待たされる) 確率
+    stall_rate: 応答の途中 (2つ目のチャンクの前) で止まる確率
+    """
+    def __init__(self, inner, error_rate: float = 0.0, error_codes=(503, 429), slow_rate: float = 0.0,
+                 slow_delay: float = 5.0, hang_rate: float = 0.0, hang_delay: float = 300.0,
+                 stall_rate: float = 0.0, seed: int = None):
+        self.inner = inner
+        self.error_rate = error_rate
+        self.error_codes = tuple(error_codes)
+        self.slow_rate = slow_rate
+        self.slow_delay = slow_delay
+        self.hang_rate = hang_rate
+        self.hang_delay = hang_delay
+        self.stall_rate = stall_rate
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.faults = 0
+
+    def start_chat(self, history=None, system_instruction: str = None):
+        return self.inner.start_chat(history=history, system_instruction=system_instruction)
+
+    def _draw(self):
+        with self._lock:
+            self.calls += 1
+            roll = self._random.random()
+            code = self._random.choice(self.error_codes) if self.error_codes else 503
+        for kind, rate in (("error", self.error_rate), ("hang", self.hang_rate),
+                           ("slow", self.slow_rate), ("stall", self.stall_rate)):
+            if roll < rate:
+                with self._lock:
+                    self.faults += 1
+                return kind, code
+            roll -= rate
+        return None, code
+
+    def send_message(self, chat_session, message: str, stream: bool = False):
+        fault, code = self._draw()
+        if fault == "error":
+            raise InjectedFault("injected upstream error", code)
+        if not stream:
+            self._delay(fault)
+            return self.inner.send_message(chat_session, message)
+        return self._stream(self.inner.send_message(chat_session, message, stream=True), fault)
+
+    def _delay(self, fault):
+        if fault == "hang":
+            time.sleep(self.hang_delay)
+        elif fault == "slow":
+            time.sleep(self.slow_delay)
+
+    def _stream(self, response, fault):
+        self._delay(fault)
+        for index, chunk in enumerate(response):
+            if fault == "stall" and index == 1:
+                time.sleep(self.hang_delay)
+            yield chunk
+
+
+def create_backend(kind: str, api_key: str = None, model_name: str = None, replay_path: str = None,
+                   record_path: str = None, replay_speed: float = 1.0, context_cache_ttl: int = None,
+                   resilience=None, async_mode: bool = False, on_extra_attempt=None):
+    """
+    設定値からバックエンドを作成する (gemini / mock / record / replay / fault)
+
+    resilience: ResilienceConfig の設定値 (dict)。渡すと Gemini 呼び出しにタイムアウト・再試行・ヘッジを適用する
+    async_mode: Gemini の応答を SDK の非同期クライアントで受け取り、プロセス共有のイベントループで読み込む
+    on_extra_attempt: 再試行・ヘッジで試行を追加するたびに呼ばれる (rate_limiter.attempt_charger)
+    """
+    if kind == BACKEND_MOCK:
+        return MockBackend()
+    if kind == BACKEND_REPLAY:
+        return ReplayBackend(replay_path, speed=replay_speed)
+
+    # Gemini SDK は実際に使う場合のみ読み込む
+    from modules.gemini_client import ResilienceConfig, ResilientBackend, get_client
+    config = ResilienceConfig(**resilience) if resilience is not None else None
+    if kind == BACKEND_FAULT:
+        # 障害を注入したモックで、タイムアウト・再試行の動作を画面から確認する
+        faulty = FaultInjectingBackend(MockBackend(chunk_size=20, chunk_interval=0.05), error_rate=0.2,
+                                       slow_rate=0.1, slow_delay=5.0, hang_rate=0.05, stall_rate=0.05)
+        return ResilientBackend(faulty, config, on_extra_attempt=on_extra_attempt)
+
+    client = get_client(api_key=api_key, model_name=model_name, async_mode=async_mode)
+    if context_cache_ttl:
+        client.enable_context_cache(ttl_seconds=context_cache_ttl)
+
+    if kind == BACKEND_RECORD:
+        backend = RecordingBackend(client, record_path)
+    elif kind == BACKEND_GEMINI:
+        backend = client
+    else:
+        raise ValueError(f"Unknown LLM backend: {kind}")
+    if config is None:
+        return backend
+    return ResilientBackend(backend, config, breaker=client.circuit_breaker, latency=client.first_token_latency,
+                            on_extra_attempt=on_extra_attempt)
@@ -0,0 +1,250 @@
+"""
+Google Sheets のログ (GoogleSheetsHandler が書き込む log ワークシート) をローカルの SQLite に取り込む
+
+取り込み済みの行番号 (カーソル) を保持し、新しい行だけを batch_get でまとめて取得する。
+AI の応答からは [[SCORE]] / [[RATIONALE]] を、バックグラウンド採点のログからはスコアと根拠を取り出して
+scores テーブルに保存するため、集計はローカルの問い合わせだけで済む。
+
+    python -m modules.log_ingest sync --credentials service_account.json [--db assessment_logs.db]
+    python -m modules.log_ingest scores [--user NAME] [--since "2025-01-01"] [--until "2025-02-01"]
+    python -m modules.log_ingest summary
+
+--full を付けて sync するとキャッシュを作り直す (シートの行を削除・並べ替えた場合)。
+"""
+import argparse
+import re
+import sqlite3
+import threading
+
+from modules.tag_parser import StreamingTagParser
+
+# ヘッダー (1行目) を除いた最初のデータ行
+FIRST_DATA_ROW = 2
+# Timestamp, User ID, Category, Message
+COLUMNS = ("A", "D")
+COLUMN_COUNT = 4
+
+# バックグラウンド採点のログ (streamlit_app.apply_finished_scores の出力)
+_BACKGROUND_SCORE = re.compile(r"^Background score \(Module (\d+)\): (\d+) / (.*)$", re.DOTALL)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS ingest_state (
+    source TEXT PRIMARY KEY,
+    next_row INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS log_rows (
+    source TEXT NOT NULL,
+    row_number INTEGER NOT NULL,
+    timestamp TEXT,
+    user_id TEXT,
+    category TEXT,
+    message TEXT,
+    PRIMARY KEY (source, row_number)
+);
+CREATE TABLE IF NOT EXISTS scores (
+    source TEXT NOT NULL,
+    row_number INTEGER NOT NULL,
+    timestamp TEXT,
+    user_id TEXT,
+    kind TEXT,
+    module INTEGER,
+    score INTEGER,
+    rationale TEXT
+);
+CREATE INDEX IF NOT EXISTS log_rows_user ON log_rows (user_id, timestamp);
+CREATE INDEX IF NOT EXISTS log_rows_timestamp ON log_rows (timestamp);
+CREATE INDEX IF NOT EXISTS scores_user ON scores (user_id, timestamp);
+CREATE INDEX IF NOT EXISTS scores_timestamp ON scores (timestamp);
+"""
+
+
+def parse_row(row):
+    """シートの1行を (timestamp, user_id, category, message) にする (末尾の空セルは省略されて届く)"""
+    values = [str(value) for value in row[:COLUMN_COUNT]]
+    values += [""] * (COLUMN_COUNT - len(values))
+    return tuple(values)
+
+
+def extract_scores(category: str, message: str):
+    """
+    1件のログから (kind, module, score, rationale) を取り出す。
+    - AI: 応答の生テキストに含まれる [[SCORE:X]] / [[RATIONALE:...]] (module はセッション内の順番から決まるため None)
+    - Scoring: バックグラウンド採点の結果 ("Score extracted: X" は AI の応答と重複するため使わない)
+    """
+    if category == "AI":
+        if "[[" not in message:
+            return []
+        parser = StreamingTagParser()
+        parser.feed(message)
+        parser.finish()
+        return [("ai", None, score, parser.rationales[i] if i < len(parser.rationales) else "")
+                for i, score in enumerate(parser.scores)]
+    if category == "Scoring":
+        match = _BACKGROUND_SCORE.match(message)
+        if match:
+            return [("background", int(match.group(1)), int(match.group(2)), match.group(3).strip())]
+    return []
+
+
+class LogStore:
+    """
+    取り込んだログのローカルキャッシュ (SQLite)。利用者・時刻にインデックスを張る
+    """
+    def __init__(self, path: str = "assessment_logs.db"):
+        self.path = path
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(SCHEMA)
+        self._lock = threading.Lock()
+
+    def next_row(self, source: str) -> int:
+        with self._lock:
+            row = self._conn.execute("SELECT next_row FROM ingest_state WHERE source = ?", (source,)).fetchone()
+        return row[0] if row else FIRST_DATA_ROW
+
+    def ingest(self, source: str, first_row: int, rows) -> int:
+        """
+        first_row 行目から始まる rows を保存し、カーソルを進める (1トランザクション)。保存したスコアの件数を返す
+        """
+        log_rows = []
+        scores = []
+        for offset, row in enumerate(rows):
+            row_number = first_row + offset
+            timestamp, user_id, category, message = parse_row(row)
+            log_rows.append((source, row_number, timestamp, user_id, category, message))
+            for kind, module, score, rationale in extract_scores(category, message):
+                scores.append((source, row_number, timestamp, user_id, kind, module, score, rationale))
+        with self._lock, self._conn:
+            self._conn.executemany("INSERT OR REPLACE INTO log_rows VALUES (?, ?, ?, ?, ?, ?)", log_rows)
+            self._conn.executemany("INSERT INTO scores VALUES (?, ?, ?, ?, ?, ?, ?, ?)", scores)
+            self._conn.execute("INSERT OR REPLACE INTO ingest_state VALUES (?, ?)", (source, first_row + len(log_rows)))
+        return len(scores)
+
+    def reset(self, source: str):
+        with self._lock, self._conn:
+            for table in ("ingest_state", "log_rows", "scores"):
+                self._conn.execute(f"DELETE FROM {table} WHERE source = ?", (source,))
+
+    def scores(self, user_id: str = None, since: str = None, until: str = None) -> list:
+        query = "SELECT timestamp, user_id, kind, module, score, rationale FROM scores WHERE 1 = 1"
+        params = []
+        if user_id is not None:
+            query += " AND user_id = ?"
+            params.append(user_id)
+        if since is not None:
+            query += " AND timestamp >= ?"
+            params.append(since)
+        if until is not None:
+            query += " AND timestamp < ?"
+            params.append(until)
+        query += " ORDER BY timestamp, row_number"
+        with self._lock:
+            return self._conn.execute(query, params).fetchall()
+
+    def summary(self) -> list:
+        """利用者ごとの (user_id, ログ件数, 採点件数, 平均スコア, 最初の時刻, 最後の時刻)"""
+        with self._lock:
+            return self._conn.execute("""
+                SELECT r.user_id, COUNT(*), COALESCE(s.count, 0), s.average, MIN(r.timestamp), MAX(r.timestamp)
+                FROM log_rows r
+                LEFT JOIN (SELECT user_id, COUNT(*) AS count, AVG(score) AS average
+                           FROM scores WHERE kind = 'ai' GROUP BY user_id) s ON s.user_id = r.user_id
+                GROUP BY r.user_id ORDER BY MAX(r.timestamp) DESC
+            """).fetchall()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class SheetsLogReader:
+    """
+    ワークシートの新しい行だけを取り込む。
+    page_size 行ずつの範囲を pages_per_call 個まとめて batch_get し、行が足りないページが返れば末尾とみなす
+    """
+    def __init__(self, worksheet, store: LogStore, source: str = "log",
+                 page_size: int = 1000, pages_per_call: int = 5):
+        self.worksheet = worksheet
+        self.store = store
+        self.source = source
+        self.page_size = page_size
+        self.pages_per_call = pages_per_call
+
+    def _ranges(self, first_row: int):
+        first_col, last_col = COLUMNS
+        for page in range(self.pages_per_call):
+            start = first_row + page * self.page_size
+            yield f"{first_col}{start}:{last_col}{start + self.page_size - 1}"
+
+    def sync(self) -> tuple:
+        """新しい行を取り込み、(取り込んだ行数, 取り出したスコアの件数) を返す"""
+        total_rows = total_scores = 0
+        while True:
+            first_row = self.store.next_row(self.source)
+            rows = []
+            reached_end = False
+            for values in self.worksheet.batch_get(list(self._ranges(first_row))):
+                rows.extend(values)
+                if len(values) < self.page_size:
+                    reached_end = True
+                    break
+            total_scores += self.store.ingest(self.source, first_row, rows)
+            total_rows += len(rows)
+            if reached_end:
+                return total_rows, total_scores
+
+
+def open_worksheet(credentials_path: str, sheet_id: str, worksheet_name: str):
+    import gspread
+    from google.oauth2.service_account import Credentials
+
+    credentials = Credentials.from_service_account_file(
+        credentials_path, scopes=["https://www.googleapis.com/auth/spreadsheets.readonly"])
+    return gspread.authorize(credentials).open_by_key(sheet_id).worksheet(worksheet_name)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Ingest the assessment log worksheet into a local SQLite cache")
+    parser.add_argument("--db", default="assessment_logs.db", help="local cache path")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    sync_parser = commands.add_parser("sync", help="fetch new rows from Google Sheets")
+    sync_parser.add_argument("--credentials", required=True, help="service account JSON file")
+    sync_parser.add_argument("--sheet-id", default=None, help="default: google_sheets_handler.SHEET_ID")
+    sync_parser.add_argument("--worksheet", default=None, help="default: google_sheets_handler.WORKSHEET_NAME")
+    sync_parser.add_argument("--page-size", type=int, default=1000)
+    sync_parser.add_argument("--full", action="store_true", help="drop the cache and ingest from the first row")
+
+    scores_parser = commands.add_parser("scores", help="list extracted scores")
+    scores_parser.add_argument("--user", default=None)
+    scores_parser.add_argument("--since", default=None, help="inclusive, e.g. '2025-01-01'")
+    scores_parser.add_argument("--until", default=None, help="exclusive")
+
+    commands.add_parser("summary", help="per-user counts and average score")
+    args = parser.parse_args(argv)
+
+    store = LogStore(args.db)
+    try:
+        if args.command == "sync":
+            from modules.google_sheets_handler import SHEET_ID, WORKSHEET_NAME
+            worksheet_name = args.worksheet or WORKSHEET_NAME
+            worksheet = open_worksheet(args.credentials, args.sheet_id or SHEET_ID, worksheet_name)
+            if args.full:
+                store.reset(worksheet_name)
+            reader = SheetsLogReader(worksheet, store, source=worksheet_name, page_size=args.page_size)
+            rows, found = reader.sync()
+            print(f"ingested {rows} rows ({found} scores); next row: {store.next_row(worksheet_name)}")
+        elif args.command == "scores":
+            for timestamp, user_id, kind, module, score, rationale in store.scores(args.user, args.since, args.until):
+                module = "-" if module is None else module
+                print(f"{timestamp}\t{user_id}\t{kind}\t{module}\t{score}\t{rationale}")
+        else:
+            for user_id, rows, scored, average, first, last in store.summary():
+                average = "-" if average is None else f"{average:.2f}"
+                print(f"{user_id}\trows={rows}\tscores={scored}\taverage={average}\t{first} .. {last}")
+    finally:
+        store.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,221 @@
+"""
+キューを介したログ出力
+
+リクエストスレッドでは LogRecord にコンテキスト (contextvars で実行ごとに1回設定した利用者など) を付けて
+キューに積むだけにし、JSON への変換と各出力先 (標準出力・ローテーションするファイル・Google Sheets など) への
+書き込みは QueueListener のスレッドで行う。
+
+大きな本文 (AI の応答など) は TruncationPolicy に従って標準出力・ファイルへの出力時に切り詰める。
+"""
+import atexit
+import contextvars
+import copy
+import datetime
+import json
+import logging
+import os
+import queue
+import random
+import sys
+import threading
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+
+# 実行 (Streamlit の再実行1回) ごとに設定するログのコンテキスト
+log_context = contextvars.ContextVar("log_context", default=None)
+
+
+def bind_context(**fields):
+    """
+    以降にこのスレッド (コンテキスト) で出力するログに付ける情報を設定する。
+    レコードごとに st.session_state を参照しないよう、実行の最初に1回だけ呼ぶ
+    """
+    log_context.set(fields)
+
+
+class TruncationPolicy:
+    """
+    本文の切り詰め方。max_chars が 0 なら切り詰めない。
+    sample_rate の割合のレコードは切り詰めずに全文を出力する (会話内容の抜き取り確認用)
+    """
+    def __init__(self, max_chars: int = 0, sample_rate: float = 0.0, categories=("AI", "User")):
+        self.max_chars = max_chars
+        self.sample_rate = sample_rate
+        self.categories = frozenset(categories) if categories else None
+
+    def apply(self, message: str, category: str = None) -> str:
+        if not self.max_chars or len(message) <= self.max_chars:
+            return message
+        if self.categories is not None and category not in self.categories:
+            return message
+        if self.sample_rate and random.random() < self.sample_rate:
+            return message
+        return f"{message[:self.max_chars]}…(+{len(message) - self.max_chars} chars)"
+
+
+# --- Cloud Logging用設定 (JSON形式で出力) ---
+# これにより、Cloud Runのログエクスプローラで検索・分析が可能になります
+class JsonFormatter(logging.Formatter):
+    def __init__(self, component: str = "assessment-app", policy: TruncationPolicy = None):
+        super().__init__()
+        self.component = component
+        self.policy = policy or TruncationPolicy()
+
+    def format(self, record):
+        category = getattr(record, "category", None)
+        # ログレコードの基本情報 (時刻はキューに積んだ時点のもの)
+        log_entry = {
+            "severity": record.levelname,
+            "message": self.policy.apply(record.getMessage(), category),
+            "timestamp": datetime.datetime.fromtimestamp(record.created, datetime.timezone.utc).isoformat(),
+            "component": self.component,
+        }
+
+        # extra引数で渡されたデータ ('category'など) を統合
+        if category is not None:
+            log_entry['category'] = category
+        if hasattr(record, 'metrics'):
+            log_entry['metrics'] = record.metrics
+
+        # 実行の最初に bind_context で設定した利用者情報 (設定前のログは system_init)
+        context = getattr(record, "context", None)
+        if context is None:
+            log_entry['user_id'] = "system_init"
+        else:
+            log_entry['user_id'] = context.get("user_id") or "anonymous"
+            if context.get("session_id"):
+                log_entry['session_id'] = context["session_id"]
+
+        if record.exc_info:
+            log_entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(log_entry, ensure_ascii=False)
+
+
+class LazyRotatingFileHandler(RotatingFileHandler):
+    """
+    最初のログを書き込むときにディレクトリとファイルを作るハンドラ。
+    import しただけではファイルシステムに触れないので、起動が速く、読み取り専用の環境でも import できる
+    """
+    def __init__(self, filename, **kwargs):
+        kwargs["delay"] = True
+        super().__init__(filename, **kwargs)
+
+    def _open(self):
+        os.makedirs(os.path.dirname(self.baseFilename), exist_ok=True)
+        return super()._open()
+
+
+class DeferredQueueHandler(QueueHandler):
+    """
+    リクエストスレッドでは本文を確定してコンテキストを付けるだけにし、整形はリスナーのスレッドに任せる
+    (標準の QueueHandler.prepare はここで format まで行う)
+    """
+    def __init__(self, log_queue, pipeline):
+        super().__init__(log_queue)
+        self.pipeline = pipeline
+
+    def prepare(self, record):
+        record = copy.copy(record)
+        # 引数が後から変更されても出力が変わらないよう、本文だけはここで確定する
+        record.msg = record.getMessage()
+        record.args = None
+        record.context = log_context.get()
+        return record
+
+    def enqueue(self, record):
+        self.pipeline.start()
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.pipeline.dropped += 1
+
+
+class LogPipeline:
+    """
+    プロセスで1つのログのキューと QueueListener。出力先 (sink) は名前を付けて後から追加できる
+    """
+    def __init__(self, max_queue_size: int = 10000, policy: TruncationPolicy = None, stdout: bool = True):
+        self.queue = queue.Queue(maxsize=max_queue_size)
+        self.formatter = JsonFormatter(policy=policy)
+        self.dropped = 0
+        self._sinks = {}
+        self._handler = DeferredQueueHandler(self.queue, self)
+        self._listener = None
+        self._lock = threading.Lock()
+
+        if stdout:
+            handler = logging.StreamHandler(sys.stdout)
+            handler.setFormatter(self.formatter)
+            self.add_sink("stdout", handler)
+
+    def configure(self, policy: TruncationPolicy = None, log_file: str = None):
+        """本文の切り詰め方の変更と、ファイルへの出力の追加 (同じパスなら何もしない)"""
+        if policy is not None:
+            self.formatter.policy = policy
+        if log_file:
+            self.add_file(log_file)
+
+    def add_file(self, path: str, max_bytes: int = 1 * 1024 * 1024, backup_count: int = 5):
+        # 1MBでローテーションし、最大5つのバックアップファイルを保持
+        name = f"file:{os.path.abspath(path)}"
+        if name not in self._sinks:
+            handler = LazyRotatingFileHandler(path, maxBytes=max_bytes, backupCount=backup_count, encoding='utf-8')
+            handler.setFormatter(self.formatter)
+            self.add_sink(name, handler)
+
+    def has_sink(self, name: str) -> bool:
+        return name in self._sinks
+
+    def add_sink(self, name: str, handler: logging.Handler) -> logging.Handler:
+        """
+        出力先を追加する。同じ名前の出力先が既にあれば handler は閉じて、既存のものを返す
+        """
+        with self._lock:
+            existing = self._sinks.get(name)
+            if existing is None:
+                self._sinks[name] = handler
+                if self._listener is not None:
+                    # リスナーは handlers を毎回読み直すので、入れ替えるだけで反映される
+                    self._listener.handlers = tuple(self._sinks.values())
+        if existing is not None:
+            handler.close()
+            return existing
+        return handler
+
+    def attach(self, logger: logging.Logger):
+        """
+        ロガーの出力をこのパイプラインに流す (Streamlit の再実行で何度呼んでもハンドラは1つ)
+        """
+        if self._handler not in logger.handlers:
+            logger.addHandler(self._handler)
+        logger.propagate = False
+
+    def start(self):
+        if self._listener is not None:
+            return
+        with self._lock:
+            if self._listener is None:
+                self._listener = QueueListener(self.queue, *self._sinks.values(), respect_handler_level=True)
+                self._listener.start()
+                atexit.register(self.stop)
+
+    def stop(self):
+        """キューに残っているログを書き出してからリスナーを止める"""
+        with self._lock:
+            listener, self._listener = self._listener, None
+        if listener is not None:
+            listener.stop()
+            for handler in listener.handlers:
+                handler.flush()
+
+
+_pipeline = None
+_pipeline_lock = threading.Lock()
+
+
+def get_pipeline() -> LogPipeline:
+    """プロセスで共有するパイプライン (リスナーのスレッドは最初のログで起動する)"""
+    global _pipeline
+    with _pipeline_lock:
+        if _pipeline is None:
+            _pipeline = LogPipeline()
+        return _pipeline
@@ -1,7 +1,8 @@
 import logging
 import os
 import sys
-from logging.handlers import RotatingFileHandler
+
+from modules.log_pipeline import get_pipeline
 
 # Windows環境でのコンソール出力の文字化け/エラー対策
 if sys.platform == "win32":
@@ -12,47 +13,46 @@ if sys.platform == "win32":
         # Python 3.7未満など reconfigure がない場合はスキップ（今回は3.12+なので問題なし）
         pass
 
-# ログを保存するディレクトリを作成
+# ログを保存するディレクトリ (最初にログを書き込むときに作成する)
 LOG_DIR = 'logs'
-if not os.path.exists(LOG_DIR):
-    os.makedirs(LOG_DIR)
 
 # ログファイルのパス
 LOG_FILE = os.path.join(LOG_DIR, 'assessment.log')
 
-def setup_logger(name: str, log_file: str, level=logging.INFO):
+
+def setup_logger(name: str, log_file: str = None, level=logging.INFO):
     """
-    指定された名前でロガーをセットアップする関数
+    指定された名前でロガーをセットアップする関数。
+    ファイルへの出力は log_file を渡したときだけ追加する (読み込むだけで出力先が増えないようにする。
+    アプリでは設定の LOG_FILE で指定する)
     """
     logger = logging.getLogger(name)
     logger.setLevel(level)
 
-    # Streamlitの再実行時にハンドラが重複して追加されるのを防ぐため、既存のハンドラをクリアする
-    if logger.hasHandlers():
-        logger.handlers.clear()
-
-    # ログのフォーマットを定義
-    formatter = logging.Formatter(
-        '%(asctime)s - %(levelname)s - %(message)s',
-        '%Y-%m-%d %H:%M:%S'
-    )
+    # 整形と書き込み (ファイル・コンソール) は共通のログパイプラインのスレッドで行う。
+    # Streamlitの再実行時に呼ばれてもハンドラは重複しない
+    pipeline = get_pipeline()
+    if log_file:
+        pipeline.add_file(log_file)
+    pipeline.attach(logger)
 
-    # ファイルハンドラ: ファイルにログを書き込む
-    # 1MBでローテーションし、最大5つのバックアップファイルを保持
-    file_handler = RotatingFileHandler(
-        log_file, maxBytes=1*1024*1024, backupCount=5, encoding='utf-8'
-    )
-    file_handler.setFormatter(formatter)
-
-    # ストリームハンドラ: コンソールにログを出力する
-    stream_handler = logging.StreamHandler()
-    stream_handler.setFormatter(formatter)
+    return logger
 
-    # ロガーにハンドラを追加
-    logger.addHandler(file_handler)
-    logger.addHandler(stream_handler) # コンソールにも出力する場合
 
+def setup_private_logger(name: str, level=logging.INFO):
+    """
+    ログパイプラインに流さないロガー (標準エラーに直接出す)。
+    パイプラインの出力先 (sink) 自身のログに使う。パイプラインに流すと自分の出力先に戻り、
+    失敗のログがさらに書き込みと失敗を起こすため
+    """
+    logger = logging.getLogger(name)
+    logger.setLevel(level)
+    logger.propagate = False
+    if not logger.handlers:
+        handler = logging.StreamHandler(sys.stderr)
+        handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+        logger.addHandler(handler)
     return logger
 
 # アプリケーション全体で利用するロガーインスタンス
-logger = setup_logger('assessment_logger', LOG_FILE)
+logger = setup_logger('assessment_logger')
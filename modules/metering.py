@@ -0,0 +1,239 @@
+"""
+トークン使用量とコストの計測
+
+各 Gemini 呼び出しの usage_metadata (入力・キャッシュ済み・出力トークン数) を、
+セッションとモジュール ([[SCORE]] で区切られる段階) ごとに集計する。
+
+集計結果の確認:
+
+    python -m modules.metering usage.jsonl [--input-price 0.3 --cached-price 0.075 --output-price 2.5]
+
+入力は METERING_LOG で出力したJSONL、またはアプリのJSONログ (metrics に usage を含む行) のどちらでもよい。
+"""
+import argparse
+import collections
+import json
+import statistics
+import sys
+import threading
+
+from modules.prompts import FINAL_STAGE
+
+# usage_metadata のフィールド名
+USAGE_FIELDS = ("prompt_tokens", "cached_tokens", "output_tokens")
+
+
+def stage_label(stage: int) -> str:
+    return "final" if stage >= FINAL_STAGE else f"module{stage}"
+
+
+def usage_from_response(response):
+    """
+    応答 (またはストリームの最後のチャンク) の usage_metadata から (入力, キャッシュ済み, 出力) を取り出す。
+    usage_metadata がなければ None
+    """
+    usage = getattr(response, "usage_metadata", None)
+    if usage is None:
+        return None
+    prompt = getattr(usage, "prompt_token_count", None) or 0
+    cached = getattr(usage, "cached_content_token_count", None) or 0
+    # 思考トークンは出力として課金される
+    output = (getattr(usage, "candidates_token_count", None) or 0) + (getattr(usage, "thoughts_token_count", None) or 0)
+    return prompt, cached, output
+
+
+class Pricing:
+    """100万トークンあたりの単価 (入力・キャッシュ済み入力・出力)"""
+    def __init__(self, input_per_million: float = 0.0, cached_per_million: float = 0.0, output_per_million: float = 0.0):
+        self.input_per_million = input_per_million
+        self.cached_per_million = cached_per_million
+        self.output_per_million = output_per_million
+
+    def cost(self, prompt_tokens: int, cached_tokens: int, output_tokens: int) -> float:
+        # prompt_token_count にはキャッシュ済みのトークンも含まれる
+        return ((prompt_tokens - cached_tokens) * self.input_per_million
+                + cached_tokens * self.cached_per_million
+                + output_tokens * self.output_per_million) / 1_000_000
+
+
+class SessionMeter:
+    """
+    1セッション分の使用量。モジュールごとに [入力, キャッシュ済み, 出力, 呼び出し回数] を保持する
+    """
+    __slots__ = ("session_id", "budget_tokens", "modules")
+
+    def __init__(self, session_id: str, budget_tokens: int = 0):
+        self.session_id = session_id
+        self.budget_tokens = budget_tokens     # 0 なら上限なし
+        self.modules = {}
+
+    def record(self, module: str, prompt_tokens: int, cached_tokens: int, output_tokens: int):
+        totals = self.modules.setdefault(module, [0, 0, 0, 0])
+        totals[0] += prompt_tokens
+        totals[1] += cached_tokens
+        totals[2] += output_tokens
+        totals[3] += 1
+
+    @property
+    def total_tokens(self) -> int:
+        return sum(totals[0] + totals[2] for totals in self.modules.values())
+
+    @property
+    def over_budget(self) -> bool:
+        return bool(self.budget_tokens) and self.total_tokens >= self.budget_tokens
+
+    def cost(self, pricing: Pricing) -> float:
+        return sum(pricing.cost(*totals[:3]) for totals in self.modules.values())
+
+    def to_state(self) -> dict:
+        return {"session_id": self.session_id, "budget_tokens": self.budget_tokens,
+                "modules": {module: list(totals) for module, totals in self.modules.items()}}
+
+    @classmethod
+    def from_state(cls, state: dict):
+        meter = cls(state["session_id"], state.get("budget_tokens", 0))
+        meter.modules = {module: list(totals) for module, totals in state.get("modules", {}).items()}
+        return meter
+
+
+class UsageRegistry:
+    """
+    プロセス全体の使用量の集計 (モジュールごとの合計) と、呼び出しごとの記録の出力先 (JSONL)
+    """
+    def __init__(self, pricing: Pricing = None, log_path: str = None):
+        self.pricing = pricing or Pricing()
+        self.log_path = log_path
+        self.calls = 0
+        self.sessions = set()
+        self.modules = collections.defaultdict(lambda: [0, 0, 0, 0])
+        self._lock = threading.Lock()
+
+    def record(self, meter: SessionMeter, module: str, usage, timestamp: str = None) -> dict:
+        prompt_tokens, cached_tokens, output_tokens = usage
+        meter.record(module, prompt_tokens, cached_tokens, output_tokens)
+        entry = {
+            "timestamp": timestamp,
+            "session_id": meter.session_id,
+            "module": module,
+            "prompt_tokens": prompt_tokens,
+            "cached_tokens": cached_tokens,
+            "output_tokens": output_tokens,
+            "cost": round(self.pricing.cost(prompt_tokens, cached_tokens, output_tokens), 6),
+        }
+        with self._lock:
+            self.calls += 1
+            self.sessions.add(meter.session_id)
+            totals = self.modules[module]
+            totals[0] += prompt_tokens
+            totals[1] += cached_tokens
+            totals[2] += output_tokens
+            totals[3] += 1
+            if self.log_path:
+                with open(self.log_path, "a", encoding="utf-8") as f:
+                    f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+        return entry
+
+    def snapshot(self) -> list:
+        with self._lock:
+            rows = []
+            for module, (prompt_tokens, cached_tokens, output_tokens, calls) in sorted(
+                    self.modules.items(), key=lambda item: _module_order(item[0])):
+                rows.append({
+                    "module": module,
+                    "calls": calls,
+                    "prompt_tokens": prompt_tokens,
+                    "cached_tokens": cached_tokens,
+                    "output_tokens": output_tokens,
+                    "cost": round(self.pricing.cost(prompt_tokens, cached_tokens, output_tokens), 4),
+                })
+            return rows
+
+
+# --- Report ---
+def read_entries(lines):
+    """METERING_LOG のJSONL、またはアプリのJSONログの行から使用量の記録を取り出す"""
+    for line in lines:
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            entry = json.loads(line)
+        except ValueError:
+            continue
+        if "metrics" in entry and isinstance(entry["metrics"], dict):
+            entry = entry["metrics"].get("usage") or {}
+        if "session_id" in entry and all(field in entry for field in USAGE_FIELDS):
+            yield entry
+
+
+def _module_order(module: str):
+    return (module == "final", module)
+
+
+def _distribution(values, fmt: str = ",.0f") -> str:
+    ordered = sorted(values)
+    if not ordered:
+        return "-"
+
+    def pick(q):
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+    return (f"mean={statistics.mean(ordered):{fmt}} p50={pick(0.5):{fmt}} "
+            f"p95={pick(0.95):{fmt}} max={ordered[-1]:{fmt}}")
+
+
+def build_report(entries, pricing: Pricing) -> str:
+    sessions = collections.defaultdict(lambda: [0, 0, 0, 0.0])
+    modules = collections.defaultdict(lambda: [0, 0, 0, 0])
+    for entry in entries:
+        usage = [entry[field] for field in USAGE_FIELDS]
+        cost = pricing.cost(*usage)
+        session = sessions[entry["session_id"]]
+        for i in range(3):
+            session[i] += usage[i]
+        session[3] += cost
+        module = modules[entry.get("module", "unknown")]
+        for i in range(3):
+            module[i] += usage[i]
+        module[3] += 1
+
+    if not sessions:
+        return "No usage records found."
+
+    count = len(sessions)
+    lines = [f"sessions: {count}", "", "per session:"]
+    lines.append(f"  prompt_tokens  {_distribution([s[0] for s in sessions.values()])}")
+    lines.append(f"  cached_tokens  {_distribution([s[1] for s in sessions.values()])}")
+    lines.append(f"  output_tokens  {_distribution([s[2] for s in sessions.values()])}")
+    lines.append(f"  cost           {_distribution([s[3] for s in sessions.values()], '.4f')}")
+    lines.append(f"  total cost     {sum(s[3] for s in sessions.values()):,.4f}")
+    lines += ["", "per module (average per session):"]
+    for module, (prompt_tokens, cached_tokens, output_tokens, calls) in sorted(
+            modules.items(), key=lambda item: _module_order(item[0])):
+        cost = pricing.cost(prompt_tokens, cached_tokens, output_tokens)
+        lines.append(f"  {module:<8} calls={calls / count:5.1f} prompt={prompt_tokens / count:10,.0f} "
+                     f"cached={cached_tokens / count:10,.0f} output={output_tokens / count:8,.0f} "
+                     f"cost={cost / count:.4f}")
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Summarize token usage per session and module")
+    parser.add_argument("paths", nargs="*", help="usage JSONL or app JSON log files (default: stdin)")
+    parser.add_argument("--input-price", type=float, default=0.0, help="USD per 1M input tokens")
+    parser.add_argument("--cached-price", type=float, default=0.0, help="USD per 1M cached input tokens")
+    parser.add_argument("--output-price", type=float, default=0.0, help="USD per 1M output tokens")
+    args = parser.parse_args(argv)
+
+    pricing = Pricing(args.input_price, args.cached_price, args.output_price)
+    entries = []
+    if not args.paths:
+        entries.extend(read_entries(sys.stdin))
+    for path in args.paths:
+        with open(path, "r", encoding="utf-8") as f:
+            entries.extend(read_entries(f))
+    print(build_report(entries, pricing))
+
+
+if __name__ == "__main__":
+    main()
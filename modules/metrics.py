@@ -0,0 +1,138 @@
+import functools
+import threading
+import time
+from contextlib import contextmanager
+
+# ヒストグラムのバケット境界 (ミリ秒。サイズ系のメトリクスもこの境界を使う)
+DEFAULT_BUCKETS = (1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000, 60000, 120000)
+
+
+class Histogram:
+    """
+    固定バケットのヒストグラム。値そのものは保持しないので、観測数が増えてもメモリは一定
+    """
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.bounds = tuple(buckets)
+        self.counts = [0] * (len(self.bounds) + 1)  # 最後は +Inf
+        self.count = 0
+        self.sum = 0.0
+        self.min = None
+        self.max = None
+
+    def observe(self, value: float):
+        index = len(self.bounds)
+        for i, bound in enumerate(self.bounds):
+            if value <= bound:
+                index = i
+                break
+        self.counts[index] += 1
+        self.count += 1
+        self.sum += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+
+    def quantile(self, q: float):
+        """バケット内を線形補間した近似値"""
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for i, count in enumerate(self.counts):
+            if count and seen + count >= rank:
+                lower = self.bounds[i - 1] if i > 0 else 0.0
+                upper = self.bounds[i] if i < len(self.bounds) else self.max
+                lower = max(lower, self.min)
+                upper = min(upper, self.max)
+                return lower + (upper - lower) * (rank - seen) / count
+            seen += count
+        return self.max
+
+    def summary(self) -> dict:
+        return {
+            "count": self.count,
+            "mean": round(self.sum / self.count, 2) if self.count else None,
+            "p50": _round(self.quantile(0.50)),
+            "p95": _round(self.quantile(0.95)),
+            "p99": _round(self.quantile(0.99)),
+            "max": _round(self.max),
+        }
+
+
+def _round(value):
+    return None if value is None else round(value, 2)
+
+
+class MetricsRegistry:
+    """
+    プロセス内の全セッションのメトリクスを名前ごとのヒストグラムに集計する
+    """
+    def __init__(self):
+        self._histograms = {}
+        self._lock = threading.Lock()
+
+    def observe(self, name: str, value: float):
+        with self._lock:
+            histogram = self._histograms.get(name)
+            if histogram is None:
+                histogram = self._histograms[name] = Histogram()
+            histogram.observe(value)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {name: histogram.summary() for name, histogram in sorted(self._histograms.items())}
+
+    def render_text(self) -> str:
+        """Prometheus のテキスト形式に近いダンプ"""
+        lines = []
+        with self._lock:
+            for name, histogram in sorted(self._histograms.items()):
+                lines.append(f"# TYPE {name} histogram")
+                cumulative = 0
+                for bound, count in zip(list(histogram.bounds) + ["+Inf"], histogram.counts):
+                    cumulative += count
+                    lines.append(f'{name}_bucket{{le="{bound}"}} {cumulative}')
+                lines.append(f"{name}_sum {round(histogram.sum, 3)}")
+                lines.append(f"{name}_count {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+    def clear(self):
+        with self._lock:
+            self._histograms.clear()
+
+
+# プロセス内で共有するデフォルトのレジストリ
+registry = MetricsRegistry()
+
+
+@contextmanager
+def timer(name: str, fields: dict = None, registry: MetricsRegistry = registry):
+    """
+    ブロックの所要時間 (ミリ秒) をヒストグラムに記録する。
+    fields を渡すと、ログに出力するメトリクスとして fields[name] にも格納する
+    """
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = (time.perf_counter() - started) * 1000
+        registry.observe(name, elapsed)
+        if fields is not None:
+            fields[name] = round(elapsed, 2)
+
+
+def timed(name: str, registry: MetricsRegistry = registry):
+    """関数の所要時間を記録するデコレーター"""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with timer(name, registry=registry):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def observe(name: str, value: float, fields: dict = None, registry: MetricsRegistry = registry):
+    """時間以外の値 (履歴の長さ・送信サイズなど) を記録する"""
+    registry.observe(name, value)
+    if fields is not None:
+        fields[name] = value
@@ -0,0 +1,122 @@
+import collections
+import hashlib
+import threading
+import time
+
+# テンプレートを生成するときに名前の代わりに渡す文字列 (応答中のこの文字列を受検者の名前に置き換える)
+NAME_PLACEHOLDER = "USER_NAME"
+# テンプレートの生成に失敗・不適格だった後、作り直しを試みるまでの待機秒数 (続けて失敗するたびに倍にする)
+RETRY_AFTER_FAILURE = 300.0
+MAX_RETRY_AFTER_FAILURE = 6 * 3600.0
+
+
+class InvalidTemplate(ValueError):
+    """生成した導入文がテンプレートとして使えない (名前の呼びかけが1回でない・タグを含む)"""
+
+
+def initial_prompt(user_name: str) -> str:
+    """開始時の指示 (Gemini にのみ渡し、画面には表示しない)"""
+    return f"ユーザーの{user_name}さんが参加しました。アセスメントを開始してください。"
+
+
+def cache_key(backend_kind: str, model_name: str, system_instruction: str) -> str:
+    # prompts.md の更新 (システムプロンプトの変化) やモデルの切り替えで別のキーになる
+    return hashlib.sha256(f"{backend_kind}\n{model_name}\n{system_instruction}".encode("utf-8")).hexdigest()
+
+
+def is_valid_template(text: str) -> bool:
+    # 導入の応答にはタグ (スコア・終了) が含まれないはず。含まれていれば使い回さない。
+    # 名前の呼びかけがちょうど1回でなければ (省略・重複・言い換え) 名前を正しく差し込めないので使わない
+    return bool(text and text.strip()) and "[[" not in text and text.count(NAME_PLACEHOLDER) == 1
+
+
+class OpeningCache:
+    """
+    最初の応答 (Module 1 の導入) を名前を伏せたテンプレートとして保持し、名前を差し込んで返す。
+    テンプレートがなければ呼び出し元は通常どおり生成し、その間にバックグラウンドでテンプレートを作る。
+    テンプレートは ttl_seconds 秒で期限切れとし、全員が同じ導入文を受け取り続けないよう作り直す (0 なら無期限)。
+    生成は同じキーにつき同時に1つだけ行い、失敗・不適格だった場合は一定時間 (続けて失敗するたびに倍) 作り直さない
+    """
+    def __init__(self, max_entries: int = 8, ttl_seconds: float = 6 * 3600, clock=time.monotonic):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._clock = clock
+        self.hits = 0
+        self.misses = 0
+        self._entries = collections.OrderedDict()
+        self._refreshing = set()
+        self._failures = {}         # key -> (続けて失敗した回数, 次に作り直せる時刻)
+        self.rejected = 0
+        self._lock = threading.Lock()
+
+    def get(self, key: str, user_name: str):
+        """
+        名前を差し込んだ導入文を返す。テンプレートがなければ None
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and self.ttl_seconds and self._clock() - entry[1] >= self.ttl_seconds:
+                del self._entries[key]
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            template = entry[0]
+            self._entries.move_to_end(key)
+            self.hits += 1
+        return template.replace(NAME_PLACEHOLDER, user_name)
+
+    def put(self, key: str, template: str) -> bool:
+        if not is_valid_template(template):
+            return False
+        with self._lock:
+            self._entries[key] = (template, self._clock())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return True
+
+    def refresh(self, key: str, generate, on_error=None) -> bool:
+        """
+        generate() (名前を伏せた導入文を返す関数) をバックグラウンドで実行してテンプレートを作る。
+        同じキーの生成が実行中か、失敗後に作り直しを控えている間は何もしない。
+        on_error(例外, 作り直しを控える秒数) は生成の失敗とテンプレートの不適格のどちらでも呼ばれる
+        """
+        with self._lock:
+            if key in self._refreshing:
+                return False
+            failure = self._failures.get(key)
+            if failure is not None and self._clock() < failure[1]:
+                return False
+            self._refreshing.add(key)
+        thread = threading.Thread(target=self._fill, args=(key, generate, on_error),
+                                  name="OpeningCache", daemon=True)
+        thread.start()
+        return True
+
+    def _fill(self, key: str, generate, on_error):
+        try:
+            template = generate()
+            if not self.put(key, template):
+                with self._lock:
+                    self.rejected += 1
+                raise InvalidTemplate(
+                    f"Opening template rejected ({NAME_PLACEHOLDER} appears {(template or '').count(NAME_PLACEHOLDER)} times)")
+        except Exception as e:
+            delay = self._record_failure(key)
+            if on_error is not None:
+                on_error(e, delay)
+        else:
+            with self._lock:
+                self._failures.pop(key, None)
+        finally:
+            with self._lock:
+                self._refreshing.discard(key)
+
+    def _record_failure(self, key: str) -> float:
+        """失敗を記録し、作り直しを控える秒数を返す"""
+        with self._lock:
+            count = self._failures.get(key, (0, 0.0))[0] + 1
+            delay = min(MAX_RETRY_AFTER_FAILURE, RETRY_AFTER_FAILURE * 2 ** (count - 1))
+            self._failures[key] = (count, self._clock() + delay)
+        return delay
@@ -0,0 +1,289 @@
+"""
+プロンプトの回帰評価
+
+台本の回答 (コーパス) を実際の会話と同じ手順 (開始時の指示 → 回答) でバックエンドに送り、
+[[SCORE]] / [[RATIONALE]] を取り出して、プロンプトの版ごとにスコアの分布・繰り返しによるばらつき・
+ターンごとのレイテンシ・トークン使用量とコストを集計する。
+
+    python -m modules.prompt_eval run eval/module1_patterns.json --backend mock --repeats 3 --workers 8
+    python -m modules.prompt_eval run eval/module1_patterns.json --backend gemini --model gemini-2.5-flash
+    python -m modules.prompt_eval report eval/module1_patterns.json [--input-price 0.3 --output-price 2.5]
+
+結果は (プロンプトの版, 回答, バックエンド・モデル, 繰り返し番号) ごとに --cache (SQLite) に保存するため、
+再実行では変わったもの (prompts.md を編集した版やコーパスに追加した回答) だけを評価する。
+report はキャッシュにある全ての版を並べて表示する。
+
+コーパスの形式 (JSON):
+
+    [{"id": "m1_pattern_a", "answers": ["..."], "expected": [3, 5],
+      "history": [{"role": "user", "text": "..."}, {"role": "model", "text": "..."}],   # 省略可
+      "completed_modules": 0, "user_name": "評価"}]                                      # 省略可
+
+history を省略すると開始時の指示から始める (Module 1)。expected はスコアの期待範囲 (両端を含む)。
+1件は1モジュールの評価で、最初のスコアが出た時点で終える。answers の2件目以降は、
+スコアの前に深掘りの質問が返ってきた場合の追加の回答として順に送る。
+"""
+import argparse
+import collections
+import hashlib
+import json
+import os
+import sqlite3
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from modules import prompts
+from modules.metering import Pricing, usage_from_response
+from modules.opening_cache import initial_prompt
+from modules.tag_parser import StreamingTagParser
+
+
+class EvalCase:
+    __slots__ = ("id", "answers", "history", "expected", "completed_modules", "user_name")
+
+    def __init__(self, id: str, answers, history=None, expected=None, completed_modules: int = 0,
+                 user_name: str = "評価"):
+        self.id = id
+        self.answers = list(answers)
+        self.history = list(history or [])
+        self.expected = tuple(expected) if expected else None
+        self.completed_modules = completed_modules
+        self.user_name = user_name
+
+    @property
+    def fingerprint(self) -> str:
+        # 回答・前提の会話が変わったときだけ別の結果として扱う (id や期待範囲は含めない)
+        payload = json.dumps([self.answers, self.history, self.completed_modules, self.user_name], ensure_ascii=False)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def messages(self):
+        if self.history:
+            return list(self.answers)
+        return [initial_prompt(self.user_name)] + self.answers
+
+    def gemini_history(self):
+        return [{"role": item["role"], "parts": [{"text": item["text"]}]} for item in self.history]
+
+
+def load_corpus(path: str):
+    with open(path, "r", encoding="utf-8") as f:
+        return [EvalCase(**item) for item in json.load(f)]
+
+
+def prompt_version(scoped: bool) -> str:
+    """評価に使うプロンプトの版 (prompts.md の内容と、モジュールごとに絞るかどうか)"""
+    prompts.reload_if_changed()
+    return f"{prompts.PROMPT_HASH[:12]}{'-scoped' if scoped else ''}"
+
+
+def system_instruction(stage: int, scoped: bool) -> str:
+    return prompts.build_system_prompt(stage) if scoped else prompts.get_system_prompt()
+
+
+def run_case(backend, case: EvalCase, scoped: bool) -> dict:
+    """
+    1件の会話を最初のスコア (または終了) まで流す。アプリと同じく、ターンごとに履歴からチャットを作り直して送信する
+    """
+    history = case.gemini_history()
+    # スコアが出た時点で終えるため、1件の中で段階は変わらない
+    stage = prompts.current_stage(case.completed_modules)
+    result = {"scores": [], "rationales": [], "turn_ms": [], "usage": [0, 0, 0], "ended": False}
+    for message in case.messages():
+        chat = backend.start_chat(history=list(history), system_instruction=system_instruction(stage, scoped))
+        started = time.perf_counter()
+        parser = StreamingTagParser()
+        usage_chunk = None
+        for chunk in backend.send_message(chat, message, stream=True):
+            if getattr(chunk, "usage_metadata", None) is not None:
+                usage_chunk = chunk
+            parser.feed(chunk.text)
+        parser.finish()
+        result["turn_ms"].append(round((time.perf_counter() - started) * 1000, 2))
+        usage = usage_from_response(usage_chunk) if usage_chunk is not None else None
+        if usage is not None:
+            result["usage"] = [total + value for total, value in zip(result["usage"], usage)]
+
+        result["scores"].extend(parser.scores)
+        result["rationales"].extend(parser.rationales)
+        history.append({"role": "user", "parts": [{"text": message}]})
+        history.append({"role": "model", "parts": [{"text": parser.raw_text}]})
+        result["ended"] = parser.end_of_assessment
+        if parser.scores or parser.end_of_assessment:
+            break
+    return result
+
+
+class ResultCache:
+    """評価結果のキャッシュ (SQLite)"""
+    def __init__(self, path: str = "eval_cache.db"):
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS results (key TEXT PRIMARY KEY, version TEXT, target TEXT, "
+                "case_id TEXT, fingerprint TEXT, repeat INTEGER, value TEXT, created_at REAL)"
+            )
+            self._conn.commit()
+
+    @staticmethod
+    def key(version: str, target: str, case: EvalCase, repeat: int) -> str:
+        return hashlib.sha256(f"{version}\n{target}\n{case.fingerprint}\n{repeat}".encode("utf-8")).hexdigest()
+
+    def get(self, key: str):
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM results WHERE key = ?", (key,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def put(self, key: str, version: str, target: str, case: EvalCase, repeat: int, value: dict):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (key, version, target, case.id, case.fingerprint, repeat, json.dumps(value, ensure_ascii=False),
+                 time.time()),
+            )
+            self._conn.commit()
+
+    def results_for(self, cases):
+        """コーパスの各ケースについて、キャッシュにある全ての版・対象の結果を返す"""
+        order = {case.fingerprint: (index, case) for index, case in enumerate(cases)}
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT version, target, fingerprint, repeat, value, MIN(created_at) OVER (PARTITION BY version, target) "
+                "FROM results").fetchall()
+        # 版・対象は最初に評価した順、その中はコーパスの順に並べる
+        rows = [row for row in rows if row[2] in order]
+        rows.sort(key=lambda row: (row[5], row[0], row[1], order[row[2]][0], row[3]))
+        for version, target, fingerprint, repeat, value, _ in rows:
+            yield version, target, order[fingerprint][1], repeat, json.loads(value)
+
+
+def evaluate(backend, cases, cache: ResultCache, version: str, target: str, repeats: int = 1,
+             workers: int = 4, scoped: bool = True, on_result=None):
+    """
+    キャッシュにない (ケース, 繰り返し番号) だけを最大 workers 件まで並行して評価する。
+    (評価した件数, キャッシュから読んだ件数, 失敗した件数) を返す。失敗はキャッシュしない
+    """
+    jobs = []
+    cached = 0
+    for case in cases:
+        for repeat in range(repeats):
+            key = ResultCache.key(version, target, case, repeat)
+            if cache.get(key) is None:
+                jobs.append((key, case, repeat))
+            else:
+                cached += 1
+
+    failed = 0
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(run_case, backend, case, scoped): (key, case, repeat) for key, case, repeat in jobs}
+        for future in as_completed(futures):
+            key, case, repeat = futures[future]
+            try:
+                result = future.result()
+            except Exception as e:
+                failed += 1
+                if on_result is not None:
+                    on_result(case, repeat, None, e)
+                continue
+            cache.put(key, version, target, case, repeat, result)
+            if on_result is not None:
+                on_result(case, repeat, result, None)
+    return len(jobs) - failed, cached, failed
+
+
+def _percentile(ordered, q: float):
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))] if ordered else float("nan")
+
+
+def build_report(rows, pricing: Pricing) -> str:
+    """
+    (版, 対象) ごとに、ケース別のスコア分布と期待範囲に入った割合、全体のレイテンシとトークン使用量を表にする
+    """
+    groups = collections.OrderedDict()
+    for version, target, case, repeat, result in rows:
+        groups.setdefault((version, target), collections.OrderedDict()).setdefault(case.id, (case, []))[1].append(result)
+    if not groups:
+        return "No cached results for this corpus."
+
+    lines = []
+    for (version, target), cases in groups.items():
+        turn_ms = sorted(ms for _, results in cases.values() for result in results for ms in result["turn_ms"])
+        runs = [result for _, results in cases.values() for result in results]
+        usage = [sum(result["usage"][i] for result in runs) / len(runs) for i in range(3)]
+        in_range = [(low <= result["scores"][0] <= high) for case, results in cases.values() if case.expected
+                    for low, high in [case.expected] for result in results if result["scores"]]
+        lines.append(f"== prompt {version} / {target}: {len(runs)} runs, in expected range {sum(in_range)}/{len(in_range)}")
+        lines.append(f"   turn latency p50={_percentile(turn_ms, 0.5):.0f}ms p95={_percentile(turn_ms, 0.95):.0f}ms  "
+                     f"tokens/run prompt={usage[0]:,.0f} cached={usage[1]:,.0f} output={usage[2]:,.0f}  "
+                     f"cost/run={pricing.cost(*usage):.4f}")
+        for case_id, (case, results) in cases.items():
+            scores = [result["scores"][0] for result in results if result["scores"]]
+            missing = len(results) - len(scores)
+            if scores:
+                spread = (f"mean={statistics.mean(scores):4.1f} sd={statistics.pstdev(scores):3.1f} "
+                          f"min={min(scores)} max={max(scores)} dist={dict(sorted(collections.Counter(scores).items()))}")
+            else:
+                spread = "no score"
+            expected = ""
+            if case.expected and scores:
+                low, high = case.expected
+                hits = sum(1 for score in scores if low <= score <= high)
+                expected = f" in [{low}, {high}]: {hits}/{len(scores)}"
+            unscored = f" unscored={missing}" if missing else ""
+            lines.append(f"   {case_id:<24} n={len(results):<3} {spread}{expected}{unscored}")
+        lines.append("")
+    return "\n".join(lines).rstrip()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Prompt regression evaluation over a canned answer corpus")
+    commands = parser.add_subparsers(dest="command", required=True)
+    for name in ("run", "report"):
+        command = commands.add_parser(name)
+        command.add_argument("corpus", help="corpus JSON file")
+        command.add_argument("--cache", default="eval_cache.db")
+        command.add_argument("--input-price", type=float, default=0.0, help="USD per 1M input tokens")
+        command.add_argument("--cached-price", type=float, default=0.0, help="USD per 1M cached input tokens")
+        command.add_argument("--output-price", type=float, default=0.0, help="USD per 1M output tokens")
+        if name == "run":
+            command.add_argument("--backend", default="mock", help="gemini / mock / replay / fault")
+            command.add_argument("--model", default=None, help="default: GEMINI_MODEL")
+            command.add_argument("--replay-path", default=None)
+            command.add_argument("--repeats", type=int, default=3)
+            command.add_argument("--workers", type=int, default=4)
+            command.add_argument("--full-prompt", action="store_true", help="send the whole prompts.md every turn")
+    args = parser.parse_args(argv)
+
+    cases = load_corpus(args.corpus)
+    cache = ResultCache(args.cache)
+    pricing = Pricing(args.input_price, args.cached_price, args.output_price)
+
+    if args.command == "run":
+        from modules.llm_backends import create_backend
+
+        model_name = args.model or os.getenv("GEMINI_MODEL")
+        backend = create_backend(args.backend, api_key=os.getenv("GEMINI_API_KEY"), model_name=model_name,
+                                 replay_path=args.replay_path, replay_speed=0, resilience={})
+        scoped = not args.full_prompt
+        version = prompt_version(scoped)
+        target = f"{args.backend}:{model_name or '-'}"
+
+        def on_result(case, repeat, result, error):
+            if error is not None:
+                print(f"  {case.id} #{repeat}: failed ({error})")
+            else:
+                print(f"  {case.id} #{repeat}: scores={result['scores']} turns={len(result['turn_ms'])}")
+
+        started = time.perf_counter()
+        evaluated, cached, failed = evaluate(backend, cases, cache, version, target, args.repeats,
+                                             args.workers, scoped, on_result)
+        print(f"prompt {version} / {target}: evaluated={evaluated} cached={cached} failed={failed} "
+              f"in {time.perf_counter() - started:.1f}s")
+        print()
+    print(build_report(cache.results_for(cases), pricing))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,13 +1,193 @@
+import hashlib
 import os
+import re
+import threading
+from functools import lru_cache
 
 # Get the directory of the current file
 current_dir = os.path.dirname(os.path.abspath(__file__))
 prompt_file_path = os.path.join(current_dir, "prompts.md")
 
-# Read the system prompt from the Markdown file
-try:
-    with open(prompt_file_path, "r", encoding="utf-8") as f:
-        SYSTEM_PROMPT = f.read()
-except FileNotFoundError:
-    # Fallback or error handling if file is missing (though it should be there)
-    SYSTEM_PROMPT = "Error: prompts.md not found."
+
+def _read_prompt_file() -> str:
+    # Read the system prompt from the Markdown file
+    try:
+        with open(prompt_file_path, "r", encoding="utf-8") as f:
+            return f.read()
+    except FileNotFoundError:
+        # Fallback or error handling if file is missing (though it should be there)
+        return "Error: prompts.md not found."
+
+
+def _file_mtime():
+    try:
+        return os.stat(prompt_file_path).st_mtime_ns
+    except OSError:
+        return None
+
+
+SYSTEM_PROMPT = _read_prompt_file()
+# prompts.md の内容ハッシュ（キャッシュの無効化判定に使う）
+PROMPT_HASH = hashlib.sha256(SYSTEM_PROMPT.encode("utf-8")).hexdigest()
+_loaded_mtime = _file_mtime()
+_reload_lock = threading.Lock()
+
+MODULE_COUNT = 4
+# 最終フィードバックの段階 (Module 4 の評価が終わった後)
+FINAL_STAGE = MODULE_COUNT + 1
+
+_H1 = re.compile(r"^# ", re.MULTILINE)
+_MODULE_HEADER = re.compile(r"^## .*?Module (\d+)", re.MULTILINE)
+
+
+def split_sections(prompt: str):
+    """
+    prompts.md を「共通ルール」「Module 1-4 の定義」「総合フィードバック」に分割する。
+    戻り値: {"common": str, "module_intro": str, "modules": {番号: str}, "final": str}
+    """
+    sections = {"common": [], "module_intro": "", "modules": {}, "final": []}
+    starts = [m.start() for m in _H1.finditer(prompt)]
+    if not starts or starts[0] != 0:
+        starts.insert(0, 0)
+
+    for begin, end in zip(starts, starts[1:] + [len(prompt)]):
+        block = prompt[begin:end]
+        # 区切り線 (---) は組み立て時に付け直すため、各ブロックの末尾からは取り除く
+        stripped = block.strip().rstrip("-").strip()
+        title = block.split("\n", 1)[0]
+        module_headers = list(_MODULE_HEADER.finditer(block))
+        if module_headers:
+            sections["module_intro"] = block[:module_headers[0].start()].strip()
+            bounds = [m.start() for m in module_headers] + [len(block)]
+            for match, module_end in zip(module_headers, bounds[1:]):
+                sections["modules"][int(match.group(1))] = block[match.start():module_end].strip().rstrip("-").strip()
+        elif "フィードバック" in title:
+            sections["final"].append(stripped)
+        else:
+            sections["common"].append(stripped)
+
+    sections["common"] = "\n\n---\n\n".join(sections["common"])
+    sections["final"] = "\n\n---\n\n".join(sections["final"])
+    return sections
+
+
+PROMPT_SECTIONS = split_sections(SYSTEM_PROMPT)
+
+
+def reload_if_changed() -> bool:
+    """
+    prompts.md が更新されていれば読み込み直す（更新時刻を確認するだけなので毎ターン呼んでよい）。
+    内容が変わった場合のみ True を返す。
+    """
+    global SYSTEM_PROMPT, PROMPT_HASH, PROMPT_SECTIONS, _loaded_mtime
+    mtime = _file_mtime()
+    if mtime == _loaded_mtime:
+        return False
+    with _reload_lock:
+        if mtime == _loaded_mtime:
+            return False
+        _loaded_mtime = mtime
+        text = _read_prompt_file()
+        new_hash = hashlib.sha256(text.encode("utf-8")).hexdigest()
+        if new_hash == PROMPT_HASH:
+            return False
+        SYSTEM_PROMPT = text
+        PROMPT_SECTIONS = split_sections(text)
+        PROMPT_HASH = new_hash
+        _build_system_prompt.cache_clear()
+        _build_scoring_prompt.cache_clear()
+        return True
+
+
+def get_system_prompt() -> str:
+    reload_if_changed()
+    return SYSTEM_PROMPT
+
+
+def current_stage(completed_modules: int) -> int:
+    """
+    採点済みモジュール数から現在の段階 (1-4: 各Module, 5: 総合フィードバック) を返す
+    """
+    return min(completed_modules + 1, FINAL_STAGE)
+
+
+def build_system_prompt(stage: int) -> str:
+    """
+    指定した段階に必要なセクションだけを組み立てたシステムプロンプトを返す（段階ごとにキャッシュ）。
+
+    - 共通ルールは常に含める
+    - 直前に採点したモジュール（スコア開示用）と、現在のモジュールの定義を含める
+    - Module 4 以降は総合フィードバックのガイドラインを含める
+    - 総合フィードバックの段階では、全モジュールのサブ評価項目を振り返るため全モジュールの定義を含める
+    - 組み立てた結果が全文より短くならない場合 (総合フィードバックの段階など) は全文をそのまま使う
+    """
+    reload_if_changed()
+    return _build_system_prompt(stage)
+
+
+@lru_cache(maxsize=None)
+def _build_system_prompt(stage: int) -> str:
+    sections = PROMPT_SECTIONS
+    if not sections["modules"]:
+        # 想定した構成で分割できなければ全文を使う
+        return SYSTEM_PROMPT
+
+    if stage >= FINAL_STAGE:
+        include = sorted(sections["modules"])
+    else:
+        include = sorted({n for n in (stage - 1, stage) if n in sections["modules"]})
+
+    overview = (
+        "# 現在の進行状況\n"
+        f"アセスメントは Module 1-{MODULE_COUNT} と総合フィードバックで構成されます。"
+    )
+    if stage >= FINAL_STAGE:
+        overview += "現在は全モジュールの評価が完了し、総合フィードバックの段階です。"
+    else:
+        overview += f"現在は Module {stage} の段階です。"
+
+    parts = [sections["common"], overview]
+    if include:
+        parts.append("\n\n".join([sections["module_intro"]] + [sections["modules"][n] for n in include]))
+    if stage >= MODULE_COUNT and sections["final"]:
+        parts.append(sections["final"])
+    prompt = "\n\n---\n\n".join(part for part in parts if part)
+    # 全セクションを含む段階では、進行状況と区切り線の分だけ全文より長くなるため全文を送る
+    return prompt if len(prompt) < len(SYSTEM_PROMPT) else SYSTEM_PROMPT
+
+
+# --- Background scoring ---
+# 採点を別の呼び出しで行う場合に、会話用のシステムプロンプトへ追加する指示
+BACKGROUND_SCORING_NOTE = (
+    "# 採点の出力について (このセッションでの変更)\n"
+    "評価時は `[[SCORE:X]]` のみを出力し、`[[RATIONALE: ... ]]` タグは出力しないでください。"
+    "サブ評価項目ごとの採点と根拠は、別の処理で作成されます。"
+)
+
+SCORING_FORMAT = (
+    "# 出力形式\n"
+    "以下の対話記録を読み、上記のサブ評価項目ごとに採点してください。"
+    "出力は次の形式のJSONのみとし、前後に説明文を付けないでください。\n"
+    '{"sub_scores": [{"criterion": "項目名", "score": 1-5の整数, "comment": "根拠"}], '
+    '"total": 1-10の整数, "rationale": "総合コメント"}'
+)
+
+
+def build_scoring_prompt(stage: int) -> str:
+    """
+    採点用のシステムプロンプト (評価対象の段階の定義 + JSON の出力形式)
+    """
+    reload_if_changed()
+    return _build_scoring_prompt(stage)
+
+
+@lru_cache(maxsize=None)
+def _build_scoring_prompt(stage: int) -> str:
+    sections = PROMPT_SECTIONS
+    if stage >= FINAL_STAGE:
+        target = "\n\n".join(sections["modules"][n] for n in sorted(sections["modules"])) or SYSTEM_PROMPT
+        role = "あなたは中堅社員向けアセスメントの採点者です。Module 1-4 全体を通した総合評価を行ってください。"
+    else:
+        target = sections["modules"].get(stage) or SYSTEM_PROMPT
+        role = f"あなたは中堅社員向けアセスメントの採点者です。Module {stage} の回答を評価してください。"
+    return "\n\n---\n\n".join([role, target, SCORING_FORMAT])
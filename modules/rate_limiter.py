@@ -0,0 +1,297 @@
+import collections
+import threading
+import time
+from contextlib import contextmanager
+
+# 日本語テキストのトークン数の概算 (1トークンあたりの文字数)
+CHARS_PER_TOKEN = 2.0
+# 応答のトークン数の見込み (実際の使用量は応答後に usage_metadata で補正する)
+RESPONSE_TOKENS_ESTIMATE = 1000
+
+
+class AdmissionTimeout(Exception):
+    """待ち行列で一定時間を超えて待たされた"""
+
+
+def estimate_tokens(text: str) -> int:
+    return int(len(text or "") / CHARS_PER_TOKEN) + 1
+
+
+def estimate_history_tokens(history, system_instruction: str = None) -> int:
+    tokens = estimate_tokens(system_instruction)
+    for item in history or []:
+        for part in item.get("parts", []):
+            tokens += estimate_tokens(part.get("text", ""))
+    return tokens
+
+
+def usage_tokens(response):
+    usage = getattr(response, "usage_metadata", None)
+    return getattr(usage, "total_token_count", None) if usage is not None else None
+
+
+def is_rate_limit_error(exc: Exception) -> bool:
+    # メッセージ中の数字では判定しない (本文に "429" を含む別のエラーを取り違えるため)
+    code = getattr(exc, "code", None) or getattr(exc, "status_code", None)
+    return code == 429 or getattr(exc, "status", None) == "RESOURCE_EXHAUSTED"
+
+
+class TokenBucket:
+    """
+    period 秒 (既定は1分) あたり per_period 個補充されるトークンバケット。
+    take() は残量がマイナスになることを許す (実際の使用量が見込みを超えた分は次の要求を遅らせる)
+    """
+    def __init__(self, per_period: float, capacity: float = None, period: float = 60.0, clock=time.monotonic):
+        self.rate = per_period / period
+        self.capacity = max(1.0, capacity or per_period)
+        self.tokens = self.capacity
+        self._clock = clock
+        self._updated = clock()
+
+    def _refill(self, now: float):
+        if now > self._updated:
+            self.tokens = min(self.capacity, self.tokens + (now - self._updated) * self.rate)
+            self._updated = now
+
+    def wait_time(self, amount: float, now: float) -> float:
+        """amount 個を取り出せるまでの秒数 (容量を超える要求は満杯になるまで待つ)"""
+        self._refill(now)
+        amount = min(amount, self.capacity)
+        if self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) / self.rate
+
+    def take(self, amount: float, now: float):
+        self._refill(now)
+        self.tokens -= amount
+
+    def adjust(self, delta: float):
+        self.tokens = min(self.capacity, self.tokens - delta)
+
+
+class Ticket:
+    __slots__ = ("tokens", "actual_tokens", "enqueued_at", "admitted_at")
+
+    def __init__(self, tokens: int, enqueued_at: float):
+        self.tokens = tokens
+        self.actual_tokens = None
+        self.enqueued_at = enqueued_at
+        self.admitted_at = None
+
+
+class AdmissionController:
+    """
+    プロセス全体で Gemini 呼び出しの流量を制御する。
+
+    - max_concurrent: 同時に実行する呼び出し数の上限
+    - requests_per_minute / tokens_per_minute: クォータに合わせたトークンバケット (0 なら制限なし)
+      burst_fraction の分だけは一度に受け付け、残りは一定の間隔で受け付ける
+      (quota_window: クォータの集計期間。テストで時間軸を縮める場合に変更する)
+      TPM のバースト分が1回の要求のトークン数より小さいと、その差の分だけクォータを超え得る
+    - 待ち行列は FIFO で、先頭の要求だけが受け付けを試みる (後から来たセッションが追い越さない)
+    - 429 を受けたら throttle() で一定時間受け付けを止め、一斉の再試行を避ける
+    """
+    def __init__(self, max_concurrent: int = 16, requests_per_minute: float = 0, tokens_per_minute: float = 0,
+                 burst_fraction: float = 0.05, quota_window: float = 60.0, poll_interval: float = 0.5,
+                 clock=time.monotonic):
+        self.max_concurrent = max_concurrent
+        self.poll_interval = poll_interval
+        self._clock = clock
+        self.rpm = self._bucket(requests_per_minute, burst_fraction, quota_window, clock)
+        self.tpm = self._bucket(tokens_per_minute, burst_fraction, quota_window, clock)
+        self._cond = threading.Condition()
+        self._queue = collections.deque()
+        self._active = 0
+        self._paused_until = 0.0
+        self._service_time = 5.0    # 1回の呼び出しにかかる時間の移動平均 (ETA の推定用)
+        self.admitted = 0
+        self.charged = 0
+        self.timeouts = 0
+        self.total_wait = 0.0
+
+    @staticmethod
+    def _bucket(quota: float, burst_fraction: float, window: float, clock):
+        # バースト分 + 補充分 が任意の集計期間でクォータを超えないように配分する
+        if not quota:
+            return None
+        return TokenBucket(quota * (1 - burst_fraction), capacity=quota * burst_fraction, period=window, clock=clock)
+
+    @property
+    def queue_length(self) -> int:
+        with self._cond:
+            return len(self._queue)
+
+    @property
+    def active(self) -> int:
+        with self._cond:
+            return self._active
+
+    def _admission_wait(self, tokens: int, now: float):
+        """先頭の要求が受け付けられるまでの秒数 (None: 実行中の呼び出しの終了待ち)"""
+        if self._active >= self.max_concurrent:
+            return None
+        wait = max(0.0, self._paused_until - now)
+        if self.rpm is not None:
+            wait = max(wait, self.rpm.wait_time(1, now))
+        if self.tpm is not None:
+            wait = max(wait, self.tpm.wait_time(tokens, now))
+        return wait
+
+    def _estimate(self, position: int, head_wait, now: float) -> float:
+        # 先頭の待ち時間 + 前に並んでいる要求が捌けるまでの時間
+        interval = self._service_time / self.max_concurrent
+        if self.rpm is not None:
+            interval = max(interval, 1 / self.rpm.rate)
+        if self.tpm is not None and self._queue:
+            interval = max(interval, self._queue[0].tokens / self.tpm.rate)
+        first = head_wait if head_wait is not None else interval
+        return first + (position - 1) * interval
+
+    def acquire(self, tokens: int = 0, on_wait=None, timeout: float = None) -> Ticket:
+        """
+        順番が来るまで待って受け付ける。待っている間は on_wait(順番, 残り秒数の目安) を呼ぶ
+        """
+        now = self._clock()
+        ticket = Ticket(tokens, now)
+        deadline = now + timeout if timeout else None
+        last_notice = None
+        with self._cond:
+            self._queue.append(ticket)
+        try:
+            while True:
+                with self._cond:
+                    now = self._clock()
+                    position = self._queue.index(ticket) + 1
+                    head_wait = self._admission_wait(self._queue[0].tokens, now)
+                    if position == 1 and head_wait == 0:
+                        self._admit(ticket, now)
+                        return ticket
+                    if deadline is not None and now >= deadline:
+                        self.timeouts += 1
+                        raise AdmissionTimeout(f"Waited {now - ticket.enqueued_at:.1f}s in the admission queue")
+                    eta = self._estimate(position, head_wait, now)
+                    notice = (position, int(eta + 0.999))
+                    if notice == last_notice or on_wait is None:
+                        wait = self.poll_interval
+                        if position == 1 and head_wait is not None:
+                            wait = min(wait, head_wait)
+                        if deadline is not None:
+                            wait = min(wait, max(0.0, deadline - now))
+                        self._cond.wait(wait)
+                        continue
+                # 画面更新などのコールバックはロックの外で呼ぶ
+                last_notice = notice
+                on_wait(*notice)
+        finally:
+            if ticket.admitted_at is None:
+                with self._cond:
+                    if ticket in self._queue:
+                        self._queue.remove(ticket)
+                    self._cond.notify_all()
+
+    def _admit(self, ticket: Ticket, now: float):
+        self._queue.popleft()
+        self._active += 1
+        if self.rpm is not None:
+            self.rpm.take(1, now)
+        if self.tpm is not None:
+            self.tpm.take(ticket.tokens, now)
+        ticket.admitted_at = now
+        self.admitted += 1
+        self.total_wait += now - ticket.enqueued_at
+        self._cond.notify_all()
+
+    def release(self, ticket: Ticket):
+        with self._cond:
+            now = self._clock()
+            self._active -= 1
+            if self.tpm is not None and ticket.actual_tokens is not None:
+                self.tpm.adjust(ticket.actual_tokens - ticket.tokens)
+            self._service_time = 0.8 * self._service_time + 0.2 * (now - ticket.admitted_at)
+            self._cond.notify_all()
+
+    def charge(self, tokens: int = 0):
+        """
+        受け付け済みの呼び出しの中で追加で送った試行 (再試行・ヘッジ) の分をクォータに計上する。
+        待たずに差し引き、後続の要求の受け付けを遅らせる (待つと試行の制限時間を待ち行列で使い切るため)
+        """
+        with self._cond:
+            now = self._clock()
+            if self.rpm is not None:
+                self.rpm.take(1, now)
+            if self.tpm is not None:
+                self.tpm.take(tokens, now)
+            self.charged += 1
+
+    def throttle(self, seconds: float):
+        with self._cond:
+            self._paused_until = max(self._paused_until, self._clock() + seconds)
+            self._cond.notify_all()
+
+    @contextmanager
+    def admit(self, tokens: int = 0, on_wait=None, timeout: float = None):
+        ticket = self.acquire(tokens, on_wait=on_wait, timeout=timeout)
+        try:
+            yield ticket
+        finally:
+            self.release(ticket)
+
+
+def attempt_charger(controller: AdmissionController):
+    """ResilientBackend の on_extra_attempt に渡す関数 (追加の試行ごとに1リクエストと見込みのトークン数を計上する)"""
+    def charge(history, system_instruction: str, message: str):
+        controller.charge(estimate_history_tokens(history, system_instruction) + estimate_tokens(message)
+                          + RESPONSE_TOKENS_ESTIMATE)
+    return charge
+
+
+class RateLimitedBackend:
+    """
+    別のバックエンドをラップし、send_message を AdmissionController の受け付け後に実行する。
+    ストリーミングの場合は応答を読み終わるまで同時実行枠を保持する。
+    内側の ResilientBackend が再試行・ヘッジで送る分は、attempt_charger で試行ごとに計上する。
+
+    on_wait: 待ち行列に入っている間に (順番, 残り秒数の目安) で呼ばれる
+    """
+    def __init__(self, inner, controller: AdmissionController, on_wait=None, timeout: float = None,
+                 throttle_seconds: float = 10.0):
+        self.inner = inner
+        self.controller = controller
+        self.on_wait = on_wait
+        self.timeout = timeout
+        self.throttle_seconds = throttle_seconds
+
+    def start_chat(self, history=None, system_instruction: str = None):
+        chat = self.inner.start_chat(history=history, system_instruction=system_instruction)
+        return (chat, estimate_history_tokens(history, system_instruction))
+
+    def _tokens(self, prompt_tokens: int, message: str) -> int:
+        return prompt_tokens + estimate_tokens(message) + RESPONSE_TOKENS_ESTIMATE
+
+    def send_message(self, chat_session, message: str, stream: bool = False):
+        chat, prompt_tokens = chat_session
+        tokens = self._tokens(prompt_tokens, message)
+        if stream:
+            return self._stream(chat, message, tokens)
+        with self.controller.admit(tokens, on_wait=self.on_wait, timeout=self.timeout) as ticket:
+            try:
+                response = self.inner.send_message(chat, message)
+            except Exception as e:
+                self._on_error(e)
+                raise
+            ticket.actual_tokens = usage_tokens(response)
+        return response
+
+    def _stream(self, chat, message: str, tokens: int):
+        with self.controller.admit(tokens, on_wait=self.on_wait, timeout=self.timeout) as ticket:
+            try:
+                for chunk in self.inner.send_message(chat, message, stream=True):
+                    ticket.actual_tokens = usage_tokens(chunk) or ticket.actual_tokens
+                    yield chunk
+            except Exception as e:
+                self._on_error(e)
+                raise
+
+    def _on_error(self, exc: Exception):
+        if is_rate_limit_error(exc):
+            self.controller.throttle(self.throttle_seconds)
@@ -0,0 +1,250 @@
+import atexit
+import copy
+import json
+import secrets
+import signal
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Protocol
+
+from modules.metering import SessionMeter
+from modules.transcript import Transcript
+
+# 永続化するセッション状態のキー (transcript と meter は別途シリアライズする)
+SESSION_KEYS = ("user_name", "is_started", "is_finished", "module_scores", "background_scores", "cohort_recorded")
+SNAPSHOT_VERSION = 1
+
+
+class KeyValueBackend(Protocol):
+    """
+    セッションスナップショットを保存するキー・バリューストアのインターフェース。
+    本番環境では Redis / Memorystore / Firestore 等をこの形に合わせて実装する。
+    revision は保存のたびに変わる短い値で、値全体を読まずに最新かどうかを確かめるために使う。
+    """
+    def get(self, key: str): ...
+
+    def revision(self, key: str): ...
+
+    def put(self, key: str, value: bytes, revision: str): ...
+
+    def delete(self, key: str): ...
+
+
+class SQLiteBackend:
+    """ローカル開発・テスト用のバックエンド (1プロセス内の複数スレッドから利用可能)"""
+    def __init__(self, path: str = "sessions.db"):
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS sessions "
+                "(token TEXT PRIMARY KEY, value BLOB, updated_at REAL, revision TEXT)"
+            )
+            columns = [row[1] for row in self._conn.execute("PRAGMA table_info(sessions)")]
+            if "revision" not in columns:
+                self._conn.execute("ALTER TABLE sessions ADD COLUMN revision TEXT")
+            self._conn.commit()
+
+    def get(self, key: str):
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM sessions WHERE token = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def revision(self, key: str):
+        with self._lock:
+            row = self._conn.execute("SELECT revision FROM sessions WHERE token = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def put(self, key: str, value: bytes, revision: str):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO sessions (token, value, updated_at, revision) VALUES (?, ?, ?, ?)",
+                (key, value, time.time(), revision),
+            )
+            self._conn.commit()
+
+    def delete(self, key: str):
+        with self._lock:
+            self._conn.execute("DELETE FROM sessions WHERE token = ?", (key,))
+            self._conn.commit()
+
+
+class RedisBackend:
+    """
+    redis-py 互換クライアント (get / set / delete) を使うバックエンド。
+    クライアントは呼び出し側で作成して渡す (redis パッケージはオプション)。
+    """
+    def __init__(self, client, prefix: str = "assessment:session:", ttl_seconds: int = 7 * 24 * 3600):
+        self.client = client
+        self.prefix = prefix
+        self.ttl_seconds = ttl_seconds
+
+    def get(self, key: str):
+        return self.client.get(self.prefix + key)
+
+    def revision(self, key: str):
+        value = self.client.get(self.prefix + key + ":revision")
+        return value.decode("utf-8") if isinstance(value, bytes) else value
+
+    def put(self, key: str, value: bytes, revision: str):
+        # 値を先に書く (revision だけ新しくなると、古い値が最新として扱われるため)
+        self.client.set(self.prefix + key, value, ex=self.ttl_seconds)
+        self.client.set(self.prefix + key + ":revision", revision, ex=self.ttl_seconds)
+
+    def delete(self, key: str):
+        self.client.delete(self.prefix + key, self.prefix + key + ":revision")
+
+
+def new_token() -> str:
+    """再開用トークン (URL に載せても推測されにくい長さ)"""
+    return secrets.token_urlsafe(16)
+
+
+def snapshot_from_state(state) -> dict:
+    # 書き込みはバックグラウンドで行うため、変更され得るリストはコピーしておく
+    snapshot = {key: copy.copy(state.get(key)) for key in SESSION_KEYS}
+    snapshot["transcript"] = state["transcript"].to_state()
+    if state.get("meter") is not None:
+        snapshot["meter"] = state["meter"].to_state()
+    snapshot["version"] = SNAPSHOT_VERSION
+    return snapshot
+
+
+def apply_snapshot(state, snapshot: dict):
+    for key in SESSION_KEYS:
+        if key in snapshot:
+            state[key] = copy.copy(snapshot[key])
+    state["transcript"] = Transcript.from_state(snapshot.get("transcript", []))
+    if snapshot.get("meter"):
+        state["meter"] = SessionMeter.from_state(snapshot["meter"])
+
+
+class SessionStore:
+    """
+    セッションスナップショットのストア。
+
+    - save(): 最新のスナップショットを保留し、バックグラウンドスレッドがまとめて書き込む (write-behind)。
+      同じトークンへの連続した保存は最後の1回だけが書き込まれる。
+    - load(): 書き込み待ちのスナップショット → プロセス内のLRUキャッシュ → バックエンドの順に参照する。
+      キャッシュは revision がバックエンドと一致するときだけ使う (別インスタンスで進んだセッションを古い状態で返さない)。
+      セッション全体を1つの値として保存しているので、再開は1回の読み込みで済む。
+    - プロセス終了時 (atexit / SIGTERM) に書き込み待ちのスナップショットを書き出す。
+    """
+    def __init__(self, backend, cache_size: int = 256, flush_interval: float = 0.5):
+        self.backend = backend
+        self.cache_size = cache_size
+        self.flush_interval = flush_interval
+        self._cache = OrderedDict()
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stop = threading.Event()
+        self._closed = False
+        self._worker = threading.Thread(target=self._run, name="SessionStore", daemon=True)
+        self._worker.start()
+        atexit.register(self.close)
+        _chain_sigterm(self.close)
+
+    # --- LRU ---
+    def _remember(self, token: str, snapshot: dict):
+        self._cache[token] = snapshot
+        self._cache.move_to_end(token)
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+    def save(self, token: str, snapshot: dict):
+        snapshot["revision"] = secrets.token_hex(8)
+        with self._lock:
+            self._remember(token, snapshot)
+            self._pending[token] = snapshot
+        self._wakeup.set()
+
+    def load(self, token: str):
+        with self._lock:
+            # 書き込み待ちがあれば、このインスタンスでの最新の保存なのでそのまま返す
+            snapshot = self._pending.get(token)
+            if snapshot is not None:
+                return snapshot
+            cached = self._cache.get(token)
+
+        if cached is not None:
+            try:
+                current = self.backend.revision(token)
+            except Exception:
+                # バックエンドに問い合わせられなければ、手元のスナップショットで再開する
+                current = cached.get("revision")
+            if current is not None and current == cached.get("revision"):
+                with self._lock:
+                    if token in self._cache:
+                        self._cache.move_to_end(token)
+                return cached
+
+        value = self.backend.get(token)
+        if value is None:
+            return None
+        snapshot = json.loads(value)
+        with self._lock:
+            self._remember(token, snapshot)
+        return snapshot
+
+    def delete(self, token: str):
+        with self._lock:
+            self._cache.pop(token, None)
+            self._pending.pop(token, None)
+        self.backend.delete(token)
+
+    # --- Write-behind worker ---
+    def _run(self):
+        while not self._stop.is_set():
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            self._write_pending()
+        self._write_pending()
+
+    def _write_pending(self):
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        for token, snapshot in pending.items():
+            try:
+                self.backend.put(token, json.dumps(snapshot, ensure_ascii=False).encode("utf-8"), snapshot["revision"])
+            except Exception:
+                # 書き込みに失敗したら、より新しい保存がなければ次回に再試行する
+                with self._lock:
+                    self._pending.setdefault(token, snapshot)
+
+    def flush(self):
+        self._write_pending()
+
+    def close(self):
+        """書き込み待ちを書き出してワーカーを止める (atexit / SIGTERM からも呼ばれる。2回目以降は何もしない)"""
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+        self._stop.set()
+        self._wakeup.set()
+        if self._worker is not threading.current_thread():
+            self._worker.join()
+
+
+def _chain_sigterm(callback):
+    """
+    SIGTERM を受けたら callback を呼んでから、元のハンドラに処理を渡す。
+    シグナルハンドラはメインスレッドでしか登録できないため、それ以外 (Streamlit のスクリプトスレッド等) では
+    何もしない。その場合も Streamlit 自身の SIGTERM ハンドラが通常の終了を行うので、atexit で書き出される
+    """
+    if threading.current_thread() is not threading.main_thread():
+        return
+    previous = signal.getsignal(signal.SIGTERM)
+
+    def handler(signum, frame):
+        callback()
+        if callable(previous):
+            previous(signum, frame)
+        elif previous != signal.SIG_IGN:
+            raise SystemExit(128 + signum)
+
+    signal.signal(signal.SIGTERM, handler)
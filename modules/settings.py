@@ -0,0 +1,35 @@
+import os
+
+import streamlit as st
+
+
+def get_setting(name: str, default=None):
+    """
+    設定値を読み込む。st.secrets を優先し、なければ環境変数を参照する
+    """
+    try:
+        value = st.secrets.get(name)
+    except Exception:
+        # secrets.toml が存在しない場合など
+        value = None
+    if value is None:
+        value = os.getenv(name, default)
+    return value
+
+
+def get_flag(name: str, default: bool = False) -> bool:
+    return str(get_setting(name, str(default))).lower() in ('true', '1', 't')
+
+
+def get_float(name: str, default: float) -> float:
+    try:
+        return float(get_setting(name, default))
+    except (TypeError, ValueError):
+        return default
+
+
+def get_int(name: str, default: int) -> int:
+    try:
+        return int(get_setting(name, default))
+    except (TypeError, ValueError):
+        return default
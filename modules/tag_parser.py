@@ -0,0 +1,183 @@
+import io
+import re
+import time
+
+# 画面に表示しない隠しタグ
+HIDDEN_TAGS = ("SCORE", "RATIONALE")
+
+# タグの開始部分 ("[[NAME:" または "[[NAME]]")
+_TAG_HEAD = re.compile(r"\[\[([A-Z_]+)(:|\]\])")
+# チャンク境界で途切れた、タグの開始部分になり得る文字列
+_PARTIAL_HEAD = re.compile(r"\[\[[A-Z_]{0,32}\]?\Z")
+_SCORE_BODY = re.compile(r"\d+")
+
+
+class StreamingTagParser:
+    """
+    ストリーミング応答をチャンク単位で受け取り、[[SCORE:X]] / [[RATIONALE:...]] を
+    画面表示用テキストから取り除きながらスコアと根拠を収集するステートマシン。
+
+    各チャンクは一度だけ走査されるため、応答全体の処理コストは O(n) になる。
+    """
+    def __init__(self):
+        self._raw = io.StringIO()
+        self._visible = io.StringIO()
+        self._pending = ""      # チャンク境界で判定を保留している末尾
+        self._tag_name = None   # 現在読み込み中の隠しタグ名
+        self._tag_body = []
+        self.scores = []
+        self.rationales = []
+        self.end_of_assessment = False
+
+    # --- 結果 ---
+    @property
+    def raw_text(self) -> str:
+        return self._raw.getvalue()
+
+    @property
+    def visible_text(self) -> str:
+        return self._visible.getvalue()
+
+    @property
+    def clean_text(self) -> str:
+        return self.visible_text.strip()
+
+    @property
+    def score(self):
+        return self.scores[0] if self.scores else None
+
+    @property
+    def rationale(self) -> str:
+        return self.rationales[0] if self.rationales else ""
+
+    # --- 入力 ---
+    def feed(self, text: str) -> str:
+        """
+        チャンクを1つ処理し、新たに表示可能になったテキストを返す
+        """
+        if not text:
+            return ""
+        self._raw.write(text)
+
+        data = self._pending + text
+        self._pending = ""
+        out = []
+        pos = 0
+        end = len(data)
+
+        while pos < end:
+            if self._tag_name is None:
+                idx = data.find("[[", pos)
+                if idx == -1:
+                    # 末尾の "[" は次のチャンクでタグの開始になる可能性がある
+                    if data.endswith("["):
+                        out.append(data[pos:end - 1])
+                        self._pending = "["
+                    else:
+                        out.append(data[pos:])
+                    break
+
+                out.append(data[pos:idx])
+                match = _TAG_HEAD.match(data, idx)
+                if match is None:
+                    if _PARTIAL_HEAD.match(data, idx):
+                        self._pending = data[idx:]
+                        break
+                    # 1文字だけ進める ("[[[RATIONALE:" のように余分な "[" が前にあってもタグの開始を見逃さない)
+                    out.append("[")
+                    pos = idx + 1
+                    continue
+
+                name, separator = match.group(1), match.group(2)
+                if name in HIDDEN_TAGS and separator == ":":
+                    self._tag_name = name
+                    self._tag_body = []
+                else:
+                    if name == "END_OF_ASSESSMENT" and separator == "]]":
+                        self.end_of_assessment = True
+                    out.append(match.group(0))
+                pos = match.end()
+            else:
+                idx = data.find("]]", pos)
+                if idx == -1:
+                    if data.endswith("]"):
+                        self._tag_body.append(data[pos:end - 1])
+                        self._pending = "]"
+                    else:
+                        self._tag_body.append(data[pos:])
+                    break
+                self._tag_body.append(data[pos:idx])
+                out.append(self._close_tag())
+                pos = idx + 2
+
+        visible = "".join(out)
+        self._visible.write(visible)
+        return visible
+
+    def finish(self) -> str:
+        """
+        ストリーム終了時に保留中のテキストを確定させる
+        """
+        out = ""
+        if self._tag_name is None:
+            out = self._pending
+        else:
+            # 閉じられていない隠しタグは表示せず、根拠のみ回収する
+            self._tag_body.append(self._pending.rstrip("]"))
+            if self._tag_name == "RATIONALE":
+                self.rationales.append("".join(self._tag_body).strip())
+            self._tag_name = None
+            self._tag_body = []
+        self._pending = ""
+        self._visible.write(out)
+        return out
+
+    def _close_tag(self) -> str:
+        body = "".join(self._tag_body)
+        name = self._tag_name
+        self._tag_name = None
+        self._tag_body = []
+
+        if name == "SCORE":
+            if _SCORE_BODY.fullmatch(body):
+                self.scores.append(int(body))
+                return ""
+            # 数値でないスコアタグは従来どおりそのまま表示する
+            return f"[[SCORE:{body}]]"
+        self.rationales.append(body.strip())
+        return ""
+
+
+class ThrottledRenderer:
+    """
+    プレースホルダーの再描画を一定間隔に間引く。
+    チャンクごとに全文を再送しないため、WebSocketの再描画回数が応答長に比例しない。
+    """
+    def __init__(self, placeholder, interval: float = 0.15, cursor: str = "▌"):
+        self.placeholder = placeholder
+        self.interval = interval
+        self.cursor = cursor
+        self._last_render = None
+        self._dirty = False
+        self.render_count = 0
+        self.bytes_sent = 0
+
+    def update(self, parser: StreamingTagParser, new_text: str):
+        if new_text:
+            self._dirty = True
+        if not self._dirty:
+            return
+        now = time.monotonic()
+        # 最初の表示は即座に行い、以降は interval ごとにまとめて描画する
+        if self._last_render is None or now - self._last_render >= self.interval:
+            self._render(parser.visible_text + self.cursor)
+            self._last_render = now
+            self._dirty = False
+
+    def finish(self, text: str):
+        self._render(text)
+
+    def _render(self, text: str):
+        self.placeholder.markdown(text)
+        self.render_count += 1
+        self.bytes_sent += len(text.encode("utf-8"))
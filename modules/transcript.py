@@ -0,0 +1,209 @@
+import codecs
+import csv
+import datetime
+import io
+import json
+
+from modules.tag_parser import StreamingTagParser
+
+TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S"
+CSV_HEADER = ["Timestamp", "Role", "Content", "Score", "Hidden Rationale"]
+
+
+def now_timestamp() -> str:
+    return datetime.datetime.now().strftime(TIMESTAMP_FORMAT)
+
+
+class TranscriptRecord:
+    """
+    1発言分の記録。生テキストは1回だけ保持し、スコア・根拠・表示用テキストは追加時に一度だけ解析する。
+    """
+    __slots__ = ("role", "raw", "clean", "score", "rationale", "timestamp", "visible")
+
+    def __init__(self, role: str, raw: str, clean: str = None, score=None, rationale: str = "",
+                 timestamp: str = None, visible: bool = True):
+        self.role = role              # "user" | "assistant"
+        self.raw = raw                # [[SCORE]] / [[RATIONALE]] を含む生テキスト
+        self.clean = raw if clean is None else clean
+        self.score = score
+        self.rationale = rationale
+        self.timestamp = timestamp or now_timestamp()
+        self.visible = visible        # False: Geminiには送るが画面・ログには出さない (開始時の指示など)
+
+    @classmethod
+    def from_parser(cls, role: str, parser: StreamingTagParser, timestamp: str = None):
+        return cls(role, parser.raw_text, clean=parser.clean_text, score=parser.score,
+                   rationale=parser.rationale, timestamp=timestamp)
+
+    @classmethod
+    def parse(cls, role: str, raw: str, timestamp: str = None, visible: bool = True):
+        parser = StreamingTagParser()
+        parser.feed(raw)
+        parser.finish()
+        record = cls.from_parser(role, parser, timestamp)
+        record.visible = visible
+        return record
+
+    @property
+    def gemini_role(self) -> str:
+        return "model" if self.role == "assistant" else "user"
+
+    def to_state(self) -> list:
+        """永続化用のコンパクトな表現"""
+        return [self.role, self.raw, self.clean, self.score, self.rationale, self.timestamp, self.visible]
+
+    @classmethod
+    def from_state(cls, state):
+        role, raw, clean, score, rationale, timestamp, visible = state
+        return cls(role, raw, clean=clean, score=score, rationale=rationale, timestamp=timestamp, visible=visible)
+
+    def to_dict(self) -> dict:
+        return {
+            "timestamp": self.timestamp,
+            "role": self.role,
+            "content": self.clean,
+            "raw_content": self.raw,
+            "score": self.score,
+            "rationale": self.rationale,
+        }
+
+
+class Transcript:
+    """
+    セッションの会話記録。UI表示用の履歴とGemini送信用の履歴は、この記録から都度作るビューとして扱う。
+    """
+    __slots__ = ("records",)
+
+    def __init__(self):
+        self.records = []
+
+    def __len__(self):
+        return len(self.records)
+
+    def __iter__(self):
+        return iter(self.records)
+
+    @property
+    def last(self):
+        return self.records[-1] if self.records else None
+
+    def append(self, record: TranscriptRecord) -> TranscriptRecord:
+        self.records.append(record)
+        return record
+
+    def append_user(self, text: str, visible: bool = True, timestamp: str = None) -> TranscriptRecord:
+        return self.append(TranscriptRecord("user", text, timestamp=timestamp, visible=visible))
+
+    def append_assistant(self, parser: StreamingTagParser, timestamp: str = None) -> TranscriptRecord:
+        return self.append(TranscriptRecord.from_parser("assistant", parser, timestamp))
+
+    def to_state(self) -> list:
+        return [record.to_state() for record in self.records]
+
+    @classmethod
+    def from_state(cls, state):
+        transcript = cls()
+        transcript.records = [TranscriptRecord.from_state(item) for item in state]
+        return transcript
+
+    def user_turns(self) -> int:
+        return sum(1 for record in self.records if record.role == "user" and record.visible)
+
+    # --- Views ---
+    def messages(self):
+        """画面に表示する発言"""
+        return [record for record in self.records if record.visible]
+
+    def gemini_history(self):
+        """Gemini API に渡す履歴 (生テキスト)"""
+        return [
+            {"role": record.gemini_role, "parts": [{"text": record.raw}]}
+            for record in self.records
+        ]
+
+
+# --- Export ---
+def iter_csv(records, encoding: str = "shift_jis"):
+    """
+    CSVを1行ずつエンコードして返すジェネレータ。
+    encoding="utf-8-sig" の場合は先頭にBOMを付ける (Excelでの文字化け対策)。
+    """
+    if encoding == "utf-8-sig":
+        yield codecs.BOM_UTF8
+        encoding = "utf-8"
+
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+
+    def drain() -> bytes:
+        data = buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate(0)
+        return data.encode(encoding, "ignore")
+
+    writer.writerow(CSV_HEADER)
+    yield drain()
+    for record in records:
+        if not record.visible:
+            continue
+        score = "" if record.score is None else str(record.score)
+        writer.writerow([record.timestamp, record.role, record.clean, score, record.rationale])
+        yield drain()
+
+
+def iter_jsonl(records):
+    for record in records:
+        if not record.visible:
+            continue
+        yield (json.dumps(record.to_dict(), ensure_ascii=False) + "\n").encode("utf-8")
+
+
+# 形式名: (ボタン表示名, MIMEタイプ, 拡張子, ライター)
+EXPORT_FORMATS = {
+    "csv_sjis": ("CSV (Shift-JIS / Excel向け)", "text/csv; charset=shift_jis", "csv",
+                 lambda records: iter_csv(records, "shift_jis")),
+    "csv_utf8": ("CSV (UTF-8 BOM付き)", "text/csv; charset=utf-8", "csv",
+                 lambda records: iter_csv(records, "utf-8-sig")),
+    "jsonl": ("JSON Lines", "application/x-ndjson", "jsonl", iter_jsonl),
+}
+
+
+class _ChunkReader(io.RawIOBase):
+    """バイト列のジェネレータを読み取り専用のファイルとして扱う (読まれた分だけ生成する)"""
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+        self._pending = b""
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        while not self._pending:
+            chunk = next(self._chunks, None)
+            if chunk is None:
+                return 0
+            self._pending = chunk
+        size = min(len(buffer), len(self._pending))
+        buffer[:size] = self._pending[:size]
+        self._pending = self._pending[size:]
+        return size
+
+
+def export_stream(records, fmt: str) -> io.BufferedReader:
+    """
+    指定した形式のエクスポートをファイルとして返す。内容は読み出されるときに1行ずつ生成する
+    (st.download_button の data に渡す関数から返し、クリックされたときだけ作る)
+    """
+    writer = EXPORT_FORMATS[fmt][3]
+    return io.BufferedReader(_ChunkReader(writer(records)))
+
+
+def export_bytes(transcript: Transcript, fmt: str) -> bytes:
+    """
+    指定した形式でエクスポートする。行ごとのバイト列を逐次書き込み、全文の中間文字列を作らない
+    """
+    writer = EXPORT_FORMATS[fmt][3]
+    out = io.BytesIO()
+    for chunk in writer(transcript.records):
+        out.write(chunk)
+    return out.getvalue()
@@ -1,70 +1,344 @@
 import streamlit as st
 import logging
-import sys
-import json
 import os
 import datetime
-import re # Added for score parsing
+import secrets
+import time
+from concurrent.futures import wait as wait_futures
 from dotenv import load_dotenv
 
 # Load environment variables
 load_dotenv()
 
-from modules.gemini_client import GeminiClient
-
-# --- Cloud Logging用設定 (JSON形式で出力) ---
+# 再実行1回あたりの所要時間を計測するための開始時刻
+script_started = time.perf_counter()
+
+from modules.llm_backends import BACKEND_GEMINI, BACKEND_MOCK, BACKEND_RECORD, BACKEND_REPLAY, create_backend
+from modules.tag_parser import StreamingTagParser, ThrottledRenderer
+from modules.history_compactor import CompactionConfig, compact_history
+from modules.prompts import BACKGROUND_SCORING_NOTE, build_system_prompt, current_stage, get_system_prompt
+from modules import background_scoring
+from modules.settings import get_flag, get_float, get_int, get_setting
+from modules.transcript import EXPORT_FORMATS, Transcript, TranscriptRecord, export_stream, now_timestamp
+from modules.metering import Pricing, SessionMeter, UsageRegistry, stage_label, usage_from_response
+from modules.metrics import observe, registry as metrics_registry, timed, timer
+from modules.opening_cache import NAME_PLACEHOLDER, OpeningCache, cache_key, initial_prompt as opening_prompt
+from modules.log_pipeline import TruncationPolicy, bind_context, get_pipeline
+from modules.rate_limiter import AdmissionController, RateLimitedBackend, attempt_charger
+from modules.session_store import SQLiteBackend, SessionStore, apply_snapshot, new_token, snapshot_from_state
+
+# --- ログ出力 (Cloud Logging用のJSON形式。整形と書き込みはログパイプラインのスレッドで行う) ---
 # これにより、Cloud Runのログエクスプローラで検索・分析が可能になります
-class JsonFormatter(logging.Formatter):
-    def format(self, record):
-        # ログレコードの基本情報
-        log_entry = {
-            "severity": record.levelname,
-            "message": record.getMessage(),
-            "timestamp": datetime.datetime.now(datetime.timezone.utc).isoformat(),
-            "component": "assessment-app",
-        }
-        
-        # extra引数で渡されたデータ ('category'など) を統合
-        if hasattr(record, 'category'):
-            log_entry['category'] = record.category
-        
-        # Streamlitのセッションからユーザー情報を取得して付与
-        # (コンテキスト外のエラー回避のためtry-except)
-        try:
-            if "user_name" in st.session_state and st.session_state.user_name:
-                log_entry['user_id'] = st.session_state.user_name
-            else:
-                log_entry['user_id'] = "anonymous"
-        except:
-            log_entry['user_id'] = "system_init"
-
-        return json.dumps(log_entry, ensure_ascii=False)
+log_pipeline = get_pipeline()
+# 大きな本文 (AI の応答・回答) を標準出力・ファイルに出すときの上限文字数 (0 なら切り詰めない)
+log_pipeline.configure(
+    policy=TruncationPolicy(get_int("LOG_MAX_MESSAGE_CHARS", 0), get_float("LOG_FULL_MESSAGE_SAMPLE_RATE", 0.0)),
+    log_file=get_setting("LOG_FILE"),
+)
 
-# ロガーの初期化
+# ロガーの初期化 (ハンドラはプロセスで1つ。再実行のたびに付け直さない)
 logger = logging.getLogger("assessment_app")
 logger.setLevel(logging.INFO)
-
-# 既存のハンドラをクリアして重複防止
-if logger.hasHandlers():
-    logger.handlers.clear()
-
-# 標準出力(stdout)へのハンドラを作成
-handler = logging.StreamHandler(sys.stdout)
-handler.setFormatter(JsonFormatter())
-logger.addHandler(handler)
+log_pipeline.attach(logger)
+
+# この実行で出力するログの利用者情報 (レコードごとに st.session_state を参照しない)
+bind_context(user_id=st.session_state.get("user_name") or None,
+             session_id=getattr(st.session_state.get("meter"), "session_id", None))
+
+# 任意のログ出力先 (Google Sheets)。接続と gspread の読み込みは最初の描画の後に行う
+sheets_logging = get_flag("SHEETS_LOGGING", False)
+
+def start_optional_sinks():
+    """
+    任意のログ出力先を初期化する。最初の描画を遅らせないよう、スクリプトの最後に呼ぶ
+    """
+    if sheets_logging and not log_pipeline.has_sink("sheets"):
+        from modules.google_sheets_handler import (
+            CREDENTIALS_KEY_IN_SECRETS, SHEET_ID, WORKSHEET_NAME, GoogleSheetsHandler,
+        )
+        # 同時に別のセッションが追加していれば、そちらが使われる
+        log_pipeline.add_sink("sheets", GoogleSheetsHandler(SHEET_ID, WORKSHEET_NAME, CREDENTIALS_KEY_IN_SECRETS))
 
 
 # デバッグモードの読み込み
 # st.secrets を優先し、なければ環境変数を参照、デフォルトは 'False'
-debug_val = st.secrets.get("DEBUG_MODE")
-if debug_val is None:
-    debug_val = os.getenv('DEBUG_MODE', 'False')
-
-debug_mode = str(debug_val).lower() in ('true', '1', 't')
+debug_mode = get_flag("DEBUG_MODE", False)
 
 if debug_mode:
     logger.warning("--- DEBUG MODE IS ENABLED ---")
 
+# 履歴圧縮の設定 (完了済みモジュールを要約して送信トークンを削減する。デフォルトは有効)
+compaction_config = CompactionConfig(enabled=get_flag("HISTORY_COMPACTION", True))
+
+# システムプロンプトを現在のモジュールに必要な部分だけに絞る (デフォルトは有効)
+scoped_prompt = get_flag("MODULE_SCOPED_PROMPT", True)
+
+# システムプロンプトをサーバー側でキャッシュする (対応モデル・最小トークン数の制約があるためデフォルトは無効)
+context_cache_enabled = get_flag("CONTEXT_CACHE", False)
+context_cache_ttl = get_int("CONTEXT_CACHE_TTL", 3600)
+
+# トークン使用量の計測 (予算は1セッションあたりの入力+出力トークン数。0 なら上限なし)
+session_token_budget = get_int("SESSION_TOKEN_BUDGET", 0)
+token_pricing = (
+    get_float("TOKEN_PRICE_INPUT", 0.0),
+    get_float("TOKEN_PRICE_CACHED", 0.0),
+    get_float("TOKEN_PRICE_OUTPUT", 0.0),
+)
+metering_log = get_setting("METERING_LOG")
+
+@st.cache_resource(show_spinner=False)
+def get_usage_registry(pricing, log_path):
+    return UsageRegistry(Pricing(*pricing), log_path=log_path)
+
+usage_registry = get_usage_registry(token_pricing, metering_log)
+
+def record_usage(response, turn_metrics, stage=None):
+    # 呼び出し時点の段階 (完了済みモジュール数) に使用量を割り当てる
+    usage = usage_from_response(response)
+    if usage is None:
+        return
+    if stage is None:
+        stage = current_stage(len(st.session_state.module_scores))
+    module = stage_label(stage)
+    turn_metrics["usage"] = usage_registry.record(st.session_state.meter, module, usage, now_timestamp())
+
+# 再実行ごとの所要時間と描画量 (送信バイト数) をログに出力する計測モード
+render_metrics = get_flag("RENDER_METRICS", False)
+render_stats = {"bytes_sent": 0}
+
+# st.fragment が使えない古いバージョンでは通常の関数として実行する
+fragment = getattr(st, "fragment", None) or getattr(st, "experimental_fragment", None) or (lambda func: func)
+
+def render_markdown(text):
+    if render_metrics:
+        render_stats["bytes_sent"] += len(text.encode("utf-8"))
+    st.markdown(text)
+
+def render_message(record):
+    avatar = "🌱" if record.role == "assistant" else None
+    with st.chat_message(record.role, avatar=avatar):
+        render_markdown(record.clean)
+
+def log_render_metrics(scope, started):
+    rerun_ms = round((time.perf_counter() - started) * 1000, 2)
+    observe(f"{scope}_rerun_ms", rerun_ms)
+    if not render_metrics:
+        return
+    logger.info(f"Rerun metrics ({scope})", extra={'category': 'Metrics', 'metrics': {
+        "scope": scope,
+        "rerun_ms": rerun_ms,
+        "bytes_sent": render_stats["bytes_sent"],
+        "messages": len(st.session_state.get("transcript", ())),
+    }})
+
+def log_turn_metrics(turn_metrics):
+    # 1ターン分の計測値を構造化ログの metrics フィールドとして出力する (本文は含めない)
+    logger.info("Turn metrics", extra={'category': 'Metrics', 'metrics': turn_metrics})
+
+# LLMバックエンドの選択 (gemini / mock / record / replay)。デバッグモードの既定はモック
+llm_backend = get_setting("LLM_BACKEND") or (BACKEND_MOCK if debug_mode else BACKEND_GEMINI)
+replay_path = get_setting("LLM_REPLAY_PATH", "recordings/session.jsonl")
+replay_speed = get_float("LLM_REPLAY_SPEED", 1.0)
+record_dir = get_setting("LLM_RECORD_DIR", "recordings")
+
+# Gemini呼び出しの流量制御 (プロセス内の全セッションで共有。RPM/TPM は 0 なら制限なし)
+admission_control = get_flag("ADMISSION_CONTROL", True)
+admission_limits = (
+    get_int("GEMINI_MAX_CONCURRENT", 16),
+    get_float("GEMINI_RPM", 0),
+    get_float("GEMINI_TPM", 0),
+)
+admission_timeout = get_float("ADMISSION_TIMEOUT", 300.0)
+
+@st.cache_resource(show_spinner=False)
+def get_admission_controller(max_concurrent, requests_per_minute, tokens_per_minute):
+    return AdmissionController(max_concurrent, requests_per_minute, tokens_per_minute)
+
+def queue_notice(placeholder):
+    # 待ち行列に入っている間、失敗させずに順番と目安時間を表示する
+    def on_wait(position, eta):
+        placeholder.markdown(f"🌀 分析中... (順番待ち: {position}番目 / 目安 約{eta}秒)")
+    return on_wait
+
+# Gemini呼び出しのタイムアウト・再試行・ヘッジ (ヘッジは呼び出し回数が増えるためデフォルトは無効)
+resilience = {
+    "first_token_timeout": get_float("GEMINI_FIRST_TOKEN_TIMEOUT", 30.0),
+    "idle_timeout": get_float("GEMINI_IDLE_TIMEOUT", 30.0),
+    "response_timeout": get_float("GEMINI_RESPONSE_TIMEOUT", 60.0),
+    "max_attempts": get_int("GEMINI_MAX_ATTEMPTS", 3),
+    "hedge": get_flag("GEMINI_HEDGE", False),
+} if get_flag("GEMINI_RESILIENCE", True) else None
+# 応答を SDK の非同期クライアントで受け取り、全セッションの読み込みを1つのイベントループにまとめる
+# (応答を待つ間、セッションごとに読み込み用のスレッドを作らない)
+gemini_async = get_flag("GEMINI_ASYNC", False)
+
+def get_backend(on_wait=None):
+    record_path = None
+    if llm_backend == BACKEND_RECORD:
+        # セッションごとに1ファイルへ記録する
+        if "record_path" not in st.session_state:
+            st.session_state.record_path = os.path.join(
+                record_dir, f"session_{datetime.datetime.now().strftime('%Y%m%d_%H%M%S_%f')}.jsonl")
+        record_path = st.session_state.record_path
+    # 再試行・ヘッジの試行も1回ずつクォータに計上する
+    controller = get_admission_controller(*admission_limits) if admission_control else None
+    backend = create_backend(
+        llm_backend,
+        api_key=api_key,
+        model_name=model_name,
+        replay_path=replay_path,
+        record_path=record_path,
+        replay_speed=replay_speed,
+        context_cache_ttl=context_cache_ttl if context_cache_enabled else None,
+        resilience=resilience,
+        async_mode=gemini_async,
+        on_extra_attempt=attempt_charger(controller) if controller is not None else None,
+    )
+    if controller is None:
+        return backend
+    return RateLimitedBackend(backend, controller, on_wait=on_wait, timeout=admission_timeout)
+
+# 最初の応答 (Module 1 の導入) のキャッシュ。名前以外は全員ほぼ同じため、生成済みの導入文に名前を差し込んで返す
+# (記録・再生バックエンドでは台本と呼び出しの順序を揃えるため使わない)
+opening_cache_enabled = get_flag("OPENING_CACHE", True) and llm_backend not in (BACKEND_RECORD, BACKEND_REPLAY)
+
+@st.cache_resource(show_spinner=False)
+def get_opening_cache(ttl_seconds):
+    return OpeningCache(ttl_seconds=ttl_seconds)
+
+opening_cache = get_opening_cache(get_float("OPENING_CACHE_TTL", 6 * 3600))
+
+def refresh_opening_cache(key, system_instruction):
+    """
+    名前を伏せた導入文をバックグラウンドで生成してキャッシュする (prompts.md の更新後は最初のセッションで作り直される)
+    """
+    backend = get_backend()
+
+    def generate():
+        chat = backend.start_chat(history=[], system_instruction=system_instruction)
+        response = backend.send_message(chat, opening_prompt(NAME_PLACEHOLDER))
+        usage = usage_from_response(response)
+        if usage is not None:
+            usage_registry.record(SessionMeter("opening_cache"), stage_label(1), usage, now_timestamp())
+        return response.text
+
+    def on_error(e, retry_after):
+        logger.warning(f"導入文のキャッシュの生成に失敗しました ({retry_after:.0f}秒後まで作り直しません): {e}",
+                       extra={'category': 'System'})
+
+    opening_cache.refresh(key, generate, on_error=on_error)
+
+# 受検者全体 (コホート) の中での位置づけ。終了したセッションのスコアを蓄積し、採点結果に「上位 X%」を表示する
+# 蓄積先はインスタンスごとのローカルファイルのため既定では無効 (1インスタンス構成の場合のみ有効にする。modules/cohort.py 参照)
+cohort_enabled = get_flag("COHORT_STATS", False)
+cohort_settings = (
+    get_setting("COHORT_STORE_PATH", "cohort_scores.f32"),
+    get_float("COHORT_REFRESH_INTERVAL", 300.0),
+    get_int("COHORT_MIN_SIZE", 30),
+)
+
+@st.cache_resource(show_spinner=False)
+def get_cohort_engine(path, refresh_interval, min_cohort):
+    # numpy の読み込みは起動時間に響くため、終了後の画面で初めて使うときまで遅らせる
+    from modules.cohort import CohortEngine, CohortStore
+    return CohortEngine(CohortStore(path), refresh_interval=refresh_interval, min_cohort=min_cohort)
+
+def cohort_note(cohort, column, score):
+    rank = cohort.rank(column, score) if cohort is not None else None
+    if rank is None:
+        return ""
+    top_percent, _, _, size = rank
+    return f" (受検者{size:,}人中 上位{max(top_percent, 1):.0f}%)"
+
+# セッションの外部保存 (none / sqlite)。保存しておけば別インスタンスや再接続後も再開できる
+session_store_kind = get_setting("SESSION_STORE", "none").lower()
+session_store_path = get_setting("SESSION_STORE_PATH", "sessions.db")
+
+@st.cache_resource(show_spinner=False)
+def get_session_store(kind, path):
+    if kind == "sqlite":
+        return SessionStore(SQLiteBackend(path))
+    if kind != "none":
+        logger.warning(f"Unknown SESSION_STORE: {kind}. Session persistence is disabled.", extra={'category': 'System'})
+    return None
+
+session_store = get_session_store(session_store_kind, session_store_path)
+
+def persist_session():
+    # 書き込みはバックグラウンドで行われるため、ターンの応答時間には影響しない
+    token = st.session_state.get("session_token")
+    if session_store is None or not token:
+        return
+    session_store.save(token, snapshot_from_state(st.session_state))
+
+def restore_session(token):
+    snapshot = session_store.load(token) if session_store is not None and token else None
+    if snapshot is None:
+        return False
+    apply_snapshot(st.session_state, snapshot)
+    st.session_state.session_token = token
+    st.query_params["session"] = token
+    logger.info(f"Session resumed ({len(st.session_state.transcript)} records).", extra={'category': 'System'})
+    return True
+
+def resume_from_code():
+    code = st.session_state.get("resume_code", "").strip()
+    st.session_state.resume_failed = bool(code) and not restore_session(code)
+
+# 採点モード: inline (応答内の [[RATIONALE]] で採点) / background (応答とは別の呼び出しで並行して採点)
+background_scoring_enabled = get_setting("SCORING_MODE", "inline").lower() == "background"
+
+def current_system_prompt():
+    if not scoped_prompt:
+        prompt = get_system_prompt()
+    else:
+        prompt = build_system_prompt(current_stage(len(st.session_state.module_scores)))
+    if background_scoring_enabled:
+        prompt += "\n\n---\n\n" + BACKGROUND_SCORING_NOTE
+    return prompt
+
+def apply_finished_scores(wait=False):
+    """
+    完了したバックグラウンド採点の結果を会話記録と background_scores に反映する (スクリプトのスレッドで呼ぶ)。
+    module_scores は会話内の [[SCORE]] (受検者に開示済みの値) のまま変えず、採点結果は別に記録する
+    """
+    pending = st.session_state.get("pending_scores")
+    if not pending:
+        return
+    if wait:
+        wait_futures([item.future for item in pending])
+    remaining = []
+    for item in pending:
+        if not item.future.done():
+            remaining.append(item)
+            continue
+        try:
+            result = item.future.result()
+        except Exception as e:
+            # 採点に失敗した場合は、会話内の [[SCORE]] の値をそのまま使う
+            logger.error(f"バックグラウンド採点に失敗しました (Module {item.stage}): {e}", exc_info=True)
+            continue
+        records = st.session_state.transcript.records
+        if item.record_index >= len(records) or item.score_index >= len(st.session_state.module_scores):
+            continue
+        record = records[item.record_index]
+        record.rationale = f"【詳細採点】{result.total}点 / {result.rationale}"
+        background_scores = st.session_state.background_scores
+        background_scores.extend([None] * (item.score_index + 1 - len(background_scores)))
+        background_scores[item.score_index] = result.total
+        shown = st.session_state.module_scores[item.score_index]
+        if shown != result.total:
+            logger.warning(f"Background score differs from the conversation score (Module {item.stage}): "
+                           f"{result.total} vs {shown}", extra={'category': 'Scoring'})
+        scoring_metrics = {"turn": "scoring", "stage": item.stage}
+        record_usage(result.response, scoring_metrics, stage=item.stage)
+        logger.info(f"Background score (Module {item.stage}): {result.total} / {result.rationale}",
+                    extra={'category': 'Scoring'})
+        log_turn_metrics(scoring_metrics)
+    st.session_state.pending_scores = remaining
+    if len(remaining) != len(pending):
+        persist_session()
+
 # --- ページ設定 ---
 st.set_page_config(
     page_title="メンターAI",
@@ -73,11 +347,9 @@ st.set_page_config(
 )
 
 # --- セッション状態の初期化 ---
-if "messages" not in st.session_state:
-    st.session_state.messages = []
-
-if "gemini_history" not in st.session_state:
-    st.session_state.gemini_history = []
+# 会話記録 (UI表示用の履歴とGemini用の履歴は、ここから作るビュー)
+if "transcript" not in st.session_state:
+    st.session_state.transcript = Transcript()
 
 if "is_started" not in st.session_state:
     st.session_state.is_started = False
@@ -87,6 +359,21 @@ if "is_finished" not in st.session_state:
 
 if "module_scores" not in st.session_state:
     st.session_state.module_scores = []
+if "background_scores" not in st.session_state:
+    st.session_state.background_scores = []
+
+# 採点待ちの Future (プロセス内のみ。セッションの保存対象には含めない)
+if "pending_scores" not in st.session_state:
+    st.session_state.pending_scores = []
+
+if "meter" not in st.session_state:
+    st.session_state.meter = SessionMeter(secrets.token_hex(8), session_token_budget)
+
+# URLに再開コードがあれば、保存済みのセッションを1回の読み込みで復元する (ウィジェット作成前に行う)
+if session_store is not None and "session_token" not in st.session_state:
+    resume_token = st.query_params.get("session")
+    if not (resume_token and restore_session(resume_token)):
+        st.session_state.session_token = None
 
 # --- サイドバー: ユーザー設定 ---
 with st.sidebar:
@@ -95,36 +382,67 @@ with st.sidebar:
         st.session_state.user_name = ""
     st.text_input("お名前（ニックネーム可）", key="user_name", disabled=st.session_state.is_started)
 
+    if session_store is not None:
+        if st.session_state.session_token:
+            st.caption("再開コード (ページを閉じても、このコードで続きから再開できます)")
+            st.code(st.session_state.session_token, language=None)
+        elif not st.session_state.is_started:
+            st.text_input("再開コード（お持ちの場合）", key="resume_code")
+            # ウィジェットの値 (お名前など) を書き換えるため、再実行前に呼ばれるコールバックで復元する
+            st.button("続きから再開する", on_click=resume_from_code)
+            if st.session_state.get("resume_failed"):
+                st.warning("再開コードに一致するセッションが見つかりませんでした。")
+
+    # デバッグモードでは、プロセス内で集計したメトリクス (ヒストグラム) を表示する
+    if debug_mode:
+        with st.expander("📈 メトリクス (プロセス全体)"):
+            st.dataframe([{"metric": name, **summary} for name, summary in metrics_registry.snapshot().items()],
+                         use_container_width=True, hide_index=True)
+            st.code(metrics_registry.render_text(), language=None)
+        with st.expander("🪙 トークン使用量"):
+            meter = st.session_state.meter
+            st.caption(f"このセッション: {meter.total_tokens:,} tokens / 予算 {meter.budget_tokens or '-'}"
+                       f" / 推定コスト ${meter.cost(usage_registry.pricing):.4f}")
+            st.dataframe(usage_registry.snapshot(), use_container_width=True, hide_index=True)
+
 # --- メイン画面 ---
 st.title("🌱 メンター型アセスメント")
 st.markdown("あなたの強みと補完すべき能力を診断します。対話するように回答してください。")
 
 # --- Secrets/Configの読み込み ---
-api_key = st.secrets.get("GEMINI_API_KEY")
-model_name = st.secrets.get("GEMINI_MODEL")
-
-if api_key and model_name:
-    if os.environ.get("STREAMLIT_SERVER_RUNNING_IN_CLOUD"):
-        logger.debug("Secrets loaded from Streamlit Cloud Secrets.", extra={'category': 'System'})
-    else:
-        logger.debug("Secrets loaded from local .streamlit/secrets.toml.", extra={'category': 'System'})
-else:
-    logger.warning("Secrets not fully loaded from st.secrets. Attempting fallback to environment variables.")
-    api_key = os.getenv("GEMINI_API_KEY")
-    model_name = os.getenv("GEMINI_MODEL")
+# 設定値はプロセス内で変わらないため、再実行のたびに読み直さない
+@st.cache_resource(show_spinner=False)
+def load_model_config():
+    api_key = st.secrets.get("GEMINI_API_KEY")
+    model_name = st.secrets.get("GEMINI_MODEL")
 
     if api_key and model_name:
-        logger.debug("Secrets loaded from environment variables.", extra={'category': 'System'})
-    else:
-        if not debug_mode:
-            error_message = "APIキーまたはモデル名が設定されていません。st.secretsまたは環境変数を確認してください。"
-            logger.error(error_message)
-            st.error(f"{error_message}")
-            st.stop()
+        if os.environ.get("STREAMLIT_SERVER_RUNNING_IN_CLOUD"):
+            logger.debug("Secrets loaded from Streamlit Cloud Secrets.", extra={'category': 'System'})
         else:
-            logger.warning("Debug mode: API Key and Model Name not loaded, proceeding with mock values.")
-            api_key = "mock_api_key_for_debug"
-            model_name = "mock_gemini_model_for_debug"
+            logger.debug("Secrets loaded from local .streamlit/secrets.toml.", extra={'category': 'System'})
+    else:
+        logger.warning("Secrets not fully loaded from st.secrets. Attempting fallback to environment variables.")
+        api_key = os.getenv("GEMINI_API_KEY")
+        model_name = os.getenv("GEMINI_MODEL")
+
+        if api_key and model_name:
+            logger.debug("Secrets loaded from environment variables.", extra={'category': 'System'})
+    return api_key, model_name
+
+api_key, model_name = load_model_config()
+
+if not (api_key and model_name):
+    # モック・再生バックエンドはAPIキーを使わない
+    if not debug_mode and llm_backend in (BACKEND_GEMINI, BACKEND_RECORD):
+        error_message = "APIキーまたはモデル名が設定されていません。st.secretsまたは環境変数を確認してください。"
+        logger.error(error_message)
+        st.error(f"{error_message}")
+        st.stop()
+    else:
+        logger.warning(f"{llm_backend} backend: API Key and Model Name not loaded, proceeding with mock values.")
+        api_key = "mock_api_key_for_debug"
+        model_name = "mock_gemini_model_for_debug"
 
 # --- 開始ボタンの表示 ---
 if not st.session_state.is_started:
@@ -134,219 +452,285 @@ if not st.session_state.is_started:
             st.warning("お名前を入力してください。")
         else:
             st.session_state.is_started = True
+            if session_store is not None:
+                st.session_state.session_token = new_token()
+                st.query_params["session"] = st.session_state.session_token
             st.rerun()
 
 # --- チャットロジック (開始後のみ実行) ---
 if st.session_state.is_started:
     # 初回起動時（メッセージ履歴が空の場合）の処理
-    if not st.session_state.messages:
+    transcript = st.session_state.transcript
+
+    if not len(transcript):
         try:
             logger.info(f"Starting new session Username:{st.session_state.user_name}.", extra={'category': 'System'})
             
-            initial_prompt = f"ユーザーの{st.session_state.user_name}さんが参加しました。アセスメントを開始してください。"
-
-            if not debug_mode:
-                # クライアントを都度作成（ステートレス動作）
-                client = GeminiClient(api_key=api_key, model_name=model_name)
-                # 履歴なしでチャット開始
-                chat = client.start_chat(history=[])
-                # 初期プロンプト送信
-                initial_response = client.send_message(chat, initial_prompt)
-                
-                # Gemini用の履歴を保存 (辞書形式)
-                st.session_state.gemini_history.append({"role": "user", "parts": [{"text": initial_prompt}]})
-                st.session_state.gemini_history.append({"role": "model", "parts": [{"text": initial_response.text}]})
-                
-                initial_text = initial_response.text
+            initial_prompt = opening_prompt(st.session_state.user_name)
+            turn_metrics = {"turn": "initial"}
+            system_instruction = current_system_prompt()
+            opening_key = cache_key(llm_backend, model_name, system_instruction)
+            initial_text = opening_cache.get(opening_key, st.session_state.user_name) if opening_cache_enabled else None
+
+            if initial_text is not None:
+                # 事前に生成した導入文に名前を差し込む (Gemini の呼び出しなし)
+                turn_metrics["opening_cache"] = "hit"
+                with timer("post_process_ms", turn_metrics):
+                    # 開始時の指示はGeminiにのみ渡し、画面には表示しない (履歴は生成した場合と同じ形になる)
+                    transcript.append_user(initial_prompt, visible=False)
+                    transcript.append(TranscriptRecord.parse("assistant", initial_text))
+                    persist_session()
             else:
-                initial_text = f"デバッグモードで起動しました。アセスメントを開始します。(起動時刻: {datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')})"
-            
-            # UI用履歴に追加 (Timestamp付き)
-            st.session_state.messages.append({
-                "role": "assistant", 
-                "content": initial_text,
-                "timestamp": datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            })
+                # 表示は履歴の描画に任せるため、ストリーミング中だけ一時的な枠に表示する
+                opening_area = st.empty()
+                with opening_area.container(), st.chat_message("assistant", avatar="🌱"):
+                    response_placeholder = st.empty()
+                    response_placeholder.markdown("🌀 準備中...")
+                    # Geminiの場合はプロセス共有プールのクライアント（コネクションを再利用）
+                    with timer("client_setup_ms", turn_metrics):
+                        backend = get_backend(on_wait=queue_notice(response_placeholder))
+                    # 履歴なしでチャット開始
+                    with timer("chat_restore_ms", turn_metrics):
+                        chat = backend.start_chat(history=[], system_instruction=system_instruction)
+                    observe("system_prompt_bytes", len(system_instruction.encode("utf-8")), turn_metrics)
+
+                    stream_started = time.perf_counter()
+                    parser = StreamingTagParser()
+                    renderer = ThrottledRenderer(response_placeholder)
+                    usage_chunk = None
+                    for chunk in backend.send_message(chat, initial_prompt, stream=True):
+                        if "ttft_ms" not in turn_metrics:
+                            observe("ttft_ms", round((time.perf_counter() - stream_started) * 1000, 2), turn_metrics)
+                        if getattr(chunk, "usage_metadata", None) is not None:
+                            usage_chunk = chunk
+                        renderer.update(parser, parser.feed(chunk.text))
+                    parser.finish()
+                    observe("stream_ms", round((time.perf_counter() - stream_started) * 1000, 2), turn_metrics)
+                if usage_chunk is not None:
+                    record_usage(usage_chunk, turn_metrics)
+                with timer("post_process_ms", turn_metrics):
+                    transcript.append_user(initial_prompt, visible=False)
+                    transcript.append_assistant(parser)
+                    persist_session()
+                opening_area.empty()
+                initial_text = transcript.last.raw
+                if opening_cache_enabled:
+                    turn_metrics["opening_cache"] = "miss"
+                    refresh_opening_cache(opening_key, system_instruction)
+            observe("response_bytes", len(initial_text.encode("utf-8")), turn_metrics)
             logger.info(initial_text, extra={'category': 'AI'})
+            log_turn_metrics(turn_metrics)
             
         except Exception as e:
             logger.error(f"モデルのセットアップ中にエラーが発生しました: {e}", exc_info=True)
             st.error(f"初期化エラーが発生しました。詳細はログを確認してください。")
             st.stop()
 
+    apply_finished_scores()
+
     # 履歴から終了判定を更新 (リロード対策)
-    if st.session_state.messages:
-        last_msg = st.session_state.messages[-1]
-        if last_msg["role"] == "assistant" and "[[END_OF_ASSESSMENT]]" in last_msg.get("content", ""):
-            st.session_state.is_finished = True
-
-    # チャット履歴の表示
-    for msg in st.session_state.messages:
-        avatar = "🌱" if msg["role"] == "assistant" else None
-        with st.chat_message(msg["role"], avatar=avatar):
-            st.markdown(msg["content"])
-
-    # ユーザー入力エリア
-    if prompt := st.chat_input("回答を入力してください...", disabled=st.session_state.is_finished):
-        current_time = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        with st.chat_message("user"):
-            st.markdown(prompt)
-        
-        # ユーザーメッセージ保存
-        st.session_state.messages.append({
-            "role": "user", 
-            "content": prompt,
-            "timestamp": current_time
-        })
-
-        # AIの応答を生成
+    last_record = transcript.last
+    if last_record is not None and last_record.role == "assistant" and "[[END_OF_ASSESSMENT]]" in last_record.raw:
+        st.session_state.is_finished = True
+
+    # チャット履歴の表示 (フルランの時のみ。応答のストリーミングと描画はフラグメント内で行う)
+    for record in transcript.messages():
+        render_message(record)
+    st.session_state.rendered_count = len(transcript)
+
+    @fragment
+    def live_turn():
+        # 回答の送信はフラグメントだけの再実行になり、履歴全体は描き直さない
+        fragment_started = time.perf_counter()
+        render_stats["bytes_sent"] = 0
+        apply_finished_scores()
         try:
-            with st.chat_message("assistant", avatar="🌱"):
-                response_placeholder = st.empty()
-                response_placeholder.markdown("🌀 分析中...")
-                
-                if debug_mode:
-                    def mock_response_generator():
-                        import time
-                        # Simple state tracking based on message count
-                        user_msg_count = len([m for m in st.session_state.messages if m["role"] == "user"])
-                        
-                        if user_msg_count < 3:
-                            mock_text = f"【Debug Mode】 Mock Response {user_msg_count}\n\nThis is a dummy response for testing. (Message {user_msg_count}/3)\n\n[[SCORE:7]]\n[[RATIONALE:Dummy rationale for step {user_msg_count}.]]"
-                        else:
-                            mock_text = f"【Debug Mode】 Assessment Complete.\n\nHere is the comprehensive feedback...\n\n1. Type: Debugger\n2. Analysis: ...\n\n[[SCORE:9]]\n[[RATIONALE:Final dummy rationale.]]\n\n[[END_OF_ASSESSMENT]]"
-                        
-                        time.sleep(0.5)
-                        class MockChunk:
-                            def __init__(self, text):
-                                self.text = text
-                        yield MockChunk(text=mock_text)
-                    response = mock_response_generator()
-                    full_text = ""
-                    for chunk in response:
-                        if chunk.text:
-                            full_text += chunk.text
-                        response_placeholder.markdown(full_text + "▌")
-                    # Debug mode also needs to handle the final clean up for display
-                    # response_placeholder.markdown(full_text) -> Will be overwritten by cleaned text below
-                else:
-                    # ステートレス: クライアント作成と履歴復元
-                    client = GeminiClient(api_key=api_key, model_name=model_name)
-                    chat = client.start_chat(history=st.session_state.gemini_history)
-                    
-                    response = client.send_message(chat, prompt, stream=True)
-                
-                    full_text = ""
-                    for chunk in response:
-                        if chunk.text:
-                            full_text += chunk.text
-                        response_placeholder.markdown(full_text + "▌")
-                    
-                # --- Post-Processing for Score & Rationale Tags ---
-                
-                # Regex patterns
-                score_pattern = re.compile(r"\[\[SCORE:(\d+)\]\]")
-                rationale_pattern = re.compile(r"\[\[RATIONALE:.*?\]\]", re.DOTALL)
-                
-                # 1. Extract and Remove Score
-                match = score_pattern.search(full_text)
-                if match:
-                    score = int(match.group(1))
-                    st.session_state.module_scores.append(score)
-                    logger.info(f"Score extracted: {score}", extra={'category': 'Scoring'})
-                
-                # 2. Create "Cleaned" text for Display (Remove Score AND Rationale tags)
-                cleaned_text = score_pattern.sub("", full_text)
-                cleaned_text = rationale_pattern.sub("", cleaned_text).strip()
-                
-                # Update Placeholder with cleaned text
-                response_placeholder.markdown(cleaned_text)
-
-                # Gemini履歴の更新 (辞書形式) - AI needs to remember what it generated (Raw text)
-                st.session_state.gemini_history.append({"role": "user", "parts": [{"text": prompt}]})
-                st.session_state.gemini_history.append({"role": "model", "parts": [{"text": full_text}]})
-
-            # Save to Session State (Keep Raw Content for Log)
-            st.session_state.messages.append({
-                "role": "assistant", 
-                "content": cleaned_text, 
-                "raw_content": full_text, # Contains [[SCORE]] and [[RATIONALE]]
-                "timestamp": datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            })
-            
-            # --- 構造化ログ出力 ---
-            logger.info(prompt, extra={'category': 'User'})
-            logger.info(full_text, extra={'category': 'AI'}) # Log raw text
-            
-            # 終了判定
-            if "[[END_OF_ASSESSMENT]]" in full_text:
-                st.session_state.is_finished = True
-                st.rerun()
-
-        except Exception as e:
-            logger.error(f"AIの応答生成中にエラーが発生しました (User: {st.session_state.user_name}): {e}", exc_info=True)
-            st.error("AIの応答生成中にエラーが発生しました。もう一度お試しください。")
+            # 前回のフルラン以降に追加されたメッセージだけを描画する
+            for record in transcript.records[st.session_state.rendered_count:]:
+                if record.visible:
+                    render_message(record)
+
+            # ユーザー入力エリア。フラグメントの中ではレイアウトのブロックの下になり画面下部に固定されないため、
+            # 下部のコンテナ (st.bottom) に置いて固定する
+            with st.bottom:
+                prompt = st.chat_input("回答を入力してください...", disabled=st.session_state.is_finished)
+
+            if prompt:
+                if st.session_state.meter.over_budget:
+                    logger.warning(f"Token budget exceeded: {st.session_state.meter.total_tokens}", extra={'category': 'Metering'})
+                    st.error("このセッションで利用できるAIの使用量の上限に達しました。管理者にお問い合わせください。")
+                    return
+                with st.chat_message("user"):
+                    render_markdown(prompt)
+
+                # ユーザーメッセージ保存 (Gemini送信用の履歴はこの発言を含めずに作る)
+                turn_metrics = {"turn": transcript.user_turns() + 1}
+                history = transcript.gemini_history()
+                user_record = transcript.append_user(prompt)
+
+                # AIの応答を生成
+                try:
+                    with st.chat_message("assistant", avatar="🌱"):
+                        response_placeholder = st.empty()
+                        response_placeholder.markdown("🌀 分析中...")
+
+                        # ステートレス: バックエンドを取得し、履歴を復元
+                        with timer("client_setup_ms", turn_metrics):
+                            backend = get_backend(on_wait=queue_notice(response_placeholder))
+                        # 完了済みモジュールは要約に置き換えて送信する (会話記録自体は全文を保持)
+                        with timer("chat_restore_ms", turn_metrics):
+                            sent_history = compact_history(history, compaction_config)
+                            system_instruction = current_system_prompt()
+                            chat = backend.start_chat(history=sent_history, system_instruction=system_instruction)
+                        observe("history_messages", len(sent_history), turn_metrics)
+                        observe("history_bytes", sum(
+                            len(part.get("text", "").encode("utf-8"))
+                            for item in sent_history for part in item["parts"]), turn_metrics)
+                        observe("system_prompt_bytes", len(system_instruction.encode("utf-8")), turn_metrics)
+                        observe("prompt_bytes", len(prompt.encode("utf-8")), turn_metrics)
+
+                        stream_started = time.perf_counter()
+                        response = backend.send_message(chat, prompt, stream=True)
+
+                        # --- ストリーミング表示 ---
+                        # タグはチャンク到着時点で取り除き、描画は一定間隔に間引く
+                        parser = StreamingTagParser()
+                        renderer = ThrottledRenderer(response_placeholder)
+                        first_chunk_at = None
+                        usage_chunk = None
+                        scoring = None
+                        for chunk in response:
+                            if first_chunk_at is None:
+                                first_chunk_at = time.perf_counter()
+                                observe("ttft_ms", round((first_chunk_at - stream_started) * 1000, 2), turn_metrics)
+                            # 使用量は最後のチャンクに累計で入っている
+                            if getattr(chunk, "usage_metadata", None) is not None:
+                                usage_chunk = chunk
+                            renderer.update(parser, parser.feed(chunk.text))
+                            if background_scoring_enabled and parser.scores and scoring is None:
+                                # [[SCORE]] が出た時点で、応答の残りと並行して項目別の採点を始める
+                                score_index = len(st.session_state.module_scores)
+                                scoring = background_scoring.submit(
+                                    get_backend(),
+                                    record_index=len(transcript),
+                                    score_index=score_index,
+                                    stage=current_stage(score_index),
+                                    dialogue=background_scoring.module_dialogue(
+                                        transcript.records, len(transcript) - 1, current_stage(score_index)),
+                                )
+                        stream_ended = time.perf_counter()
+                        observe("stream_ms", round((stream_ended - stream_started) * 1000, 2), turn_metrics)
+                        if usage_chunk is not None:
+                            record_usage(usage_chunk, turn_metrics)
+                        output_tokens = turn_metrics.get("usage", {}).get("output_tokens")
+                        if first_chunk_at is not None and stream_ended > first_chunk_at and output_tokens:
+                            observe("tokens_per_s", round(output_tokens / (stream_ended - first_chunk_at), 2), turn_metrics)
+
+                        parser.finish()
+
+                        # --- Post-Processing for Score & Rationale Tags ---
+                        if parser.score is not None:
+                            score = parser.score
+                            st.session_state.module_scores.append(score)
+                            logger.info(f"Score extracted: {score}", extra={'category': 'Scoring'})
+
+                        # Update Placeholder with cleaned text
+                        renderer.finish(parser.clean_text)
+                        render_stats["bytes_sent"] += renderer.bytes_sent
+
+                    # Save to Session State (Raw text, score and rationale are parsed once here)
+                    record = transcript.append_assistant(parser)
+                    full_text = record.raw
+
+                    if scoring is not None:
+                        # 採点結果は完了後の再実行時に記録と background_scores に反映する
+                        st.session_state.pending_scores.append(scoring)
+
+                    # 終了判定
+                    if "[[END_OF_ASSESSMENT]]" in full_text:
+                        st.session_state.is_finished = True
+                    persist_session()
+                    observe("post_process_ms", round((time.perf_counter() - stream_ended) * 1000, 2), turn_metrics)
+                    observe("response_bytes", len(full_text.encode("utf-8")), turn_metrics)
+                    observe("render_count", renderer.render_count, turn_metrics)
+
+                    # --- 構造化ログ出力 ---
+                    logger.info(prompt, extra={'category': 'User'})
+                    logger.info(full_text, extra={'category': 'AI'}) # Log raw text
+                    log_turn_metrics(turn_metrics)
+
+                    if st.session_state.is_finished:
+                        st.rerun()
+
+                except Exception as e:
+                    # 失敗したターンは履歴に残さない (Gemini用の履歴で user が連続しないように)
+                    if transcript.last is user_record:
+                        transcript.records.pop()
+                    logger.error(f"AIの応答生成中にエラーが発生しました (User: {st.session_state.user_name}): {e}", exc_info=True)
+                    st.error("AIの応答生成中にエラーが発生しました。もう一度お試しください。")
+                    # 再入力しなくて済むように、送信した回答を表示しておく
+                    st.caption("送信した回答 (コピーして再送信できます)")
+                    st.code(prompt, language=None)
+        finally:
+            log_render_metrics("fragment", fragment_started)
+
+    live_turn()
 
     # --- アセスメント終了判定とログダウンロード ---
     if st.session_state.is_finished:
         st.success("アセスメントが終了しました。お疲れ様でした！")
         st.markdown("以下のボタンから、ここまでの対話ログをダウンロードできます。")
+
+        # バックグラウンド採点が残っていれば、結果が揃ってからログ・採点結果を出す
+        if st.session_state.pending_scores:
+            with st.spinner("採点結果を集計しています..."):
+                apply_finished_scores(wait=True)
+
+        cohort = get_cohort_engine(*cohort_settings) if cohort_enabled else None
+        if cohort is not None and not st.session_state.get("cohort_recorded"):
+            # 1セッションにつき1回だけコホートに加える (順位の集計は次回の更新時に反映される)
+            cohort.record(st.session_state.module_scores)
+            st.session_state.cohort_recorded = True
+            persist_session()
         
-        # CSV生成
-        import csv
-        import io
-        
-        csv_buffer = io.StringIO()
-        writer = csv.writer(csv_buffer)
-        # Add Timestamp to Header, separate Score and Rationale
-        writer.writerow(["Timestamp", "Role", "Content", "Score", "Hidden Rationale"])
-        
-        # Regex for extraction (re-defined here to ensure scope access)
-        csv_score_pattern = re.compile(r"\[\[SCORE:(\d+)\]\]")
-        csv_rationale_tag_pattern = re.compile(r"\[\[RATIONALE:(.*?)\]\]", re.DOTALL) # Capture content inside
-        csv_rationale_remove_pattern = re.compile(r"\[\[RATIONALE:.*?\]\]", re.DOTALL) # Match full tag for removal
-
-        for msg in st.session_state.messages:
-            timestamp = msg.get("timestamp", "")
-            role = msg["role"]
-            raw_text = msg.get("raw_content", msg["content"])
-            
-            # Extract Score
-            score = ""
-            s_match = csv_score_pattern.search(raw_text)
-            if s_match:
-                score = s_match.group(1)
-            
-            # Extract Rationale
-            rationale = ""
-            r_match = csv_rationale_tag_pattern.search(raw_text)
-            if r_match:
-                rationale = r_match.group(1).strip()
-            
-            # Clean Content (Remove Score and Rationale tags)
-            clean_text = csv_score_pattern.sub("", raw_text)
-            clean_text = csv_rationale_remove_pattern.sub("", clean_text).strip()
-            
-            writer.writerow([timestamp, role, clean_text, score, rationale])
-        
-        csv_data = csv_buffer.getvalue().encode("shift_jis", "ignore")
-        
+        # ログはダウンロードボタンが押されたときだけ生成する (再実行のたびに作らず、セッションにも保持しない)
+        export_format = st.radio(
+            "ログの形式",
+            list(EXPORT_FORMATS),
+            format_func=lambda key: EXPORT_FORMATS[key][0],
+            horizontal=True,
+        )
+        label, mime, extension, _ = EXPORT_FORMATS[export_format]
+        # data に関数を渡すと、クリック時に別スレッドで呼ばれる (その時点の記録の一覧を渡しておく)。
+        # 内容は読み出すときに生成されるため、読み出しまでを形式ごとの所要時間として記録する
+        export_records = list(transcript.records)
+        export_data = timed(f"export_{export_format}_ms")(lambda: export_stream(export_records, export_format).read())
         st.download_button(
-            label="対話ログをダウンロード (CSV)",
-            data=csv_data,
-            file_name=f"assessment_log_{st.session_state.user_name}_{datetime.datetime.now().strftime('%Y%m%d_%H%M%S')}.csv",
-            mime="text/csv; charset=shift_jis"
+            label=f"対話ログをダウンロード ({label})",
+            data=export_data,
+            file_name=f"assessment_log_{st.session_state.user_name}_{datetime.datetime.now().strftime('%Y%m%d_%H%M%S')}.{extension}",
+            mime=mime
         )
 
         if st.button("採点結果を見る"):
             st.subheader("アセスメント採点結果")
-            if st.session_state.module_scores:
-                total_score = 0
-                for i, score in enumerate(st.session_state.module_scores):
-                    st.markdown(f"**Module {i+1}**: {score}点/10点")
-                    total_score += score
-                
-                average_score = total_score / len(st.session_state.module_scores)
-                st.markdown(f"**平均スコア**: {average_score:.2f}点/10点")
+            scores = st.session_state.module_scores
+            if scores:
+                background_scores = st.session_state.background_scores
+                for i, score in enumerate(scores):
+                    detail = background_scores[i] if i < len(background_scores) else None
+                    detail_note = f" (詳細採点: {detail}点)" if detail is not None and detail != score else ""
+                    st.markdown(f"**Module {i+1}**: {score}点/10点{detail_note}{cohort_note(cohort, i, score)}")
+
+                average_score = sum(scores) / len(scores)
+                average_note = ""
+                if cohort is not None:
+                    from modules.cohort import AVERAGE_COLUMN
+                    average_note = cohort_note(cohort, AVERAGE_COLUMN, average_score)
+                st.markdown(f"**平均スコア**: {average_score:.2f}点/10点{average_note}")
             else:
                 st.info("まだ採点結果はありません。")
+
+log_render_metrics("app", script_started)
+
+start_optional_sinks()
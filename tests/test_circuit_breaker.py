@@ -0,0 +1,93 @@
+import pytest
+
+from modules.gemini_client import CircuitBreaker, CircuitOpenError
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self):
+        return self.now
+
+
+def open_breaker(breaker):
+    for _ in range(breaker.failure_threshold):
+        breaker.before_call()
+        breaker.record_failure()
+
+
+def test_opens_after_threshold_and_rejects():
+    clock = FakeClock()
+    breaker = CircuitBreaker(failure_threshold=3, recovery_time=30.0, clock=clock)
+    breaker.record_failure()
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.CLOSED
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+
+    clock.now += 29.9
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+    assert breaker.rejected == 1
+
+
+def test_success_resets_failure_count():
+    breaker = CircuitBreaker(failure_threshold=3, clock=FakeClock())
+    breaker.record_failure()
+    breaker.record_failure()
+    breaker.record_success()
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.CLOSED
+
+
+def test_half_open_allows_one_trial():
+    clock = FakeClock()
+    breaker = CircuitBreaker(failure_threshold=2, recovery_time=30.0, clock=clock)
+    open_breaker(breaker)
+    clock.now += 30.0
+    breaker.before_call()
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    # 試行中は他の呼び出しを通さない
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+
+
+def test_half_open_success_closes():
+    clock = FakeClock()
+    breaker = CircuitBreaker(failure_threshold=2, recovery_time=30.0, clock=clock)
+    open_breaker(breaker)
+    clock.now += 30.0
+    breaker.before_call()
+    breaker.record_success()
+    assert breaker.state == CircuitBreaker.CLOSED
+    breaker.before_call()
+
+
+def test_half_open_failure_reopens_for_a_full_period():
+    clock = FakeClock()
+    breaker = CircuitBreaker(failure_threshold=2, recovery_time=30.0, clock=clock)
+    open_breaker(breaker)
+    clock.now += 30.0
+    breaker.before_call()
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+    clock.now += 29.0
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+    clock.now += 1.0
+    breaker.before_call()
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+
+
+def test_release_frees_the_trial_slot():
+    clock = FakeClock()
+    breaker = CircuitBreaker(failure_threshold=2, recovery_time=30.0, clock=clock)
+    open_breaker(breaker)
+    clock.now += 30.0
+    breaker.before_call()
+    # 結果が分からないまま終わった試行の後は、次の呼び出しがすぐ新しい試行になる
+    breaker.release()
+    assert breaker.state == CircuitBreaker.OPEN
+    breaker.before_call()
+    assert breaker.state == CircuitBreaker.HALF_OPEN
@@ -0,0 +1,75 @@
+import threading
+
+from modules.opening_cache import RETRY_AFTER_FAILURE, InvalidTemplate, OpeningCache
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def fill(cache, key, generate):
+    """refresh() のスレッドが終わるまで待ち、(開始したか, on_error の引数) を返す"""
+    errors = []
+    done = threading.Event()
+
+    def wrapped():
+        try:
+            return generate()
+        finally:
+            done.set()
+
+    started = cache.refresh(key, wrapped, on_error=lambda e, delay: errors.append((e, delay)))
+    if started:
+        done.wait(5)
+        for _ in range(500):
+            if key not in cache._refreshing:
+                break
+            threading.Event().wait(0.01)
+    return started, errors
+
+
+def test_rejected_template_backs_off_until_expiry():
+    clock = FakeClock()
+    cache = OpeningCache(clock=clock)
+    calls = []
+
+    def generate():
+        calls.append(1)
+        return "名前の呼びかけがない導入文"
+
+    started, errors = fill(cache, "k", generate)
+    assert started and isinstance(errors[0][0], InvalidTemplate)
+    assert errors[0][1] == RETRY_AFTER_FAILURE
+    assert cache.rejected == 1
+
+    # 控えている間は生成しない
+    assert fill(cache, "k", generate) == (False, [])
+    assert len(calls) == 1
+
+    # 期限を過ぎたら作り直し、続けて失敗すると待機時間が倍になる
+    clock.now = RETRY_AFTER_FAILURE
+    started, errors = fill(cache, "k", generate)
+    assert started and errors[0][1] == RETRY_AFTER_FAILURE * 2
+
+
+def test_success_clears_backoff_and_serves_template():
+    clock = FakeClock()
+    cache = OpeningCache(clock=clock)
+    fill(cache, "k", lambda: "")
+    clock.now = RETRY_AFTER_FAILURE
+    started, errors = fill(cache, "k", lambda: "USER_NAMEさん、ようこそ。")
+    assert started and errors == []
+    assert cache.get("k", "太郎") == "太郎さん、ようこそ。"
+    assert "k" not in cache._failures
+
+
+def test_one_fill_in_flight_per_key():
+    cache = OpeningCache()
+    release = threading.Event()
+    assert cache.refresh("k", lambda: release.wait(5) and "USER_NAMEさん")
+    assert not cache.refresh("k", lambda: "USER_NAMEさん")
+    release.set()
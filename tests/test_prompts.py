@@ -0,0 +1,23 @@
+import pytest
+
+from modules.prompts import (FINAL_STAGE, MODULE_COUNT, PROMPT_SECTIONS, SYSTEM_PROMPT,
+                             build_system_prompt)
+
+
+@pytest.mark.parametrize("stage", range(1, FINAL_STAGE + 1))
+def test_scoped_prompt_is_not_larger_than_full_prompt(stage):
+    assert len(build_system_prompt(stage)) <= len(SYSTEM_PROMPT)
+
+
+def test_early_stages_are_smaller_than_full_prompt():
+    for stage in range(1, MODULE_COUNT):
+        assert len(build_system_prompt(stage)) < len(SYSTEM_PROMPT)
+
+
+def test_final_stage_sends_full_prompt():
+    # 総合フィードバックでは全セクションが必要なため、組み立て直さず全文をそのまま送る
+    prompt = build_system_prompt(FINAL_STAGE)
+    assert prompt == SYSTEM_PROMPT
+    for module in range(1, MODULE_COUNT + 1):
+        assert PROMPT_SECTIONS["modules"][module] in prompt
+    assert PROMPT_SECTIONS["final"] in prompt
@@ -0,0 +1,106 @@
+import threading
+import time
+
+from modules.rate_limiter import AdmissionController, TokenBucket
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def wait_until(condition, timeout: float = 5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "condition not met"
+        time.sleep(0.005)
+
+
+def test_token_bucket_adjust_refunds_overestimate():
+    clock = FakeClock()
+    bucket = TokenBucket(600, capacity=100, clock=clock)
+    bucket.take(80, clock())
+    assert bucket.tokens == 20
+    # 見込み 80 に対して実際は 30 だった → 50 を返す
+    bucket.adjust(30 - 80)
+    assert bucket.tokens == 70
+    # 返却しても容量は超えない
+    bucket.adjust(-1000)
+    assert bucket.tokens == 100
+
+
+def test_token_bucket_adjust_charges_underestimate():
+    clock = FakeClock()
+    bucket = TokenBucket(600, capacity=100, clock=clock)
+    bucket.take(50, clock())
+    bucket.adjust(120 - 50)
+    assert bucket.tokens == -20
+    assert bucket.wait_time(10, clock()) == 30 / bucket.rate
+
+
+def test_release_refunds_actual_usage():
+    clock = FakeClock()
+    controller = AdmissionController(tokens_per_minute=1000, burst_fraction=0.1, clock=clock)
+    ticket = controller.acquire(tokens=100)
+    assert controller.tpm.tokens == 0
+    ticket.actual_tokens = 40
+    controller.release(ticket)
+    assert controller.tpm.tokens == 60
+
+
+def test_acquire_is_fifo_without_overtaking():
+    clock = FakeClock()
+    controller = AdmissionController(max_concurrent=10, tokens_per_minute=1000, burst_fraction=0.1,
+                                     poll_interval=0.01, clock=clock)
+    # バースト分 (100) を使い切る
+    controller.release(controller.acquire(tokens=100))
+    controller.tpm.tokens = 0
+
+    admitted = []
+
+    def request(name, tokens):
+        ticket = controller.acquire(tokens=tokens)
+        admitted.append(name)
+        controller.release(ticket)
+
+    large = threading.Thread(target=request, args=("large", 50))
+    large.start()
+    wait_until(lambda: controller.queue_length == 1)
+    small = threading.Thread(target=request, args=("small", 1))
+    small.start()
+    wait_until(lambda: controller.queue_length == 2)
+
+    # 補充されないうちは、後から来た小さな要求も先頭を追い越さない
+    time.sleep(0.1)
+    assert admitted == []
+
+    clock.now += 60.0
+    large.join(5)
+    small.join(5)
+    assert admitted == ["large", "small"]
+
+
+def test_concurrency_limit_admits_in_arrival_order():
+    controller = AdmissionController(max_concurrent=1, poll_interval=0.01)
+    holder = controller.acquire()
+    admitted = []
+
+    def request(name):
+        ticket = controller.acquire()
+        admitted.append(name)
+        controller.release(ticket)
+
+    threads = []
+    for i, name in enumerate(("first", "second", "third")):
+        thread = threading.Thread(target=request, args=(name,))
+        thread.start()
+        wait_until(lambda: controller.queue_length == i + 1)
+        threads.append(thread)
+
+    controller.release(holder)
+    for thread in threads:
+        thread.join(5)
+    assert admitted == ["first", "second", "third"]
@@ -0,0 +1,134 @@
+import json
+import os
+import signal
+import subprocess
+import sys
+import textwrap
+
+from modules.session_store import SQLiteBackend, SessionStore
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class FlakyBackend:
+    """最初の fail_times 回の書き込みを失敗させるバックエンド"""
+    def __init__(self, fail_times: int):
+        self.fail_times = fail_times
+        self.values = {}
+
+    def get(self, key):
+        return self.values.get(key, (None, None))[0]
+
+    def revision(self, key):
+        return self.values.get(key, (None, None))[1]
+
+    def put(self, key, value, revision):
+        if self.fail_times > 0:
+            self.fail_times -= 1
+            raise ConnectionError("injected failure")
+        self.values[key] = (value, revision)
+
+    def delete(self, key):
+        self.values.pop(key, None)
+
+
+def run_child(code: str, db_path: str, terminate: bool = False):
+    # 最初の書き込みが遅いバックエンド。その間に保存したスナップショットは書き込み待ちのまま残る
+    script = textwrap.dedent(f"""
+        import time
+        from modules.session_store import SQLiteBackend, SessionStore
+
+        class SlowBackend(SQLiteBackend):
+            calls = 0
+
+            def put(self, key, value, revision):
+                SlowBackend.calls += 1
+                if SlowBackend.calls == 1:
+                    time.sleep(0.5)
+                super().put(key, value, revision)
+
+        store = SessionStore(SlowBackend({db_path!r}), flush_interval=3600)
+        store.save("token", {{"step": 1}})
+        time.sleep(0.1)
+    """) + textwrap.dedent(code)
+    process = subprocess.Popen([sys.executable, "-c", script], cwd=ROOT, stdout=subprocess.PIPE,
+                               stderr=subprocess.PIPE, text=True)
+    if terminate:
+        assert process.stdout.readline().strip() == "saved"
+        process.send_signal(signal.SIGTERM)
+    process.communicate(timeout=30)
+    return process.returncode
+
+
+def load(db_path: str, token: str):
+    store = SessionStore(SQLiteBackend(db_path))
+    try:
+        return store.load(token)
+    finally:
+        store.close()
+
+
+def test_pending_snapshot_is_flushed_at_exit(tmp_path):
+    db_path = str(tmp_path / "sessions.db")
+    # ワーカーが前の書き込みを終える前に通常終了する
+    code = """
+        store.save("token", {"step": 3})
+    """
+    assert run_child(code, db_path) == 0
+    assert load(db_path, "token")["step"] == 3
+
+
+def test_pending_snapshot_is_flushed_on_sigterm(tmp_path):
+    db_path = str(tmp_path / "sessions.db")
+    code = """
+        store.save("token", {"step": 5})
+        print("saved", flush=True)
+        time.sleep(30)
+    """
+    assert run_child(code, db_path, terminate=True) != 0
+    assert load(db_path, "token")["step"] == 5
+
+
+def test_failed_write_is_retried(tmp_path):
+    backend = FlakyBackend(fail_times=1)
+    store = SessionStore(backend, flush_interval=3600)
+    store.close()
+    store.save("token", {"step": 1})
+    store.flush()
+    assert backend.get("token") is None
+    store.flush()
+    assert json.loads(backend.get("token"))["step"] == 1
+
+
+def test_newer_save_wins_over_failed_retry():
+    backend = FlakyBackend(fail_times=1)
+    store = SessionStore(backend, flush_interval=3600)
+    store.close()
+    store.save("token", {"step": 1})
+    store.flush()
+    store.save("token", {"step": 2})
+    store.flush()
+    assert json.loads(backend.get("token"))["step"] == 2
+
+
+def test_session_survives_restart(tmp_path):
+    db_path = str(tmp_path / "sessions.db")
+    store = SessionStore(SQLiteBackend(db_path))
+    store.save("token", {"step": 7})
+    store.close()
+    # 別のプロセス (再起動後) から再開できる
+    assert load(db_path, "token")["step"] == 7
+
+
+def test_stale_cache_is_not_served_after_another_instance_saves(tmp_path):
+    db_path = str(tmp_path / "sessions.db")
+    a = SessionStore(SQLiteBackend(db_path))
+    b = SessionStore(SQLiteBackend(db_path))
+    a.save("token", {"step": 1})
+    a.flush()
+    assert b.load("token")["step"] == 1
+    b.save("token", {"step": 2})
+    b.flush()
+    assert a.load("token")["step"] == 2
+    a.close()
+    b.close()
@@ -0,0 +1,73 @@
+import re
+
+import pytest
+
+from modules.tag_parser import StreamingTagParser
+
+# 従来 (一括処理) の正規表現による除去。ストリーミングの結果はこれと一致するはず
+_SCORE = re.compile(r"\[\[SCORE:(\d+)\]\]")
+_RATIONALE = re.compile(r"\[\[RATIONALE:.*?\]\]", re.DOTALL)
+
+
+def baseline_clean(text: str) -> str:
+    return _RATIONALE.sub("", _SCORE.sub("", text)).strip()
+
+
+def parse(chunks):
+    parser = StreamingTagParser()
+    visible = "".join(parser.feed(chunk) for chunk in chunks)
+    visible += parser.finish()
+    return parser, visible
+
+
+SAMPLES = [
+    "良い回答です。\n[[SCORE:7]]\n[[RATIONALE: 【項目別評価】1.視点:4点]]\n次に進みますか？",
+    "[[[RATIONALE: secret]]表示する部分",
+    "a[[b]] [[SCORE:8]] c [[RATIONALE:x]y]] d",
+    "総合フィードバックです。\n[[SCORE:9]]\n[[RATIONALE: 総合]]\n\n[[END_OF_ASSESSMENT]]",
+]
+
+
+def test_extra_bracket_before_tag_does_not_leak_rationale():
+    parser, visible = parse(["[[[RATIONALE: secret]]"])
+    assert "secret" not in visible
+    assert "secret" not in parser.clean_text
+    assert parser.rationale == "secret"
+    assert visible == "["
+
+
+@pytest.mark.parametrize("text", SAMPLES)
+def test_tags_split_at_every_offset(text):
+    expected_parser, _ = parse([text])
+    assert expected_parser.clean_text == baseline_clean(text)
+    for offset in range(1, len(text)):
+        parser, visible = parse([text[:offset], text[offset:]])
+        assert parser.clean_text == expected_parser.clean_text, offset
+        assert parser.scores == expected_parser.scores, offset
+        assert parser.rationales == expected_parser.rationales, offset
+        assert parser.end_of_assessment == expected_parser.end_of_assessment, offset
+        assert parser.raw_text == text
+
+
+@pytest.mark.parametrize("text", SAMPLES)
+def test_one_character_chunks(text):
+    parser, _ = parse(list(text))
+    assert parser.clean_text == baseline_clean(text)
+
+
+def test_unclosed_rationale_is_hidden_at_finish():
+    parser, visible = parse(["本文です。\n[[RATIONALE: 途中で", "終わった根拠]"])
+    assert visible.strip() == "本文です。"
+    assert parser.rationale == "途中で終わった根拠"
+
+
+def test_unclosed_tag_head_is_shown_at_finish():
+    parser, visible = parse(["本文です。[[SCO"])
+    assert visible == "本文です。[[SCO"
+    assert parser.score is None
+
+
+def test_non_numeric_score_is_kept_visible():
+    parser, _ = parse(["[[SCORE:高い]]"])
+    assert parser.score is None
+    assert parser.clean_text == "[[SCORE:高い]]"
@@ -0,0 +1,55 @@
+import csv
+import io
+import re
+
+import pytest
+
+from modules.transcript import Transcript, TranscriptRecord, export_bytes, iter_csv
+
+_SCORE = re.compile(r"\[\[SCORE:(\d+)\]\]")
+_RATIONALE_TAG = re.compile(r"\[\[RATIONALE:(.*?)\]\]", re.DOTALL)
+
+
+def baseline_csv(messages, encoding: str) -> bytes:
+    """従来の CSV 生成 (全体を文字列で組み立ててから一括でエンコード)"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(["Timestamp", "Role", "Content", "Score", "Hidden Rationale"])
+    for timestamp, role, raw in messages:
+        match = _SCORE.search(raw)
+        score = match.group(1) if match else ""
+        match = _RATIONALE_TAG.search(raw)
+        rationale = match.group(1).strip() if match else ""
+        clean = _RATIONALE_TAG.sub("", _SCORE.sub("", raw)).strip()
+        writer.writerow([timestamp, role, clean, score, rationale])
+    return buffer.getvalue().encode(encoding, "ignore")
+
+
+MESSAGES = [
+    ("2026-01-01 10:00:00", "assistant", "ようこそ、太郎さん。\n最初の状況です。"),
+    ("2026-01-01 10:01:00", "user", "関係者に \"確認\" してから進めます, 丁寧に。"),
+    ("2026-01-01 10:02:00", "assistant", "良い回答です 🌱 ①\n[[SCORE:7]]\n[[RATIONALE: 【項目別評価】視点:4点]]\n次へ進みますか？"),
+]
+
+
+def make_transcript():
+    transcript = Transcript()
+    # 開始時の指示 (画面・ログに出さない発言) は出力されない
+    transcript.append_user("ユーザーの太郎さんが参加しました。", visible=False, timestamp="2026-01-01 09:59:59")
+    for timestamp, role, raw in MESSAGES:
+        transcript.append(TranscriptRecord.parse(role, raw, timestamp=timestamp))
+    return transcript
+
+
+@pytest.mark.parametrize("fmt, encoding", [("csv_sjis", "shift_jis"), ("csv_utf8", "utf-8-sig")])
+def test_csv_matches_baseline(fmt, encoding):
+    transcript = make_transcript()
+    expected = baseline_csv(MESSAGES, encoding)
+    assert b"".join(iter_csv(transcript.records, encoding)) == expected
+    assert export_bytes(transcript, fmt) == expected
+
+
+def test_utf8_csv_starts_with_single_bom():
+    data = b"".join(iter_csv(make_transcript().records, "utf-8-sig"))
+    assert data.startswith(b"\xef\xbb\xbf")
+    assert data.count(b"\xef\xbb\xbf") == 1